@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from accounts import signals  # noqa: F401
+        from accounts import metrics
+        from django.db.backends.signals import connection_created
+        from h4ev.database import configure_sqlite
+
+        # synchronous and cache pragmas on every new SQLite connection
+        connection_created.connect(configure_sqlite)
+
+        if metrics.enabled():
+            # time every SQL query of every connection as the "db" phase of the request
+            connection_created.connect(metrics.install_db_timer)
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import make_password
+
+from accounts.hashers import run_hashing, verify_password
+from h4ev import settings
+
+User = get_user_model()
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that checks passwords on the hashing process pool
+    (LOGIN_HASH_WORKERS), so the CPU-bound hashing does not hold the GIL
+    of the worker serving other requests. Outdated hashes are upgraded on
+    a successful login, as with ModelBackend.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        workers = settings.ACCOUNTS["LOGIN_HASH_WORKERS"]
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # hash anyway so the response time does not tell whether the username exists
+            run_hashing(make_password, password, workers=workers)
+            return None
+
+        correct, upgraded = run_hashing(verify_password, password, user.password, workers=workers)
+        if not correct:
+            return None
+        if upgraded:
+            user.password = upgraded
+            user.save(update_fields=["password"])
+        return user if self.user_can_authenticate(user) else None
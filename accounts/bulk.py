@@ -0,0 +1,164 @@
+"""
+Bulk user import for onboarding whole cohorts at once.
+
+Rows are validated with UserImportSerializer, passwords are hashed on a
+process pool (hashing is CPU bound, so threads would queue on the GIL)
+and users are inserted with bulk_create, one transaction per batch. Rows
+that fail are reported with their 1-based row number; the rest are
+imported.
+"""
+import csv
+import io
+import itertools
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from accounts.hashers import get_hash_pool
+from accounts.serializers import UserImportSerializer
+from h4ev import settings
+
+User = get_user_model()
+
+FORMATS = ("csv", "json", "ndjson")
+# file extensions that differ from their format name
+EXTENSIONS = {"jsonl": "ndjson"}
+
+
+def hash_passwords(passwords, workers=None) -> list:
+    workers = workers or settings.ACCOUNTS["IMPORT_HASH_WORKERS"]
+    if workers <= 1 or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(get_hash_pool(workers).map(make_password, passwords, chunksize=chunksize))
+
+
+def read_rows(stream, file_format):
+    """
+    User rows from a text stream: CSV with a header line, NDJSON (one user
+    object per line), or a JSON list (or {"users": [...]}). CSV and NDJSON
+    are read lazily; a JSON document is parsed whole.
+    """
+    if file_format == "csv":
+        return csv.DictReader(stream)
+    if file_format == "ndjson":
+        return (json.loads(line) for line in stream if line.strip())
+    data = json.load(stream)
+    if isinstance(data, dict):
+        data = data.get("users")
+    if not isinstance(data, list):
+        raise ValueError('expected a list of users or {"users": [...]}')
+    return data
+
+
+def rows_from_request(request):
+    """User rows from an import request body, JSON or text/csv"""
+    # DRF's content_type is the whole header, parameters such as charset included
+    if request.content_type.split(";")[0].strip().lower() == "text/csv":
+        return read_rows(io.StringIO(request.body.decode("utf-8-sig")), "csv")
+    data = request.data
+    if isinstance(data, dict):
+        data = data.get("users")
+    if not isinstance(data, list):
+        raise ValueError('expected a list of users or {"users": [...]}')
+    return data
+
+
+def row_error(number, username, errors) -> dict:
+    return {"row": number, "username": username, "errors": errors}
+
+
+def existing_usernames(usernames) -> set:
+    return set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+
+
+def validate_batch(rows, first_number, seen) -> tuple:
+    """(row number, validated data) of the valid rows, and the errors of the others"""
+    valid = []
+    errors = []
+    for number, row in enumerate(rows, first_number):
+        if not isinstance(row, dict):
+            errors.append(row_error(number, None, {"non_field_errors": ["Expected an object."]}))
+            continue
+        serializer = UserImportSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append(row_error(number, row.get("username"), serializer.errors))
+            continue
+        username = serializer.validated_data["username"]
+        if username in seen:
+            errors.append(row_error(number, username, {"username": ["Duplicated in this import."]}))
+            continue
+        seen.add(username)
+        valid.append((number, serializer.validated_data))
+
+    # one query per batch instead of the serializer's per-row uniqueness check
+    taken = existing_usernames([data["username"] for _, data in valid])
+    for number, data in valid:
+        if data["username"] in taken:
+            errors.append(row_error(number, data["username"], {"username": ["A user with that username already exists."]}))
+    return [(number, data) for number, data in valid if data["username"] not in taken], errors
+
+
+def insert_batch(valid) -> tuple:
+    """Insert the batch in one transaction; returns (created, errors)"""
+    if not valid:
+        return 0, []
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create([User(**data) for _, data in valid])
+        return len(valid), []
+    except IntegrityError as e:
+        # a signup or another import took some usernames after the batch was checked
+        taken = existing_usernames([data["username"] for _, data in valid])
+        if not taken:
+            return 0, [row_error(number, data["username"], {"non_field_errors": [str(e)]}) for number, data in valid]
+        errors = [
+            row_error(number, data["username"], {"username": ["A user with that username already exists."]})
+            for number, data in valid if data["username"] in taken
+        ]
+        created, more_errors = insert_batch([(number, data) for number, data in valid if data["username"] not in taken])
+        return created, errors + more_errors
+
+
+def import_users(rows, batch_size=None, workers=None) -> dict:
+    """
+    Import an iterable of user dicts batch by batch: only one batch is
+    validated, hashed and inserted at a time, so a lazy iterable (see
+    read_rows) keeps memory bounded by the batch size. Returns the created and failed counts,
+    the per-row errors and the throughput in users per second.
+    """
+    batch_size = batch_size or settings.ACCOUNTS["IMPORT_BATCH_SIZE"]
+    start = time.monotonic()
+    rows = iter(rows)
+    seen = set()
+    total = created = 0
+    errors = []
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        valid, batch_errors = validate_batch(batch, total + 1, seen)
+        total += len(batch)
+
+        hashed = hash_passwords([data["password"] for _, data in valid], workers)
+        for (_, data), password in zip(valid, hashed):
+            data["password"] = password
+
+        batch_created, insert_errors = insert_batch(valid)
+        created += batch_created
+        errors += batch_errors + insert_errors
+
+    seconds = time.monotonic() - start
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "rows": total,
+        "created": created,
+        "failed": len(errors),
+        "seconds": round(seconds, 3),
+        "users_per_second": round(created / seconds, 1) if seconds else None,
+        "errors": errors,
+    }
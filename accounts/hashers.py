@@ -0,0 +1,62 @@
+"""
+Password hashers tuned from settings.ACCOUNTS, and the process pool that
+password hashing is offloaded to.
+
+PASSWORD_HASHERS lists the configured algorithm first and the others after
+it, so existing hashes keep verifying. Django re-hashes a password with the
+configured algorithm and parameters the next time its user logs in.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import hashers
+from django.contrib.auth.hashers import check_password, make_password
+
+from h4ev import settings
+from h4ev.process import per_process
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = settings.ACCOUNTS["PBKDF2_ITERATIONS"]
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    time_cost = settings.ACCOUNTS["ARGON2_TIME_COST"]
+    memory_cost = settings.ACCOUNTS["ARGON2_MEMORY_COST"]
+    parallelism = settings.ACCOUNTS["ARGON2_PARALLELISM"]
+
+
+class BCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    rounds = settings.ACCOUNTS["BCRYPT_ROUNDS"]
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    work_factor = settings.ACCOUNTS["SCRYPT_WORK_FACTOR"]
+
+
+def init_hash_worker():
+    # a no-op when the worker was forked from a configured process
+    django.setup()
+
+
+@per_process
+def get_hash_pool(workers) -> ProcessPoolExecutor:
+    """Password hashing processes of this size for this process"""
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_hash_worker)
+
+
+def run_hashing(func, *args, workers=0):
+    """Run func(*args) on a pool of workers processes, or inline when workers is 0"""
+    if workers <= 0:
+        return func(*args)
+    return get_hash_pool(workers).submit(func, *args).result()
+
+
+def verify_password(password, encoded) -> tuple:
+    """
+    (whether password matches encoded, the re-hashed password when encoded
+    uses an outdated algorithm or parameters). Runs in the hashing pool.
+    """
+    upgraded = []
+    correct = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return correct, upgraded[0] if upgraded else None
@@ -0,0 +1,233 @@
+"""
+Rotation, compression and retention of the request logs in settings.LOG_DIR.
+
+Active files are renamed to a timestamped segment once they grow past
+ROTATE_BYTES or at every ROTATE_INTERVAL boundary. Writers notice the
+rename on their next batch and reopen the active path. Segments that have
+gone quiet are compressed, and archives older than RETENTION_DAYS are
+deleted. In the partitioned layout a day's directory is closed once the
+day is over: its files are compressed like segments and expire by the
+directory's date. Every worker runs the same maintenance, serialized through an
+flock on LOG_DIR/.maintenance.lock.
+"""
+import fcntl
+import gzip
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+ACTIVE_SUFFIXES = (".jsonl", ".idx")
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+SEGMENT_RE = re.compile(r"\.\d{8}T\d{6}(-\d+)?\.(jsonl|idx)$")
+PARTITION_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+INTERVALS = {"hourly": 3600, "daily": 86400, "weekly": 7 * 86400}
+
+
+@contextmanager
+def maintenance_lock(log_dir, blocking=False, shared=False):
+    """
+    Yield True while holding the cross-process maintenance lock. Writers
+    take it shared around writes that must not be split by a rotation.
+    """
+    fd = os.open(os.path.join(log_dir, ".maintenance.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            fcntl.flock(fd, mode | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def segment_path(path, stamp):
+    """user_1.jsonl -> user_1.20240101T000000.jsonl, with a counter if that name exists"""
+    base, suffix = os.path.splitext(path)
+    candidate = f"{base}.{stamp}{suffix}"
+    counter = 1
+    # the earlier segment may already have been compressed away
+    while any(os.path.exists(candidate + ext) for ext in ("", *COMPRESSED_SUFFIXES.values())):
+        candidate = f"{base}.{stamp}-{counter}{suffix}"
+        counter += 1
+    return candidate
+
+
+def rotate(paths, stamp=None):
+    """
+    Rename active files to segments. Callers must hold the maintenance lock.
+    Related files (a partition and its index) should be rotated together.
+    """
+    stamp = stamp or time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    for path in paths:
+        try:
+            if os.path.getsize(path) == 0:
+                continue
+            os.rename(path, segment_path(path, stamp))
+        except FileNotFoundError:
+            # another worker rotated it first
+            continue
+
+
+def rotate_if_large(log_dir, paths, max_bytes):
+    """
+    Rotate paths when the first (the data file) has reached max_bytes.
+    Skipped if the lock is busy; the writer retries after its next batch.
+    """
+    with maintenance_lock(log_dir) as locked:
+        if not locked:
+            return False
+        try:
+            # re-check under the lock: another worker may have rotated it already
+            if os.path.getsize(paths[0]) < max_bytes:
+                return False
+        except FileNotFoundError:
+            return False
+        rotate(paths)
+        return True
+
+
+def is_segment(name):
+    return bool(SEGMENT_RE.search(name))
+
+
+def partition_day(path, log_dir):
+    """The date of the partition directory holding path, or None outside one"""
+    directory = os.path.relpath(os.path.dirname(path), log_dir)
+    if not PARTITION_RE.match(directory):
+        return None
+    try:
+        return datetime.strptime(directory, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def is_closed(path, log_dir):
+    """Whether path is no longer written to: a rotated segment, or a file of a past date partition"""
+    if is_segment(os.path.basename(path)):
+        return True
+    day = partition_day(path, log_dir)
+    return day is not None and day < utc_today() and path.endswith(ACTIVE_SUFFIXES)
+
+
+def iter_files(log_dir):
+    for root, dirs, files in os.walk(log_dir):
+        for name in files:
+            yield os.path.join(root, name)
+
+
+def rotate_period(log_dir, interval):
+    """
+    Rotate every active file once per interval boundary. The boundary
+    already handled is remembered in LOG_DIR/.last-rotation.
+    """
+    period = str(int(time.time() // interval))
+    marker = os.path.join(log_dir, ".last-rotation")
+    try:
+        with open(marker) as f:
+            last = f.read().strip()
+    except FileNotFoundError:
+        last = None
+
+    if last == period:
+        return
+    if last is not None:
+        active = [
+            path for path in iter_files(log_dir)
+            if path.endswith(ACTIVE_SUFFIXES) and not is_segment(os.path.basename(path))
+        ]
+        rotate(active)
+    with open(marker, "w") as f:
+        f.write(period)
+
+
+def compress_file(path, compression):
+    target = path + COMPRESSED_SUFFIXES[compression]
+    tmp = target + ".tmp"
+    if compression == "zstd":
+        import pyzstd
+        opener = pyzstd.ZstdFile
+    else:
+        opener = gzip.open
+
+    with open(path, "rb") as src, opener(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    # keep the segment's age for retention
+    shutil.copystat(path, tmp)
+    os.replace(tmp, target)
+    os.remove(path)
+
+
+def compress_segments(log_dir, compression, min_age):
+    """Compress closed files (see is_closed) nobody has written to for min_age seconds"""
+    now = time.time()
+    for path in iter_files(log_dir):
+        if not is_closed(path, log_dir):
+            continue
+        try:
+            if now - os.path.getmtime(path) < min_age:
+                continue
+            compress_file(path, compression)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"Error compressing request log {path}: {e}")
+
+
+def apply_retention(log_dir, days):
+    """
+    Delete rotated segments and archives last modified more than days ago,
+    and every file of date partitions more than days old.
+    """
+    cutoff = time.time() - days * 86400
+    cutoff_day = utc_today() - timedelta(days=days)
+    for path in iter_files(log_dir):
+        day = partition_day(path, log_dir)
+        try:
+            if day is not None:
+                if day < cutoff_day:
+                    os.remove(path)
+                continue
+            name = os.path.basename(path)
+            archived = name.endswith(tuple(COMPRESSED_SUFFIXES.values()))
+            if (archived or is_segment(name)) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+
+    # drop date partitions left empty
+    for root, dirs, files in os.walk(log_dir, topdown=False):
+        if root != log_dir and not os.listdir(root):
+            os.rmdir(root)
+
+
+def run_maintenance(log_dir, config):
+    """One maintenance pass: time rotation, compression, retention"""
+    with maintenance_lock(log_dir) as locked:
+        if not locked:
+            return
+        interval = INTERVALS.get(config["ROTATE_INTERVAL"])
+        # date partitions already close once a day
+        if interval and config["LAYOUT"] == "per_user":
+            rotate_period(log_dir, interval)
+        if config["COMPRESSION"]:
+            # rotated files may still get one last batch from workers holding the old descriptor
+            compress_segments(log_dir, config["COMPRESSION"], config["COMPRESS_MIN_AGE"])
+        if config["RETENTION_DAYS"]:
+            apply_retention(log_dir, config["RETENTION_DAYS"])
+
+
+def open_log(path):
+    """Open a plain, gzip or zstd log file for line-by-line text reading"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    if path.endswith(".zst"):
+        import pyzstd
+        return pyzstd.open(path, "rt")
+    return open(path)
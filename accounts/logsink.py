@@ -0,0 +1,315 @@
+"""
+Buffered, non-blocking sink for the per-user request logs written by
+LoggingAPIView.
+
+Request threads only enqueue the log entry. A background writer per worker
+process drains the queue in batches, keeps the per-user files open and
+appends each file's batch with a single write on an O_APPEND descriptor,
+so lines from different gunicorn workers never interleave mid-line.
+Rotation, compression and retention are handled by accounts/logrotate.py.
+"""
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from accounts import logstore
+from accounts.logrotate import maintenance_lock, rotate_if_large, run_maintenance
+from h4ev import settings
+
+
+class RequestLogSink:
+
+    def __init__(self, log_dir=None, queue_size=None, batch_size=None, flush_interval=None,
+                 full_policy=None, block_timeout=None, max_open_files=None):
+        config = settings.REQUEST_LOG
+        self.log_dir = log_dir or settings.LOG_DIR
+        self.batch_size = batch_size or config["BATCH_SIZE"]
+        self.flush_interval = flush_interval or config["FLUSH_INTERVAL"]
+        self.full_policy = full_policy or config["FULL_POLICY"]
+        self.block_timeout = block_timeout or config["BLOCK_TIMEOUT"]
+        self.max_open_files = max_open_files or config["MAX_OPEN_FILES"]
+        self.config = config
+        self.layout = config["LAYOUT"]
+        self.rotate_bytes = config["ROTATE_BYTES"]
+        self.next_maintenance = 0
+        self.next_ingest = 0
+        self.ingester = None
+
+        self.queue = queue.Queue(maxsize=queue_size or config["QUEUE_SIZE"])
+        self.files = OrderedDict()  # path -> file descriptor, least recently used first
+        self.write_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.counters = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0}
+
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def path_for(self, user_id):
+        if self.layout == "partitioned":
+            return self.partition_path()
+        return os.path.join(self.log_dir, f"user_{user_id}.jsonl")
+
+    def partition_path(self):
+        day = time.strftime("%Y-%m-%d", time.gmtime())
+        return os.path.join(self.log_dir, day, "requests.jsonl")
+
+    def write(self, user_id, entry):
+        """
+        Queue a log entry without blocking the request. When the queue is
+        full the entry is dropped, or with the "block" policy the caller
+        waits up to BLOCK_TIMEOUT seconds for room before dropping it.
+        """
+        self.ensure_started()
+        item = (user_id, entry)
+        try:
+            if self.full_policy == "block":
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def ensure_started(self):
+        # the writer thread does not survive a fork, so start one per worker
+        if self.pid == os.getpid():
+            return
+        with self.write_lock:
+            if self.pid == os.getpid():
+                return
+            for path in list(self.files):
+                self.close_file(path)
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name="request-log-writer", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            batch = self.collect()
+            if batch:
+                self.write_batch(batch)
+            else:
+                self.maybe_maintain()
+
+    def collect(self):
+        """Wait for one entry, then gather more until the batch is full or the interval passes"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def write_batch(self, batch):
+        if self.layout == "partitioned":
+            self.write_partitioned(batch)
+        else:
+            self.write_per_user(batch)
+        self.maybe_maintain()
+
+    def write_per_user(self, batch):
+        lines_by_path = {}
+        for user_id, entry in batch:
+            lines_by_path.setdefault(self.path_for(user_id), []).append(json.dumps(entry) + "\n")
+
+        with self.write_lock:
+            for path, lines in lines_by_path.items():
+                try:
+                    fd = self.descriptor(path)
+                    os.write(fd, "".join(lines).encode())
+                    self.rotate_if_large(path, fd)
+                except OSError as e:
+                    print(f"Error writing request log {path}: {e}")
+                    self.close_file(path)
+                    continue
+                self.counters["written"] += len(lines)
+            self.counters["batches"] += 1
+
+    def write_partitioned(self, batch):
+        """
+        Append the batch to today's partition with each user's lines grouped
+        together, then record a {"user_id", "offset", "length", "lines"} entry
+        per user in the partition's requests.idx so one user's requests can be
+        read back without scanning the whole file.
+        """
+        lines_by_user = {}
+        for user_id, entry in batch:
+            lines_by_user.setdefault(user_id, []).append(json.dumps(entry) + "\n")
+
+        chunks = []
+        ranges = []
+        offset = 0
+        for user_id, lines in lines_by_user.items():
+            chunk = "".join(lines).encode()
+            chunks.append(chunk)
+            ranges.append((user_id, offset, len(chunk), len(lines)))
+            offset += len(chunk)
+        data = b"".join(chunks)
+
+        path = self.partition_path()
+        index_path = os.path.splitext(path)[0] + ".idx"
+        with self.write_lock:
+            try:
+                # shared lock: rotation must not split a batch from its index entries,
+                # and retention must not remove the partition directory under us
+                with maintenance_lock(self.log_dir, blocking=True, shared=True):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    fd = self.descriptor(path)
+                    os.write(fd, data)
+                    # with O_APPEND the descriptor now sits right after our write
+                    start = os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+                    index = "".join(
+                        json.dumps({"user_id": user_id, "offset": start + relative, "length": length, "lines": lines})
+                        + "\n"
+                        for user_id, relative, length, lines in ranges
+                    )
+                    os.write(self.descriptor(index_path), index.encode())
+                self.rotate_if_large(path, fd, index_path)
+            except OSError as e:
+                print(f"Error writing request log {path}: {e}")
+                self.close_file(path)
+                self.close_file(index_path)
+                return
+            self.counters["written"] += len(batch)
+            self.counters["batches"] += 1
+
+    def rotate_if_large(self, path, fd, *related):
+        if not self.rotate_bytes or os.fstat(fd).st_size < self.rotate_bytes:
+            return
+        if rotate_if_large(self.log_dir, [path, *related], self.rotate_bytes):
+            self.counters["rotations"] += 1
+            for rotated in (path, *related):
+                self.close_file(rotated)
+
+    def maybe_maintain(self):
+        """Run rotation/compression/retention at most once per MAINTENANCE_INTERVAL"""
+        now = time.monotonic()
+        if now < self.next_maintenance:
+            return
+        self.next_maintenance = now + self.config["MAINTENANCE_INTERVAL"]
+        try:
+            run_maintenance(self.log_dir, self.config)
+        except OSError as e:
+            print(f"Error maintaining request logs: {e}")
+        self.maybe_ingest(now)
+
+    def maybe_ingest(self, now):
+        """Load new lines into the log store every INGEST_INTERVAL, on a thread so writes do not wait"""
+        interval = self.config["INGEST_INTERVAL"]
+        if not interval or now < self.next_ingest or (self.ingester is not None and self.ingester.is_alive()):
+            return
+        self.next_ingest = now + interval
+        self.ingester = threading.Thread(target=self.ingest, name="request-log-ingest", daemon=True)
+        self.ingester.start()
+
+    def ingest(self):
+        try:
+            logstore.ingest_pending(self.log_dir)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error ingesting request logs: {e}")
+
+    def descriptor(self, path):
+        fd = self.files.get(path)
+        if fd is not None:
+            if not self.rotated(path, fd):
+                self.files.move_to_end(path)
+                return fd
+            # another worker (or maintenance) renamed the file; reopen the active path
+            self.close_file(path)
+
+        while len(self.files) >= self.max_open_files:
+            oldest = next(iter(self.files))
+            self.close_file(oldest)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.files[path] = fd
+        return fd
+
+    def rotated(self, path, fd):
+        try:
+            return os.stat(path).st_ino != os.fstat(fd).st_ino
+        except FileNotFoundError:
+            return True
+
+    def close_file(self, path):
+        fd = self.files.pop(path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def flush(self):
+        """Write everything still queued; used on worker shutdown"""
+        batch = self.drain()
+        if batch:
+            self.write_batch(batch)
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None and self.pid == os.getpid():
+            # let the writer finish the batch it is holding
+            self.thread.join(timeout=self.flush_interval * 2 + 1)
+        self.flush()
+        with self.write_lock:
+            for path in list(self.files):
+                self.close_file(path)
+
+    def stats(self):
+        return {
+            **self.counters,
+            "pid": os.getpid(),
+            "queued": self.queue.qsize(),
+            "open_files": len(self.files),
+        }
+
+
+class SyncRequestLogSink(RequestLogSink):
+    """Write each entry on the request thread (REQUEST_LOG ASYNC disabled)"""
+
+    def write(self, user_id, entry):
+        self.write_batch([(user_id, entry)])
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink() -> RequestLogSink:
+    global _sink
+
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                sink_class = RequestLogSink if settings.REQUEST_LOG["ASYNC"] else SyncRequestLogSink
+                _sink = sink_class()
+                atexit.register(close_log_sink)
+    return _sink
+
+
+def close_log_sink():
+    """Write out and close this process's sink; the next get_log_sink() starts a new one"""
+    global _sink
+
+    with _sink_lock:
+        sink, _sink = _sink, None
+    if sink is not None:
+        sink.close()
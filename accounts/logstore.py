@@ -0,0 +1,360 @@
+"""
+Indexed SQLite store for the request logs written by LoggingAPIView.
+
+ingest() streams every log file under settings.LOG_DIR (plain, gzip or
+zstd, per-user or partitioned) into REQUEST_LOG["STORE"] line by line and
+remembers how far it got, so repeated runs only read new lines. Runs
+hold a file lock next to the store, so they never read the same lines
+twice; each worker's log writer runs one in the background every
+INGEST_INTERVAL seconds (ingest_pending), skipping it when one is
+already going. query() filters the stored requests and reports
+latency percentiles, throughput per minute and error rates.
+"""
+import fcntl
+import functools
+import json
+import math
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from django.urls import Resolver404, resolve
+from django.utils.dateparse import parse_date, parse_datetime
+
+from accounts.logrotate import COMPRESSED_SUFFIXES, iter_files, open_log
+from h4ev import settings
+
+PERCENTILES = (50, 90, 95, 99)
+GROUP_COLUMNS = {"user": "user_id", "path": "path", "route": "route", "status": "status"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    username TEXT,
+    method TEXT,
+    path TEXT,
+    route TEXT,
+    query TEXT,
+    status INTEGER,
+    started_at REAL,
+    duration_ms REAL,
+    UNIQUE (user_id, started_at, method, path, query)
+);
+CREATE INDEX IF NOT EXISTS requests_started ON requests (started_at);
+CREATE INDEX IF NOT EXISTS requests_user ON requests (user_id, started_at);
+CREATE INDEX IF NOT EXISTS requests_route ON requests (route, started_at);
+CREATE INDEX IF NOT EXISTS requests_path ON requests (path, started_at);
+CREATE INDEX IF NOT EXISTS requests_status ON requests (status, started_at);
+CREATE INDEX IF NOT EXISTS requests_duration ON requests (duration_ms);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    file_key TEXT PRIMARY KEY,
+    offset INTEGER
+);
+"""
+
+
+def connect(path=None):
+    path = path or settings.REQUEST_LOG["STORE"]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def log_files(log_dir):
+    for path in sorted(iter_files(log_dir)):
+        name = os.path.basename(path)
+        if name.endswith(tuple(COMPRESSED_SUFFIXES.values())):
+            name = os.path.splitext(name)[0]
+        if name.endswith(".jsonl"):
+            yield path
+
+
+def file_key(path, stat, log_dir):
+    """
+    Plain files are tracked by name and inode so a recreated file starts
+    over; an archive is immutable, so its name and size identify it.
+    """
+    name = os.path.relpath(path, log_dir)
+    if path.endswith(tuple(COMPRESSED_SUFFIXES.values())):
+        return f"archive:{name}:{stat.st_size}"
+    return f"file:{name}:{stat.st_dev}:{stat.st_ino}"
+
+
+def parse_timestamp(value):
+    parsed = datetime.fromisoformat(value.rstrip("Z"))
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+@functools.lru_cache(maxsize=4096)
+def route_for(path):
+    """The URL pattern a path matched, e.g. api/onadata/form/<str:form_id>/"""
+    try:
+        return resolve(path).route
+    except Resolver404:
+        return path
+
+
+def row_for(entry):
+    request = entry.get("request", {})
+    path, _, query = request.get("path", "").partition("?")
+    return (
+        entry.get("user_id"),
+        entry.get("username"),
+        request.get("method"),
+        path,
+        route_for(path),
+        query,
+        entry.get("response", {}).get("status_code"),
+        parse_timestamp(entry["timestamp_start"]),
+        entry.get("duration_ms"),
+    )
+
+
+def ingest(log_dir=None, store=None, batch_size=5000, wait=True):
+    """
+    Load new log lines into the store; returns files and rows read. Waits
+    for a run in another thread or process to finish first, or with
+    wait=False returns None instead.
+    """
+    log_dir = log_dir or settings.LOG_DIR
+    store = store or settings.REQUEST_LOG["STORE"]
+    os.makedirs(os.path.dirname(store) or ".", exist_ok=True)
+    fd = os.open(f"{store}.ingest.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        connection = connect(store)
+        totals = {"files": 0, "rows": 0, "skipped": 0}
+        try:
+            for path in log_files(log_dir):
+                try:
+                    ingest_file(connection, path, log_dir, batch_size, totals)
+                except FileNotFoundError:
+                    # rotated or compressed away mid-run; picked up under its new name next time
+                    continue
+        finally:
+            connection.close()
+        return totals
+    finally:
+        os.close(fd)
+
+
+def ingest_pending(log_dir=None, store=None):
+    """ingest() unless one is already running, as every worker's writer schedules one"""
+    return ingest(log_dir, store, wait=False)
+
+
+def ingest_file(connection, path, log_dir, batch_size, totals):
+    stat = os.stat(path)
+    key = file_key(path, stat, log_dir)
+    row = connection.execute("SELECT offset FROM ingested_files WHERE file_key = ?", (key,)).fetchone()
+    offset = row[0] if row else 0
+    archived = key.startswith("archive:")
+    if (archived and row) or (not archived and offset >= stat.st_size):
+        return
+
+    totals["files"] += 1
+    batch = []
+    with open_log(path) if archived else open(path, "rb") as f:
+        if not archived:
+            f.seek(offset)
+        for line in f:
+            if not archived:
+                if not line.endswith(b"\n"):
+                    # a batch still being appended; finish it next run
+                    break
+                offset += len(line)
+            try:
+                batch.append(row_for(json.loads(line)))
+            except (ValueError, KeyError, TypeError):
+                totals["skipped"] += 1
+                continue
+            if len(batch) >= batch_size:
+                save_rows(connection, batch, key, offset)
+                totals["rows"] += len(batch)
+                batch = []
+    save_rows(connection, batch, key, offset)
+    totals["rows"] += len(batch)
+
+
+def save_rows(connection, rows, key, offset):
+    # lines already ingested through another file (an active file later compressed) are ignored
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO requests "
+            "(user_id, username, method, path, route, query, status, started_at, duration_ms) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO ingested_files (file_key, offset) VALUES (?, ?)", (key, offset)
+        )
+
+
+def parse_bound(value, end=False):
+    """An ISO date or datetime as a UTC epoch; a bare date covers the whole day"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"{value!r} is not an ISO 8601 date or datetime")
+        parsed = datetime.combine(day, datetime.max.time() if end else datetime.min.time())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def where_clause(filters):
+    """
+    filters: user (id or username), path (prefix match, a trailing * is
+    optional), route, status ("404" or "5xx"), since, until (ISO dates).
+    """
+    clauses = []
+    args = []
+    if filters.get("user"):
+        user = str(filters["user"])
+        clauses.append("user_id = ?" if user.isdigit() else "username = ?")
+        args.append(int(user) if user.isdigit() else user)
+    if filters.get("path"):
+        clauses.append("path LIKE ? ESCAPE '\\'")
+        prefix = filters["path"].rstrip("*").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        args.append(prefix + "%")
+    if filters.get("route"):
+        clauses.append("route = ?")
+        args.append(filters["route"])
+    if filters.get("status"):
+        status = str(filters["status"]).lower()
+        if len(status) == 3 and status[0].isdigit() and status.endswith("xx"):
+            clauses.append("status BETWEEN ? AND ?")
+            args += [int(status[0]) * 100, int(status[0]) * 100 + 99]
+        elif status.isdigit():
+            clauses.append("status = ?")
+            args.append(int(status))
+        else:
+            raise ValueError("status must look like 404 or 5xx")
+    if filters.get("since"):
+        clauses.append("started_at >= ?")
+        args.append(parse_bound(filters["since"]))
+    if filters.get("until"):
+        clauses.append("started_at <= ?")
+        args.append(parse_bound(filters["until"], end=True))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+
+def summarize(connection, where, args) -> dict:
+    count, errors_4xx, errors_5xx, first, last, mean = connection.execute(
+        "SELECT COUNT(*), "
+        "SUM(status BETWEEN 400 AND 499), SUM(status >= 500), "
+        "MIN(started_at), MAX(started_at), AVG(duration_ms) "
+        f"FROM requests{where}",
+        args,
+    ).fetchone()
+    summary = {
+        "requests": count,
+        "error_rate_4xx": round((errors_4xx or 0) / count, 4) if count else 0,
+        "error_rate_5xx": round((errors_5xx or 0) / count, 4) if count else 0,
+        "mean_ms": round(mean, 2) if mean is not None else None,
+    }
+    for p, value in percentiles(connection, where, args, count).items():
+        summary[f"p{p}_ms"] = value
+    minutes = max((last - first) / 60, 1) if count else 1
+    summary["requests_per_minute"] = round(count / minutes, 2)
+    return summary
+
+
+def percentiles(connection, where, args, count) -> dict:
+    """
+    Nearest-rank PERCENTILES of duration_ms, read in one ordered pass that
+    stops at the highest rank. Unfiltered, the pass walks the duration
+    index; with a filter SQLite sorts the matching rows once.
+    """
+    ranks = {p: max(math.ceil(p / 100 * count) - 1, 0) for p in PERCENTILES}
+    values = dict.fromkeys(PERCENTILES)
+    if not count:
+        return values
+    wanted = sorted(ranks.items(), key=lambda item: item[1])
+    last = None
+    rows = connection.execute(f"SELECT duration_ms FROM requests{where} ORDER BY duration_ms", args)
+    for index, (duration_ms,) in enumerate(rows):
+        last = duration_ms
+        while wanted and wanted[0][1] == index:
+            values[wanted.pop(0)[0]] = duration_ms
+        if not wanted:
+            break
+    # rows deleted or replaced since count was taken: the tail ranks get the largest value seen
+    for p, _ in wanted:
+        values[p] = last
+    return values
+
+
+def query(filters=None, group_by=None, limit=20, per_minute=False, store=None) -> dict:
+    """
+    Latency percentiles, throughput and error rates for the requests that
+    match filters, optionally broken down by user, path, route or status
+    (largest groups first) and per minute.
+    """
+    filters = filters or {}
+    where, args = where_clause(filters)
+    connection = connect(store)
+    try:
+        result = summarize(connection, where, args)
+
+        if group_by:
+            column = GROUP_COLUMNS[group_by]
+            groups = connection.execute(
+                f"SELECT {column}, COUNT(*) AS n FROM requests{where} GROUP BY {column} ORDER BY n DESC LIMIT ?",
+                [*args, limit],
+            ).fetchall()
+            result["groups"] = []
+            for value, _ in groups:
+                group_where = f"{where} AND {column} = ?" if where else f" WHERE {column} = ?"
+                result["groups"].append({
+                    group_by: value,
+                    **summarize(connection, group_where, [*args, value]),
+                })
+
+        if per_minute:
+            result["per_minute"] = [
+                {
+                    "minute": datetime.fromtimestamp(minute * 60, timezone.utc).isoformat(),
+                    "requests": n,
+                    "errors": errors or 0,
+                    "mean_ms": round(mean, 2),
+                }
+                for minute, n, errors, mean in connection.execute(
+                    "SELECT CAST(started_at / 60 AS INTEGER) AS minute, COUNT(*), SUM(status >= 500), "
+                    f"AVG(duration_ms) FROM requests{where} GROUP BY minute ORDER BY minute",
+                    args,
+                )
+            ]
+    finally:
+        connection.close()
+    return result
+
+
+def top_requests(since, routes, limit=50, store=None) -> list:
+    """
+    The most requested successful GETs (full path with query string) on
+    the given URL patterns since the epoch timestamp since, as
+    (full_path, count) pairs.
+    """
+    if not routes:
+        return []
+    placeholders = ",".join("?" for _ in routes)
+    connection = connect(store)
+    try:
+        rows = connection.execute(
+            "SELECT path, query, COUNT(*) AS n FROM requests "
+            f"WHERE started_at >= ? AND method = 'GET' AND status = 200 AND route IN ({placeholders}) "
+            "GROUP BY path, query ORDER BY n DESC LIMIT ?",
+            [since, *routes, limit],
+        ).fetchall()
+    finally:
+        connection.close()
+    return [(path + ("?" + query if query else ""), n) for path, query, n in rows]
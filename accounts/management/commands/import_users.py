@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.bulk import EXTENSIONS, FORMATS, import_users, read_rows
+
+
+class Command(BaseCommand):
+    help = "Create users in bulk from a CSV (with a header line), NDJSON or JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV, NDJSON (.ndjson/.jsonl) or JSON file of users; the format follows "
+                                         "the extension. JSON files are loaded whole, the others streamed")
+        parser.add_argument("--format", choices=FORMATS, default=None)
+        parser.add_argument("--batch-size", type=int, default=None, help="users inserted per transaction")
+        parser.add_argument("--workers", type=int, default=None, help="password hashing processes")
+        parser.add_argument("--show-errors", type=int, default=20, help="failed rows to print (-1 for all)")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        extension = path.rsplit(".", 1)[-1].lower()
+        file_format = options["format"] or EXTENSIONS.get(extension, extension)
+        if file_format not in FORMATS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format {'/'.join(FORMATS)}")
+
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as stream:
+                result = import_users(
+                    read_rows(stream, file_format),
+                    batch_size=options["batch_size"],
+                    workers=options["workers"],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Failed to read {path}: {e}")
+
+        shown = result["errors"] if options["show_errors"] < 0 else result["errors"][:options["show_errors"]]
+        for error in shown:
+            self.stderr.write(self.style.ERROR(
+                f"row {error['row']} ({error['username']}): {json.dumps(error['errors'])}"
+            ))
+        self.stdout.write(
+            f"{result['created']} of {result['rows']} users created, {result['failed']} failed, "
+            f"in {result['seconds']}s ({result['users_per_second']} users/s)"
+        )
@@ -0,0 +1,39 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.logstore import GROUP_COLUMNS, ingest, query
+
+
+class Command(BaseCommand):
+    help = "Ingest the request logs into the SQLite log store and report latency, throughput and error rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="user id or username")
+        parser.add_argument("--path", help="path prefix, e.g. /api/onadata/form/")
+        parser.add_argument("--route", help="URL pattern, e.g. api/onadata/form/<str:form_id>/")
+        parser.add_argument("--status", help="status code or class, e.g. 404 or 5xx")
+        parser.add_argument("--since", help="ISO date or datetime (UTC)")
+        parser.add_argument("--until", help="ISO date or datetime (UTC); a bare date includes the whole day")
+        parser.add_argument("--group-by", choices=sorted(GROUP_COLUMNS))
+        parser.add_argument("--limit", type=int, default=20, help="groups to report")
+        parser.add_argument("--per-minute", action="store_true", help="include throughput per minute")
+        parser.add_argument("--no-ingest", action="store_true", help="query the store without reading new logs")
+
+    def handle(self, *args, **options):
+        if not options["no_ingest"]:
+            start = time.monotonic()
+            totals = ingest()
+            self.stderr.write(
+                f"ingested {totals['rows']} rows from {totals['files']} files "
+                f"({totals['skipped']} unreadable lines) in {time.monotonic() - start:.1f}s"
+            )
+
+        filters = {name: options[name] for name in ("user", "path", "route", "status", "since", "until")}
+        try:
+            result = query(filters, group_by=options["group_by"], limit=options["limit"],
+                           per_minute=options["per_minute"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,314 @@
+"""
+Per-request timings and Prometheus metrics.
+
+Hot paths wrap their work in timer("cache" | "upstream" | "db" | "render").
+The time is added to the current request's totals, which live in a
+ContextVar so they follow the request into sync_to_async threads and async
+tasks. MetricsMiddleware returns the totals in a Server-Timing header and
+records them, with per-route latency histograms, in this worker's registry.
+
+Every FLUSH_INTERVAL seconds each worker adds its registry into a Redis
+hash with HINCRBYFLOAT, so workers never overwrite each other, and
+GET /metrics renders the sums in the Prometheus text format.
+"""
+import atexit
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from h4ev import settings
+from h4ev.process import per_process
+
+PHASES = ("cache", "upstream", "db", "render")
+REDIS_KEY = "metrics:h4ev"
+
+# family -> (type, help)
+METRIC_TYPES = {
+    "h4ev_http_requests_total": ("counter", "HTTP requests by route, method and status"),
+    "h4ev_http_request_duration_seconds": ("histogram", "HTTP request latency by route and method"),
+    "h4ev_request_phase_seconds_total": ("counter", "Time spent per request phase (cache, upstream, db, render)"),
+    "h4ev_request_phase_calls_total": ("counter", "Calls per request phase (cache operations, upstream calls, SQL queries)"),
+    "onadata_upstream_request_duration_seconds": ("histogram", "Onadata API call latency"),
+    "onadata_cache_lookups_total": ("counter", "Onadata cache lookups by route and result (hit, miss, stale)"),
+    "onadata_cache_hit_ratio": ("gauge", "Share of Onadata cache lookups served without calling Onadata"),
+}
+HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+_timings = ContextVar("request_timings", default=None)
+_lookup = ContextVar("onadata_cache_lookup", default=None)
+
+
+def enabled() -> bool:
+    return settings.METRICS["ENABLED"]
+
+
+def start_timings():
+    """Start collecting phase timings for the current request; returns the token to reset"""
+    return _timings.set({phase: [0.0, 0] for phase in PHASES})
+
+
+def stop_timings(token):
+    _timings.reset(token)
+
+
+def current_timings():
+    return _timings.get()
+
+
+def add_timing(phase, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        # threads of one request (batch fetches) may race here; the totals are approximate then
+        entry = timings[phase]
+        entry[0] += seconds
+        entry[1] += 1
+    if phase == "upstream":
+        lookup = _lookup.get()
+        if lookup is not None:
+            lookup["result"] = "miss"
+        if enabled():
+            get_registry().observe("onadata_upstream_request_duration_seconds", {}, seconds)
+
+
+@contextmanager
+def timer(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - start)
+
+
+def timed_execute(execute, sql, params, many, context):
+    """Connection execute wrapper timing every SQL query as the "db" phase"""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        add_timing("db", time.perf_counter() - start)
+
+
+def install_db_timer(sender, connection, **kwargs):
+    if timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_execute)
+
+
+class TimedCache:
+    """Cache proxy timing the calls that reach the backend as the "cache" phase"""
+
+    TIMED = frozenset({"get", "set", "add", "delete", "get_many", "set_many", "delete_many", "incr", "touch", "has_key"})
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def __getattr__(self, name):
+        attr = getattr(self._cache, name)
+        if name not in self.TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            with timer("cache"):
+                return attr(*args, **kwargs)
+        return timed
+
+
+@contextmanager
+def cache_lookup(route):
+    """
+    Count one Onadata cache lookup for route: a "hit" unless Onadata was
+    called on this request's behalf while it ran, or mark_stale() was used.
+    """
+    lookup = {"result": "hit"}
+    token = _lookup.set(lookup)
+    try:
+        yield
+    finally:
+        _lookup.reset(token)
+        if enabled():
+            get_registry().inc("onadata_cache_lookups_total", {"route": route, "result": lookup["result"]})
+
+
+def mark_stale():
+    lookup = _lookup.get()
+    if lookup is not None:
+        lookup["result"] = "stale"
+
+
+def format_labels(labels) -> str:
+    return ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+
+
+def series(name, labels) -> str:
+    return f"{name}{{{format_labels(labels)}}}" if labels else name
+
+
+class Registry:
+    """This worker's counters since the last flush, keyed by Prometheus series"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, name, labels=None, amount=1):
+        key = series(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        base = format_labels(labels)
+        prefix = f"{base}," if base else ""
+        keys = [
+            f'{name}_bucket{{{prefix}le="{bound}"}}'
+            for bound in settings.METRICS["BUCKETS"] if seconds <= bound
+        ]
+        keys.append(f'{name}_bucket{{{prefix}le="+Inf"}}')
+        with self.lock:
+            for key in keys:
+                self.values[key] = self.values.get(key, 0) + 1
+            for key, amount in ((series(f"{name}_sum", labels), seconds), (series(f"{name}_count", labels), 1)):
+                self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.values)
+
+    def drain(self) -> dict:
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values):
+        with self.lock:
+            for key, amount in values.items():
+                self.values[key] = self.values.get(key, 0) + amount
+
+
+def record_request(route, method, status_code, seconds, timings):
+    registry = get_registry()
+    registry.inc("h4ev_http_requests_total", {"route": route, "method": method, "status": status_code})
+    registry.observe("h4ev_http_request_duration_seconds", {"route": route, "method": method}, seconds)
+    for phase, (total, calls) in (timings or {}).items():
+        if calls:
+            registry.inc("h4ev_request_phase_seconds_total", {"route": route, "phase": phase}, total)
+            registry.inc("h4ev_request_phase_calls_total", {"route": route, "phase": phase}, calls)
+
+
+def server_timing(timings, total) -> str:
+    parts = [
+        f'{phase};dur={seconds * 1000:.2f};desc="{calls}"'
+        for phase, (seconds, calls) in timings.items() if calls
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def get_redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def flush(registry=None):
+    """Add this worker's counters into the shared Redis hash"""
+    registry = registry or get_registry()
+    redis = get_redis()
+    if redis is None:
+        # nothing to aggregate into: the registry keeps this worker's totals
+        return
+    values = registry.drain()
+    if not values:
+        return
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for key, amount in values.items():
+            pipe.hincrbyfloat(REDIS_KEY, key, amount)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error flushing metrics: {e}")
+        registry.merge(values)
+
+
+def flush_loop(registry):
+    while True:
+        time.sleep(settings.METRICS["FLUSH_INTERVAL"])
+        flush(registry)
+
+
+@per_process
+def get_registry() -> Registry:
+    """This process's registry and its flush thread"""
+    registry = Registry()
+    threading.Thread(target=flush_loop, args=(registry,), name="metrics-flush", daemon=True).start()
+    atexit.register(flush, registry)
+    return registry
+
+
+def collect() -> dict:
+    """Totals of every worker: the Redis hash after flushing this worker, or this worker alone without Redis"""
+    registry = get_registry()
+    flush(registry)
+    redis = get_redis()
+    if redis is None:
+        return registry.snapshot()
+    try:
+        return {key.decode(): float(value) for key, value in redis.hgetall(REDIS_KEY).items()}
+    except Exception as e:
+        print(f"Error reading metrics: {e}")
+        return registry.snapshot()
+
+
+def hit_ratios(values) -> dict:
+    lookups = {}
+    for key, value in values.items():
+        if key.startswith("onadata_cache_lookups_total{"):
+            labels = dict(LABEL.findall(key))
+            counts = lookups.setdefault(labels["route"], {"hit": 0, "total": 0})
+            counts["total"] += value
+            if labels["result"] in ("hit", "stale"):
+                counts["hit"] += value
+    return {
+        series("onadata_cache_hit_ratio", {"route": route}): counts["hit"] / counts["total"]
+        for route, counts in lookups.items() if counts["total"]
+    }
+
+
+def family_of(name) -> str:
+    for suffix in HISTOGRAM_SUFFIXES:
+        family = name[:-len(suffix)]
+        if name.endswith(suffix) and METRIC_TYPES.get(family, ("",))[0] == "histogram":
+            return family
+    return name
+
+
+def sort_key(key):
+    # histogram buckets in increasing le order, after the other labels
+    labels = LABEL.findall(key)
+    le = dict(labels).get("le")
+    bound = float("inf") if le == "+Inf" else float(le) if le else 0
+    return [(name, value) for name, value in labels if name != "le"], key.split("{")[0], bound
+
+
+def render(values) -> str:
+    """Prometheus text exposition format"""
+    values = {**values, **hit_ratios(values)}
+    families = {}
+    for key, value in values.items():
+        families.setdefault(family_of(key.split("{", 1)[0]), []).append(key)
+
+    lines = []
+    for family in sorted(families):
+        kind, description = METRIC_TYPES.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for key in sorted(families[family], key=sort_key):
+            value = values[key]
+            lines.append(f"{key} {int(value) if float(value).is_integer() else repr(float(value))}")
+    return "\n".join(lines) + "\n"
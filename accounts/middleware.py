@@ -0,0 +1,136 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.exceptions import MiddlewareNotUsed
+
+from accounts import metrics, profiling
+from h4ev import settings
+
+
+class MetricsMiddleware:
+    """
+    Time every request and its cache, upstream, SQL and render phases
+    (accounts.metrics), add a Server-Timing header and record the request
+    in this worker's Prometheus registry. Works under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = metrics.start_timings()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self.finish(request, response, start)
+        finally:
+            metrics.stop_timings(token)
+        return response
+
+    async def __acall__(self, request):
+        token = metrics.start_timings()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self.finish(request, response, start)
+        finally:
+            metrics.stop_timings(token)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that separately
+        start = time.perf_counter()
+        response.add_post_render_callback(lambda rendered: metrics.add_timing("render", time.perf_counter() - start))
+        return response
+
+    def finish(self, request, response, start):
+        total = time.perf_counter() - start
+        timings = metrics.current_timings()
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        metrics.record_request(route, request.method, response.status_code, total, timings)
+        if settings.METRICS["SERVER_TIMING"]:
+            response["Server-Timing"] = metrics.server_timing(timings, total)
+
+
+class ProfilingMiddleware:
+    """
+    Give every request an id (X-Request-ID) and profile sampled or slow
+    requests (accounts.profiling). Under ASGI the event loop's thread is
+    stack-sampled, so async profiles also show other requests' coroutines,
+    and sampled async requests get a stack profile instead of cProfile.
+    Under WSGI an async view runs on its own event loop thread, so its
+    profile only shows the request thread waiting for it. Streaming
+    bodies are produced after the profile is taken.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not profiling.enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request.request_id = profiling.request_id(request)
+        is_sampled = profiling.sampled()
+        profiler = profiling.start_cprofile() if is_sampled else None
+        # a sampled request that cannot get cProfile is stack-sampled from the start instead
+        watch = self.watch(0 if is_sampled else None) if profiler is None else None
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            samples = profiling.get_sampler().unwatch(watch) if watch is not None else None
+        name = profiling.save(
+            request, response.status_code, time.perf_counter() - start, profiler, samples, sampled=is_sampled,
+        )
+        return self.tag(request, response, name)
+
+    async def __acall__(self, request):
+        request.request_id = profiling.request_id(request)
+        is_sampled = profiling.sampled()
+        watch = self.watch(0 if is_sampled else None)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            samples = profiling.get_sampler().unwatch(watch) if watch is not None else None
+        name = None
+        if samples:
+            # only requests watched past their threshold have samples; the rest skip the thread hop
+            name = await sync_to_async(profiling.save, thread_sensitive=False)(
+                request, response.status_code, time.perf_counter() - start, samples=samples, sampled=is_sampled,
+            )
+        return self.tag(request, response, name)
+
+    def watch(self, after=None):
+        """Watch this thread from after seconds (WATCH_AFTER_MS by default), if slow requests are profiled"""
+        config = settings.PROFILING
+        if after is None:
+            if not config["SLOW_MS"]:
+                return None
+            after = config["WATCH_AFTER_MS"] / 1000
+        return profiling.get_sampler().watch(after)
+
+    def tag(self, request, response, name):
+        response["X-Request-ID"] = request.request_id
+        if name:
+            response["X-Profile"] = name
+        return response
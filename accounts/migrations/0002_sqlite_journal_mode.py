@@ -0,0 +1,31 @@
+from django.db import migrations
+
+from h4ev import settings
+from h4ev.database import PRAGMA_VALUE
+
+
+def set_journal_mode(apps, schema_editor):
+    """Switch the SQLite file to settings.SQLITE_JOURNAL_MODE; the mode persists in the file"""
+    connection = schema_editor.connection
+    mode = settings.SQLITE_JOURNAL_MODE
+    if connection.vendor != "sqlite" or not mode:
+        return
+    if not PRAGMA_VALUE.fullmatch(mode):
+        print(f"Ignoring SQLite journal mode {mode!r}")
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {mode}")
+
+
+class Migration(migrations.Migration):
+
+    # the journal mode cannot change inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode, migrations.RunPython.noop, elidable=True),
+    ]
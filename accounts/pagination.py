@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+from h4ev import settings
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key: each page is a `WHERE id > last_id
+    LIMIT n` index range scan, so it costs the same on page 1 and page 10000.
+    """
+    ordering = "id"
+    page_size = settings.ACCOUNTS["USERS_PAGE_SIZE"]
+    page_size_query_param = "page_size"
+    max_page_size = settings.ACCOUNTS["USERS_MAX_PAGE_SIZE"]
@@ -0,0 +1,249 @@
+"""
+Opt-in request profiling (settings.PROFILING), for requests that are slow
+in production and leave nothing but a duration_ms log line behind.
+
+A SAMPLE_RATE share of requests is profiled from start to finish with
+cProfile. Every other request is handed to a watchdog thread: once it has
+run for WATCH_AFTER_MS, the watchdog samples its thread's stack every
+STACK_INTERVAL seconds, and if it finishes over SLOW_MS the sampled stacks
+are kept. A request that finishes before WATCH_AFTER_MS only costs adding
+and removing it from a set.
+
+Profiles are written to PROFILING["DIR"] (LOG_DIR/profiles by default) as
+<time>-<request id>-<suffix>.prof (cProfile, for pstats or snakeviz) or .folded
+(one "frame;frame;frame count" line per stack, for flamegraph.pl or
+speedscope), each with a .json sidecar describing the request. Only the
+newest MAX_PROFILES are kept.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from h4ev import settings
+from h4ev.process import per_process
+
+FORMATS = {"cprofile": ".prof", "stack": ".folded"}
+REQUEST_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+PROFILE_NAME = re.compile(r"^\d{8}T\d{6}-[A-Za-z0-9_-]{1,64}-[0-9a-f]{8}\.(prof|folded)$")
+
+
+def enabled() -> bool:
+    return settings.PROFILING["ENABLED"]
+
+
+def profile_dir() -> str:
+    return settings.PROFILING["DIR"] or os.path.join(settings.LOG_DIR, "profiles")
+
+
+def request_id(request) -> str:
+    """The caller's X-Request-ID when it is safe to use in a file name, or a new one"""
+    incoming = request.META.get("HTTP_X_REQUEST_ID", "")
+    # random rather than uuid4, which costs a system call on every request
+    return incoming if REQUEST_ID.match(incoming) else f"{random.getrandbits(128):032x}"
+
+
+def sampled() -> bool:
+    rate = settings.PROFILING["SAMPLE_RATE"]
+    return rate > 0 and random.random() < rate
+
+
+def start_cprofile():
+    """A running cProfile profiler for this thread, or None if another profiler is active"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one active profiler per process
+        return None
+    return profiler
+
+
+@functools.lru_cache(maxsize=4096)
+def short_path(filename) -> str:
+    """filename relative to the project or the sys.path entry it was imported from"""
+    for prefix in sorted({str(settings.BASE_DIR), *sys.path}, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({short_path(code.co_filename)}:{frame.f_lineno})"
+
+
+def fold(frame) -> str:
+    """A thread's stack, outermost frame first, in the folded flame graph format"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame).replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Watch:
+    __slots__ = ("thread_id", "start", "after", "samples")
+
+    def __init__(self, thread_id, start, after):
+        self.thread_id = thread_id
+        self.start = start
+        self.after = after
+        # created by the watchdog on the first sample
+        self.samples = None
+
+
+class StackSampler:
+    """Watchdog thread sampling the stacks of watched requests that run past their threshold"""
+
+    def __init__(self, interval, idle_interval):
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.watches = set()
+        self.condition = threading.Condition(threading.Lock())
+        threading.Thread(target=self.run, name="profiling-watchdog", daemon=True).start()
+
+    def watch(self, after, thread_id=None) -> Watch:
+        watch = Watch(thread_id or threading.get_ident(), time.perf_counter(), after)
+        with self.condition:
+            self.watches.add(watch)
+            if after <= 0:
+                self.condition.notify()
+        return watch
+
+    def unwatch(self, watch):
+        """The watch's stack samples, or None if it never ran past its threshold"""
+        with self.condition:
+            self.watches.discard(watch)
+        return watch.samples
+
+    def run(self):
+        with self.condition:
+            while True:
+                now = time.perf_counter()
+                due = [watch for watch in self.watches if now - watch.start >= watch.after]
+                if due:
+                    # sampled under the lock, so a request never reads its samples mid-update
+                    frames = sys._current_frames()
+                    for watch in due:
+                        frame = frames.get(watch.thread_id)
+                        if frame is not None:
+                            if watch.samples is None:
+                                watch.samples = Counter()
+                            watch.samples[fold(frame)] += 1
+                    del frames
+                    self.condition.wait(self.interval)
+                elif self.watches:
+                    self.condition.wait(min(watch.start + watch.after for watch in self.watches) - now)
+                else:
+                    # polling instead of being notified keeps wake-ups off the request path;
+                    # sampling then starts at most idle_interval past a request's threshold
+                    self.condition.wait(self.idle_interval)
+
+
+@per_process
+def get_sampler() -> StackSampler:
+    """This process's watchdog"""
+    config = settings.PROFILING
+    return StackSampler(config["STACK_INTERVAL"], max(config["WATCH_AFTER_MS"], 20) / 2000)
+
+
+def save(request, status_code, seconds, profiler=None, samples=None, sampled=False):
+    """
+    Write the request's cProfile profile, or its sampled stacks if it was
+    sampled or ran over SLOW_MS; returns the profile's file name or None.
+    """
+    duration_ms = seconds * 1000
+    slow = duration_ms >= settings.PROFILING["SLOW_MS"] > 0
+    if profiler is None and not (samples and (sampled or slow)):
+        return None
+    profile_format = "cprofile" if profiler is not None else "stack"
+    trigger = "sampled" if sampled else "slow"
+
+    directory = profile_dir()
+    created = datetime.now(timezone.utc)
+    # the request id comes from the caller, so a server-side suffix keeps one request from replacing another's profile
+    suffix = uuid.uuid4().hex[:8]
+    name = f"{created.strftime('%Y%m%dT%H%M%S')}-{request.request_id}-{suffix}{FORMATS[profile_format]}"
+    path = os.path.join(directory, name)
+    user = getattr(request, "user", None)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        if profiler is not None:
+            profiler.dump_stats(path)
+        else:
+            with open(path, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+        with open(f"{path}.json", "w") as f:
+            json.dump({
+                "name": name,
+                "request_id": request.request_id,
+                "trigger": trigger,
+                "format": profile_format,
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status_code": status_code,
+                "duration_ms": round(duration_ms, 2),
+                "user_id": user.id if user is not None and user.is_authenticated else None,
+                "samples": sum(samples.values()) if samples else None,
+                "created_at": created.isoformat(),
+            }, f)
+        prune(directory)
+    except OSError as e:
+        print(f"Error saving profile {name}: {e}")
+        return None
+    return name
+
+
+def prune(directory):
+    """Delete the oldest profiles beyond MAX_PROFILES"""
+    keep = settings.PROFILING["MAX_PROFILES"]
+    names = sorted(name for name in os.listdir(directory) if PROFILE_NAME.match(name))
+    for name in names[:max(0, len(names) - keep)]:
+        for path in (os.path.join(directory, name), os.path.join(directory, f"{name}.json")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit=100) -> list:
+    """Metadata of the newest profiles, newest first"""
+    directory = profile_dir()
+    try:
+        names = sorted((name for name in os.listdir(directory) if PROFILE_NAME.match(name)), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, f"{name}.json")) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            profiles.append({"name": name})
+    return profiles
+
+
+def profile_path(name):
+    """Path of a stored profile, or None for unknown or unsafe names"""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.exists(path) else None
+
+
+def profile_text(path, sort="cumulative", limit=50) -> str:
+    """pstats summary of a cProfile profile"""
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,76 @@
+"""
+Failed-login counters per username and per client IP, kept in the cache
+(Redis). Once either passes its limit, logins are refused with 429 before
+any password hashing, which sheds brute-force load cheaply. Successful
+logins are never counted, so a clinic logging in a whole shift from one
+IP is not throttled.
+"""
+import hashlib
+
+from django.core.cache import caches
+
+from h4ev import settings
+
+
+def get_cache():
+    return caches[settings.ACCOUNTS["LOGIN_RATE_CACHE"]]
+
+
+def client_ip(request) -> str:
+    header = settings.ACCOUNTS["LOGIN_IP_HEADER"]
+    # the header (e.g. HTTP_X_FORWARDED_FOR) is only trustworthy behind a proxy that sets it
+    forwarded = request.META.get(header, "") if header else ""
+    return forwarded.split(",")[0].strip() or request.META.get("REMOTE_ADDR", "")
+
+
+def failure_limits(username, ip) -> list:
+    config = settings.ACCOUNTS
+    username_hash = hashlib.md5(username.encode()).hexdigest()
+    return [
+        (f"login:failures:user:{username_hash}", config["LOGIN_MAX_FAILURES_PER_USERNAME"]),
+        (f"login:failures:ip:{ip}", config["LOGIN_MAX_FAILURES_PER_IP"]),
+    ]
+
+
+def login_retry_after(username, ip):
+    """Seconds before this username or IP may try again, or None when a login may go ahead"""
+    if not settings.ACCOUNTS["LOGIN_RATE_LIMIT"]:
+        return None
+    cache = get_cache()
+    limits = failure_limits(username, ip)
+    try:
+        counts = cache.get_many([key for key, _ in limits])
+        for key, limit in limits:
+            if counts.get(key, 0) >= limit:
+                ttl = cache.ttl(key) if hasattr(cache, "ttl") else None
+                return ttl if ttl and ttl > 0 else settings.ACCOUNTS["LOGIN_FAILURE_WINDOW"]
+    except Exception as e:
+        # without the cache, logins go ahead unthrottled
+        print(f"Error reading login rate limits: {e}")
+    return None
+
+
+def record_login_failure(username, ip):
+    if not settings.ACCOUNTS["LOGIN_RATE_LIMIT"]:
+        return
+    cache = get_cache()
+    try:
+        for key, _ in failure_limits(username, ip):
+            # the window starts at the first failure and is not extended by later ones
+            cache.add(key, 0, timeout=settings.ACCOUNTS["LOGIN_FAILURE_WINDOW"])
+            try:
+                cache.incr(key)
+            except ValueError:
+                # expired between add and incr
+                cache.add(key, 1, timeout=settings.ACCOUNTS["LOGIN_FAILURE_WINDOW"])
+    except Exception as e:
+        print(f"Error recording login failure: {e}")
+
+
+def reset_login_failures(username):
+    if not settings.ACCOUNTS["LOGIN_RATE_LIMIT"]:
+        return
+    try:
+        get_cache().delete(failure_limits(username, "")[0][0])
+    except Exception as e:
+        print(f"Error resetting login failures: {e}")
@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from rest_framework import serializers
 from rest_framework.fields import EmailField
 from rest_framework.serializers import ModelSerializer, Serializer
@@ -25,6 +26,19 @@ class UserSerializer(serializers.ModelSerializer):
         }
 
 
+class UserImportSerializer(UserSerializer):
+    """
+    UserSerializer for bulk imports: usernames are checked for uniqueness
+    once per batch by accounts.bulk instead of with a query per row.
+    """
+
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {
+            **UserSerializer.Meta.extra_kwargs,
+            "username": {"validators": [UnicodeUsernameValidator()]},
+        }
+
+
 class LoginSerializer(ModelSerializer):
     class Meta:
         model = User
@@ -1,6 +1,5 @@
 import hashlib
 import json
-import os
 import time
 from datetime import datetime
 
@@ -9,7 +8,8 @@ from django.contrib.auth.hashers import make_password
 from django.core.exceptions import ValidationError
 from rest_framework.views import APIView
 
-from h4ev import settings
+from accounts import metrics
+from accounts.logsink import get_log_sink
 
 User = get_user_model()
 
@@ -29,13 +29,34 @@ def create_user_account(serializer):
         raise ValidationError(e)
 
 
+# columns the user listing can return; password and permission fields are never exposed
+USER_LIST_FIELDS = ("id", "username", "first_name", "last_name", "role")
+
+
+def user_list_fields(fields_param=None) -> list:
+    """Validate a comma-separated ?fields= selection against USER_LIST_FIELDS"""
+    if not fields_param:
+        return list(USER_LIST_FIELDS)
+    fields = [field.strip() for field in fields_param.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in USER_LIST_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"fields must be a subset of {', '.join(USER_LIST_FIELDS)}")
+    return fields
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
 class LoggingAPIView(APIView):
     """
     Extends DRF’s APIView to log, per authenticated user:
       - request method, path, headers, body
       - response status, body
       - timing: start, end, duration_ms
-    Logs are appended as JSON lines in settings.LOG_DIR/user_<id>.jsonl.
+    Logs are appended as JSON lines in settings.LOG_DIR/user_<id>.jsonl
+    through the buffered sink in accounts.logsink.
     """
 
     def initial(self, request, *args, **kwargs):
@@ -46,17 +67,7 @@ class LoggingAPIView(APIView):
 
         # record start
         request._start_time = datetime.utcnow()
-
-        # minimal request info
-        request._log_data = {
-            "user_id": request.user.id,
-            "username": request.user.get_username(),
-            "timestamp_start": request._start_time.isoformat() + "Z",
-            "request": {
-                "method": request.method,
-                "path": request.get_full_path(),
-            },
-        }
+        request._log_data = start_log_entry(request, request._start_time)
 
     def finalize_response(self, request, response, *args, **kwargs):
         response = super().finalize_response(request, response, *args, **kwargs)
@@ -64,32 +75,62 @@ class LoggingAPIView(APIView):
         if not hasattr(request, "_start_time"):
             return response
 
-        end_time = datetime.utcnow()
-        duration_ms = (end_time - request._start_time).total_seconds() * 1000
+        write_log_entry(request, request._log_data, request._start_time, response.status_code)
+        return response
 
-        # complete the log entry with only status_code
-        log_entry = request._log_data
-        log_entry.update({
-            "timestamp_end": end_time.isoformat() + "Z",
-            "duration_ms": round(duration_ms, 2),
-            "response": {
-                "status_code": response.status_code,
-            }
-        })
 
-        # ensure log dir exists
-        os.makedirs(settings.LOG_DIR, exist_ok=True)
-        logfile = os.path.join(settings.LOG_DIR, f"user_{request.user.id}.jsonl")
+def start_log_entry(request, start_time) -> dict:
+    """Minimal request info for the log entry of an authenticated request"""
+    entry = {
+        "user_id": request.user.id,
+        "username": request.user.get_username(),
+        "timestamp_start": start_time.isoformat() + "Z",
+        "request": {
+            "method": request.method,
+            "path": request.get_full_path(),
+        },
+    }
+    # set by ProfilingMiddleware; profiles are stored under the same id
+    request_id = getattr(request, "request_id", None)
+    if request_id:
+        entry["request_id"] = request_id
+    return entry
+
+
+def write_log_entry(request, log_entry, start_time, status_code):
+    end_time = datetime.utcnow()
+    duration_ms = (end_time - start_time).total_seconds() * 1000
+
+    # complete the log entry with only status_code
+    log_entry.update({
+        "timestamp_end": end_time.isoformat() + "Z",
+        "duration_ms": round(duration_ms, 2),
+        "response": {
+            "status_code": status_code,
+        }
+    })
 
-        with open(logfile, "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
+    timings = metrics.current_timings()
+    if timings is not None:
+        log_entry["timings_ms"] = {
+            phase: round(seconds * 1000, 2) for phase, (seconds, calls) in timings.items() if calls
+        }
 
-        return response
+    # handed to a background writer so file I/O stays off the request thread
+    get_log_sink().write(request.user.id, log_entry)
 
 
-def generate_cache_key(user, url_params=None, time_window=None):
+def generate_cache_key(user, url_params=None, time_window=None, route=None, path_params=None, timestamp=None):
     key_parts = []
 
+    # Include the route and its path parameters so different resources never share a key
+    if route:
+        key_parts.append(f"route-{route}")
+    if path_params:
+        sorted_items = sorted(path_params.items())
+        path_str = "&".join(f"{k}={v}" for k, v in sorted_items)
+        key_parts.append(f"path-{path_str}")
+
     # Include user-specific information
     if user:
         key_parts.append(f"user-{user.id}")
@@ -104,12 +145,13 @@ def generate_cache_key(user, url_params=None, time_window=None):
 
     # Include time window for periodic cache busting (e.g., hourly)
     if time_window:
-        current_window = int(time.time() // time_window)
+        current_window = int((timestamp or time.time()) // time_window)
         key_parts.append(f"time-{current_window}")
 
     # Create a unique cache key by hashing the parts
     raw_key = ":".join(key_parts)
     hashed_key = hashlib.md5(raw_key.encode()).hexdigest()
-    print(hashed_key)
 
+    if route:
+        return f"cache:{route}:{hashed_key}"
     return f"cache:{hashed_key}"
@@ -0,0 +1,16 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.authentication import invalidate_user
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    """Make every worker reload the user on its next request (role changes, deactivation, deletion)"""
+    user_id = instance.pk
+    # after commit, so no worker re-caches the old row in between
+    transaction.on_commit(lambda: invalidate_user(user_id))
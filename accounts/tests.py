@@ -1,3 +1,478 @@
-from django.test import TestCase
+import fcntl
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts import bulk, logrotate, logstore, metrics, profiling, ratelimit
+from accounts.authentication import CachedJWTAuthentication, cached_user_row
+from accounts.hashers import PBKDF2PasswordHasher
+from accounts.logsink import RequestLogSink
+from h4ev import settings
+from h4ev.process import per_process
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        caches["users"].clear()
+        self.auth = CachedJWTAuthentication()
+
+    def authenticate(self, user):
+        token = self.auth.get_validated_token(str(RefreshToken.for_user(user).access_token))
+        return self.auth.get_user(token)
+
+    def test_cached_user_keeps_its_fields(self):
+        user = User.objects.create_user(username="alice", password="secret", role="viewer")
+
+        # the first call fills the cache from the database, the second is served from it
+        for _ in range(2):
+            authenticated = self.authenticate(user)
+            self.assertEqual(authenticated.pk, user.pk)
+            self.assertEqual(authenticated.username, "alice")
+            self.assertEqual(authenticated.role, "viewer")
+            self.assertTrue(authenticated.is_active)
+            self.assertFalse(authenticated.is_staff)
+            self.assertFalse(authenticated.is_superuser)
+
+    def test_cache_hit_runs_no_query(self):
+        user = User.objects.create_user(username="bob", password="secret", role="viewer")
+        self.authenticate(user)
+        with self.assertNumQueries(0):
+            self.authenticate(user)
+
+    def test_saving_a_user_drops_the_cached_row(self):
+        user = User.objects.create_user(username="carol", password="secret", role="viewer")
+        self.authenticate(user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.role = "admin"
+            user.is_active = False
+            user.save()
+
+        self.assertEqual(cached_user_row(user.pk)["role"], "admin")
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(user)
+
+
+class UserLoginTests(TestCase):
+    url = "/api/accounts/login/"
+
+    def setUp(self):
+        ratelimit.get_cache().clear()
+        self.client = APIClient()
+
+    def login(self, password):
+        return self.client.post(self.url, {"username": "nurse", "password": password}, format="json")
+
+    def test_outdated_hashes_are_upgraded_on_login(self):
+        outdated = PBKDF2PasswordHasher().encode("secret", "saltsalt", iterations=1000)
+        user = User.objects.create(username="nurse", password=outdated)
+        response = self.login("secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(RefreshToken(response.json()["refresh"]))
+
+        user.refresh_from_db()
+        algorithm, iterations, salt, digest = user.password.split("$")
+        self.assertEqual(int(iterations), settings.ACCOUNTS["PBKDF2_ITERATIONS"])
+        self.assertEqual(self.login("secret").status_code, 200)
+
+    def test_repeated_failures_are_refused_before_hashing(self):
+        User.objects.create_user(username="nurse", password="secret")
+        with mock.patch.dict(settings.ACCOUNTS, {"LOGIN_MAX_FAILURES_PER_USERNAME": 2}):
+            self.assertEqual(self.login("wrong").status_code, 401)
+            self.assertEqual(self.login("wrong").status_code, 401)
+            with mock.patch("accounts.views.authenticate") as authenticate:
+                # even the right password waits out the window
+                response = self.login("secret")
+                authenticate.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+
+
+class PerProcessTests(TestCase):
+
+    def test_builds_once_per_process_and_arguments(self):
+        built = []
+
+        @per_process
+        def get_pool(size):
+            built.append(size)
+            return object()
+
+        self.assertIs(get_pool(2), get_pool(2))
+        self.assertIsNot(get_pool(2), get_pool(4))
+        self.assertEqual(built, [2, 4])
+
+        first = get_pool(2)
+        with mock.patch("h4ev.process.os.getpid", return_value=os.getpid() + 1):
+            # a forked worker gets its own
+            self.assertIsNot(get_pool(2), first)
+            self.assertIs(get_pool(2), get_pool(2))
+        self.assertEqual(built, [2, 4, 2])
+
+
+class LogMaintenanceTests(TestCase):
+    config = {
+        "ROTATE_INTERVAL": "daily",
+        "COMPRESSION": "gzip",
+        "COMPRESS_MIN_AGE": 60,
+        "RETENTION_DAYS": 30,
+    }
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+
+    def write(self, relative, age_days=0):
+        path = os.path.join(self.log_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write('{"user_id": 1}\n')
+        modified = time.time() - age_days * 86400 - 120
+        os.utime(path, (modified, modified))
+        return path
+
+    def files(self):
+        return sorted(os.path.relpath(path, self.log_dir) for path in logrotate.iter_files(self.log_dir))
+
+    def test_per_user_layout(self):
+        self.write("user_1.jsonl")
+        self.write("user_1.20200101T000000.jsonl", age_days=40)
+        self.write("user_1.20200102T000000.jsonl.gz", age_days=40)
+        # a rotation boundary has passed since the last pass
+        with open(os.path.join(self.log_dir, ".last-rotation"), "w") as f:
+            f.write("0")
+
+        logrotate.run_maintenance(self.log_dir, {**self.config, "LAYOUT": "per_user"})
+
+        files = [name for name in self.files() if not name.startswith(".")]
+        self.assertEqual(len(files), 1)
+        self.assertRegex(files[0], r"^user_1\.\d{8}T\d{6}\.jsonl\.gz$")
+
+    def test_partitioned_layout(self):
+        today = logrotate.utc_today()
+        yesterday = (today - timedelta(days=1)).isoformat()
+        expired = (today - timedelta(days=31)).isoformat()
+        for day in (today.isoformat(), yesterday, expired):
+            self.write(f"{day}/requests.jsonl")
+            self.write(f"{day}/requests.idx")
+        self.write(f"{expired}/requests.20200101T000000.jsonl.gz")
+
+        logrotate.run_maintenance(self.log_dir, {**self.config, "LAYOUT": "partitioned"})
+
+        self.assertEqual(
+            [name for name in self.files() if not name.startswith(".")],
+            sorted([
+                f"{today.isoformat()}/requests.idx",
+                f"{today.isoformat()}/requests.jsonl",
+                f"{yesterday}/requests.idx.gz",
+                f"{yesterday}/requests.jsonl.gz",
+            ]),
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.log_dir, expired)))
+
+
+class GetAllUsersTests(TestCase):
+    url = "/api/accounts/users/get/all/"
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([User(username=f"user{i:02}", role="viewer") for i in range(25)])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(username="user00"))
+
+    def test_anonymous_clients_are_rejected(self):
+        for query in ("", "?stream=ndjson", "?paginate=true"):
+            self.assertEqual(APIClient().get(self.url + query).status_code, 401, query)
+
+    def test_lists_every_user_by_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 25)
+        self.assertEqual(
+            response.json()[0],
+            {"id": response.json()[0]["id"], "username": "user00", "first_name": "", "last_name": "", "role": "viewer"},
+        )
+
+    def test_paginate_walks_every_user_once(self):
+        usernames = []
+        url = self.url + "?paginate=true&page_size=10&fields=username"
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 10)
+            usernames += [row["username"] for row in page["results"]]
+            self.assertTrue(all(list(row) == ["username"] for row in page["results"]))
+            url = page["next"]
+        self.assertEqual(usernames, [f"user{i:02}" for i in range(25)])
+
+    def test_unknown_fields_are_rejected(self):
+        self.assertEqual(self.client.get(self.url + "?fields=password").status_code, 400)
+
+
+class RequestLogSinkTests(TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        patcher = mock.patch.dict(settings.REQUEST_LOG, {"INGEST_INTERVAL": 0, "LAYOUT": "per_user"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sink(self, **options):
+        sink = RequestLogSink(log_dir=self.log_dir, flush_interval=0.05, **options)
+        self.addCleanup(sink.close)
+        return sink
+
+    def lines(self, user_id=1):
+        with open(os.path.join(self.log_dir, f"user_{user_id}.jsonl")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_full_queue_drops_entries(self):
+        sink = self.sink(queue_size=1, full_policy="drop")
+        with mock.patch.object(sink, "ensure_started"):
+            sink.write(1, {"n": 1})
+            started = time.monotonic()
+            sink.write(1, {"n": 2})
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual((sink.counters["dropped"], sink.queue.qsize()), (1, 1))
+
+    def test_full_queue_blocks_until_room_or_timeout(self):
+        sink = self.sink(queue_size=1, full_policy="block", block_timeout=0.2)
+        with mock.patch.object(sink, "ensure_started"):
+            sink.write(1, {"n": 1})
+            started = time.monotonic()
+            sink.write(1, {"n": 2})
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+            self.assertEqual(sink.counters["dropped"], 1)
+
+            # room freed within BLOCK_TIMEOUT takes the entry
+            threading.Timer(0.05, sink.queue.get).start()
+            sink.write(1, {"n": 3})
+        self.assertEqual(sink.counters["dropped"], 1)
+        self.assertEqual(sink.queue.get_nowait(), (1, {"n": 3}))
+
+    def test_close_writes_everything_queued(self):
+        sink = self.sink()
+        with mock.patch.object(sink, "ensure_started"):
+            for n in range(3):
+                sink.write(1, {"n": n})
+        sink.write(2, {"n": 3})
+        sink.close()
+        self.assertEqual(self.lines(1), [{"n": 0}, {"n": 1}, {"n": 2}])
+        self.assertEqual(self.lines(2), [{"n": 3}])
+        self.assertEqual(sink.stats()["queued"], 0)
+
+
+class LogStoreTests(TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+        self.store = os.path.join(self.log_dir, "requests.sqlite3")
+        start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        requests = [(1, "alice", duration) for duration in range(1, 101)] + [(2, "bob", 7)]
+        with open(os.path.join(self.log_dir, "user_1.jsonl"), "w") as f:
+            for index, (user_id, username, duration) in enumerate(requests):
+                f.write(json.dumps({
+                    "user_id": user_id,
+                    "username": username,
+                    "timestamp_start": (start + timedelta(seconds=index)).isoformat(),
+                    "duration_ms": duration,
+                    "request": {"method": "GET", "path": f"/api/onadata/form/{user_id}/"},
+                    "response": {"status_code": 200 if duration % 10 else 500},
+                }) + "\n")
+
+    def test_percentiles_overall_and_per_group(self):
+        self.assertEqual(logstore.ingest(self.log_dir, self.store)["rows"], 101)
+        # a second run only looks for new lines
+        self.assertEqual(logstore.ingest(self.log_dir, self.store)["rows"], 0)
+
+        result = logstore.query(group_by="user", store=self.store)
+        self.assertEqual(result["requests"], 101)
+        self.assertEqual(
+            [result[f"p{p}_ms"] for p in logstore.PERCENTILES],
+            [50, 90, 95, 99],
+        )
+        alice, bob = result["groups"]
+        self.assertEqual((alice["user"], alice["p50_ms"], alice["p99_ms"], alice["error_rate_5xx"]), (1, 50, 99, 0.1))
+        self.assertEqual((bob["user"], bob["p50_ms"], bob["p99_ms"]), (2, 7, 7))
+
+        filtered = logstore.query({"status": "5xx"}, store=self.store)
+        self.assertEqual((filtered["requests"], filtered["p50_ms"], filtered["p99_ms"]), (10, 50, 100))
+
+    def test_ingest_waits_for_or_skips_a_running_ingest(self):
+        fd = os.open(f"{self.store}.ingest.lock", os.O_RDWR | os.O_CREAT)
+        self.addCleanup(os.close, fd)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self.assertIsNone(logstore.ingest_pending(self.log_dir, self.store))
+        waiting = threading.Thread(target=logstore.ingest, args=(self.log_dir, self.store))
+        waiting.start()
+        waiting.join(0.2)
+        self.assertTrue(waiting.is_alive())
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(logstore.query(store=self.store)["requests"], 101)
+
+    def test_stats_view_reads_the_store_without_ingesting(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="admin", password="secret", is_staff=True))
+        with mock.patch.object(logstore, "ingest") as ingest, mock.patch.object(logstore, "query", return_value={}):
+            self.assertEqual(client.get("/api/accounts/logs/stats/").status_code, 200)
+            ingest.assert_not_called()
+            client.get("/api/accounts/logs/stats/?ingest=true")
+            ingest.assert_called_once()
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.redis = metrics.get_redis()
+        self.redis.delete(metrics.REDIS_KEY)
+        self.client = APIClient()
+
+    def test_flush_adds_counters_into_the_shared_hash(self):
+        for _ in range(2):
+            registry = metrics.Registry()
+            registry.inc("h4ev_http_requests_total", {"route": "users", "method": "GET", "status": 200})
+            metrics.flush(registry)
+            self.assertEqual(registry.snapshot(), {})
+        key = 'h4ev_http_requests_total{route="users",method="GET",status="200"}'
+        self.assertEqual(float(self.redis.hget(metrics.REDIS_KEY, key)), 2)
+
+        # a failed flush keeps the counters for the next one
+        registry.inc("h4ev_http_requests_total", {"route": "users", "method": "GET", "status": 200})
+        with mock.patch.object(metrics, "get_redis", return_value=mock.Mock(pipeline=mock.Mock(side_effect=OSError))):
+            metrics.flush(registry)
+        self.assertEqual(registry.snapshot(), {key: 1})
+
+    def test_endpoint_renders_every_workers_counters_for_admins(self):
+        registry = metrics.Registry()
+        for result in ("hit", "hit", "stale", "miss"):
+            registry.inc("onadata_cache_lookups_total", {"route": "form_submissions", "result": result})
+        registry.observe("onadata_upstream_request_duration_seconds", {}, 0.3)
+        metrics.flush(registry)
+
+        self.assertIn(self.client.get("/metrics").status_code, (401, 403))
+        self.client.force_authenticate(User.objects.create_user(username="plain", password="secret"))
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.client.force_authenticate(User.objects.create_user(username="admin", password="secret", is_staff=True))
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        for line in (
+            "# TYPE onadata_cache_lookups_total counter",
+            'onadata_cache_lookups_total{route="form_submissions",result="hit"} 2',
+            'onadata_cache_hit_ratio{route="form_submissions"} 0.75',
+            "# TYPE onadata_upstream_request_duration_seconds histogram",
+            'onadata_upstream_request_duration_seconds_bucket{le="0.5"} 1',
+            'onadata_upstream_request_duration_seconds_bucket{le="+Inf"} 1',
+            "onadata_upstream_request_duration_seconds_count 1",
+        ):
+            self.assertIn(line, lines)
+        # buckets run in increasing le order, ending with +Inf
+        buckets = [line for line in lines if line.startswith("onadata_upstream_request_duration_seconds_bucket")]
+        self.assertEqual([line.split('"')[1] for line in buckets], ["0.5", "1.0", "2.5", "5.0", "10.0", "+Inf"])
+
+    def test_token_replaces_the_admin_check(self):
+        with mock.patch.dict(settings.METRICS, {"TOKEN": "scrape"}):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape").status_code, 200)
+
+
+class ProfileStorageTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.dict(settings.PROFILING, {"DIR": directory, "SLOW_MS": 1})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reused_request_ids_keep_separate_profiles(self):
+        names = []
+        for _ in range(2):
+            request = RequestFactory().get("/api/accounts/users/get/all/", HTTP_X_REQUEST_ID="same-id")
+            request.request_id = profiling.request_id(request)
+            names.append(profiling.save(request, 200, 1.0, samples=Counter({"view (accounts/views.py:1)": 3})))
+
+        self.assertNotEqual(names[0], names[1])
+        self.assertEqual([profile["name"] for profile in profiling.list_profiles()], sorted(names, reverse=True))
+        for name in names:
+            self.assertRegex(name, r"-same-id-[0-9a-f]{8}\.folded$")
+            self.assertIsNotNone(profiling.profile_path(name))
+        self.assertIsNone(profiling.profile_path("20240501T000000-same-id.folded"))
+
+
+class ImportUsersTests(TestCase):
+    url = "/api/accounts/users/import/"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="admin", password="secret", is_staff=True))
+
+    def test_csv_with_a_charset_is_imported(self):
+        for username, content_type in (("csv1", "text/csv"), ("csv2", "text/csv; charset=utf-8")):
+            body = f"username,password,role\n{username},Str0ng-pass-1,viewer\n"
+            response = self.client.post(self.url, body, content_type=content_type)
+            self.assertEqual(response.status_code, 201, content_type)
+        self.assertEqual(User.objects.filter(role="viewer").count(), 2)
+
+    def test_failed_rows_are_reported_and_the_rest_created(self):
+        User.objects.create_user(username="taken", password="secret")
+        rows = [
+            {"username": "new1", "password": "Str0ng-pass-1", "role": "viewer"},
+            {"username": "taken", "password": "Str0ng-pass-1", "role": "viewer"},
+            {"username": "new1", "password": "Str0ng-pass-1", "role": "viewer"},
+            {"username": "new2", "role": "viewer"},
+            "not a user",
+            {"username": "new3", "password": "Str0ng-pass-1", "role": "viewer"},
+        ]
+        result = self.client.post(self.url, rows, format="json").json()
+        self.assertEqual((result["rows"], result["created"], result["failed"]), (6, 2, 4))
+        self.assertEqual([(error["row"], error["username"]) for error in result["errors"]],
+                         [(2, "taken"), (3, "new1"), (4, "new2"), (5, None)])
+        self.assertIn("password", result["errors"][2]["errors"])
+        self.assertEqual(User.objects.filter(username__in=["new1", "new3"]).count(), 2)
+
+    def test_oversized_body_is_rejected(self):
+        with mock.patch.dict(settings.ACCOUNTS, {"IMPORT_MAX_BYTES": 10}):
+            response = self.client.post(self.url, [{"username": "big", "password": "Str0ng-pass-1"}], format="json")
+        self.assertEqual(response.status_code, 413)
+
+    def test_usernames_taken_during_the_batch_are_retried(self):
+        # a signup took "raced" between the batch's uniqueness check and its insert
+        User.objects.create_user(username="raced", password="secret")
+        valid = [
+            (1, {"username": "fresh", "password": "x", "role": "viewer"}),
+            (2, {"username": "raced", "password": "x", "role": "viewer"}),
+        ]
+        created, errors = bulk.insert_batch(valid)
+        self.assertEqual(created, 1)
+        self.assertEqual([(error["row"], error["username"]) for error in errors], [(2, "raced")])
+        self.assertTrue(User.objects.filter(username="fresh").exists())
+
+    def test_ndjson_rows_are_read_lazily(self):
+        stream = io.StringIO('{"username": "a"}\n\n{"username": "b"}\nnot json\n')
+        rows = bulk.read_rows(stream, "ndjson")
+        self.assertEqual([next(rows), next(rows)], [{"username": "a"}, {"username": "b"}])
+        with self.assertRaises(ValueError):
+            next(rows)
@@ -1,17 +1,21 @@
+import hmac
+import itertools
 import json
 import os
 import traceback
 from datetime import datetime
 
 from django.contrib.auth import get_user_model, authenticate
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import status
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from accounts import exceptions, services, serializers
+from accounts import bulk, exceptions, logstore, metrics, profiling, ratelimit, services, serializers
+from accounts.pagination import UserCursorPagination
 from accounts.serializers import UserSerializer
 from accounts.services import LoggingAPIView
 from h4ev import settings
@@ -103,8 +107,24 @@ class UserLoginView(APIView):
         # sanitized_username = sanitization_utils.strip_xss(unsafe_username)
         # sanitized_password = sanitization_utils.strip_xss(unsafe_password)
 
+        # Refuse before hashing anything while this username or IP has too many failed logins
+        ip = ratelimit.client_ip(request)
+        retry_after = ratelimit.login_retry_after(str(unsafe_username), ip)
+        if retry_after is not None:
+            response = Response(
+                {"message": "too many failed login attempts, try again later"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+            response["Retry-After"] = str(retry_after)
+            return response
+
         # Authenticate user with sanitized data
-        user = authenticate(username=unsafe_username, password=unsafe_password)
+        user = authenticate(request, username=unsafe_username, password=unsafe_password)
+
+        if user is None:
+            ratelimit.record_login_failure(str(unsafe_username), ip)
+        else:
+            ratelimit.reset_login_failures(str(unsafe_username))
 
         if user is not None:
             if user.is_active:
@@ -137,17 +157,76 @@ class UserLoginView(APIView):
 
 
 class GetAllUsersView(LoggingAPIView):
-    """Get all users view"""
+    """
+    Get all users, ordered by id, as a list. ?paginate=true returns one page
+    at a time instead: the response carries `results` and `next` / `previous`
+    cursor links, and ?page_size=n sets the page size. ?fields=id,username
+    selects columns. ?stream=ndjson streams every user, one JSON object per line.
+    """
 
     # logger.info("Retrieving all users")
 
-    permission_classes = [AllowAny,]
+    permission_classes = [IsAuthenticated]
     serializer_class = UserSerializer
 
     def get(self, request):
-        user = User.objects.all()
-        serializer = UserSerializer(user, many=True)
-        return Response(serializer.data, status=200)
+        try:
+            fields = services.user_list_fields(request.GET.get("fields"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # plain dicts of the selected columns: no model instances or serializer per row
+        users = User.objects.order_by("id")
+
+        if request.GET.get("stream") == "ndjson":
+            rows = users.values(*fields).iterator(chunk_size=settings.ACCOUNTS["USERS_STREAM_CHUNK_SIZE"])
+            return StreamingHttpResponse(services.ndjson_lines(rows), content_type="application/x-ndjson")
+
+        if request.GET.get("paginate", "").lower() != "true":
+            # the original response: every user in one list
+            return Response(list(users.values(*fields)), status=status.HTTP_200_OK)
+
+        paginator = UserCursorPagination()
+        # the cursor is built from the id of the last row, so it is always fetched
+        page = paginator.paginate_queryset(users.values(*fields, *({"id"} - set(fields))), request, view=self)
+        if "id" not in fields:
+            page = [{field: row[field] for field in fields} for row in page]
+        return paginator.get_paginated_response(page)
+
+
+class ImportUsersView(LoggingAPIView):
+    """
+    Create many users at once (admin only). The body is a JSON list of users,
+    {"users": [...]}, or a text/csv body with a header line, with the fields
+    of CreateUserView. Valid rows are created even when others fail; the
+    response lists the failed rows with their errors.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        # the body is parsed in memory, so its size is capped before reading it
+        max_bytes = settings.ACCOUNTS["IMPORT_MAX_BYTES"]
+        if int(request.META.get("CONTENT_LENGTH") or 0) > max_bytes:
+            return Response(
+                {"error": f"at most {max_bytes} bytes per request; use `manage.py import_users` for larger files"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        try:
+            rows = bulk.rows_from_request(request)
+        except (ValueError, UnicodeDecodeError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_rows = settings.ACCOUNTS["IMPORT_MAX_ROWS"]
+        rows = list(itertools.islice(rows, max_rows + 1))
+        if len(rows) > max_rows:
+            return Response(
+                {"error": f"at most {max_rows} users per request; use `manage.py import_users` for larger files"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        result = bulk.import_users(rows)
+        return Response(result, status=status.HTTP_201_CREATED if result["created"] else status.HTTP_400_BAD_REQUEST)
 
 
 class RetrieveUpdateDeleteUserView(LoggingAPIView):
@@ -177,3 +256,98 @@ class RetrieveUpdateDeleteUserView(LoggingAPIView):
         return Response(
             {"message": f"user with id {user_id} deleted successfully"}, status=204
         )
+
+
+class RequestLogStatsView(LoggingAPIView):
+    """
+    Latency percentiles, throughput and error rates from the request logs.
+    Filters: user, path, route, status, since, until; breakdowns: group_by
+    (user, path, route, status), per_minute=true. The store is filled in the
+    background every INGEST_INTERVAL; ingest=true loads new lines first.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.GET
+        filters = {name: params.get(name) for name in ("user", "path", "route", "status", "since", "until")}
+        group_by = params.get("group_by")
+        if group_by and group_by not in logstore.GROUP_COLUMNS:
+            return Response(
+                {"error": f"group_by must be one of {', '.join(sorted(logstore.GROUP_COLUMNS))}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = params.get("limit", "20")
+        if not limit.isdigit():
+            return Response({"error": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if params.get("ingest", "").lower() == "true":
+            logstore.ingest()
+
+        try:
+            result = logstore.query(
+                filters,
+                group_by=group_by,
+                limit=int(limit),
+                per_minute=params.get("per_minute", "").lower() == "true",
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class ProfileListView(LoggingAPIView):
+    """Stored request profiles (accounts.profiling), newest first; ?limit= caps the list"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        limit = request.GET.get("limit", "100")
+        if not limit.isdigit():
+            return Response({"error": "limit must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"profiles": profiling.list_profiles(int(limit))}, status=status.HTTP_200_OK)
+
+
+class ProfileDownloadView(LoggingAPIView):
+    """
+    Download a stored profile. ?summary=true returns a pstats summary of a
+    cProfile profile instead, sorted by ?sort= (default cumulative).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        path = profiling.profile_path(name)
+        if path is None:
+            return Response({"error": "profile not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if request.GET.get("summary", "").lower() == "true" and name.endswith(".prof"):
+            try:
+                text = profiling.profile_text(path, sort=request.GET.get("sort", "cumulative"))
+            except KeyError as e:
+                return Response({"error": f"unknown sort key {e}"}, status=status.HTTP_400_BAD_REQUEST)
+            return HttpResponse(text, content_type="text/plain; charset=utf-8")
+        content_type = "application/octet-stream" if name.endswith(".prof") else "text/plain; charset=utf-8"
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=name, content_type=content_type)
+
+
+class MetricsView(APIView):
+    """
+    Prometheus metrics summed over every worker: request counts and latency
+    histograms per route, time per phase, Onadata latency and cache hit
+    ratios. Requires "Authorization: Bearer <METRICS_TOKEN>" when set, and
+    an admin user otherwise.
+    """
+
+    def get_authenticators(self):
+        # the scrape token is not a JWT
+        return [] if settings.METRICS["TOKEN"] else super().get_authenticators()
+
+    def get_permissions(self):
+        return [AllowAny()] if settings.METRICS["TOKEN"] else [IsAdminUser()]
+
+    def get(self, request):
+        token = settings.METRICS["TOKEN"]
+        if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return HttpResponse(status=401)
+        return HttpResponse(
+            metrics.render(metrics.collect()),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
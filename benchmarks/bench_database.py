@@ -0,0 +1,169 @@
+"""
+Concurrent user creation and login throughput under each database
+configuration (h4ev/settings.py DATABASES and SQLITE_PRAGMAS):
+
+  sqlite-rollback     the old default: rollback journal, deferred transactions,
+                      no pragmas, a new connection per request
+  sqlite-wal          WAL, BEGIN IMMEDIATE and the other pragmas, persistent connections
+  postgres            persistent connections with health checks   (POSTGRES_HOST set)
+  postgres-reconnect  a new connection per request                (POSTGRES_HOST set)
+
+Each configuration runs in its own process, since the database settings
+are read at startup, through CreateUserView and UserLoginView: creates
+alone, logins alone, then both at once.
+
+    python -m benchmarks.bench_database --threads 8 --creates 200 --logins 400 --json report.json
+
+Password hashing is turned down to --iterations PBKDF2 rounds so it does
+not hide the database. SQLite runs on a fresh file in a temporary
+directory; Postgres on a throwaway test database.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+SQLITE_PRAGMA_ENV = (
+    "SQLITE_JOURNAL_MODE", "SQLITE_SYNCHRONOUS",
+    "SQLITE_CACHE_SIZE", "SQLITE_TEMP_STORE", "SQLITE_MMAP_SIZE",
+)
+CONFIGS = {
+    "sqlite-rollback": {
+        "DATABASE_ENGINE": "sqlite", "DATABASE_CONN_MAX_AGE": "0", "SQLITE_TRANSACTION_MODE": "DEFERRED",
+        **{name: "" for name in SQLITE_PRAGMA_ENV},
+    },
+    "sqlite-wal": {"DATABASE_ENGINE": "sqlite", "DATABASE_CONN_MAX_AGE": "60"},
+    "postgres": {"DATABASE_ENGINE": "postgres", "DATABASE_CONN_MAX_AGE": "60"},
+    "postgres-reconnect": {"DATABASE_ENGINE": "postgres", "DATABASE_CONN_MAX_AGE": "0"},
+}
+PASSWORD = "correct horse battery staple"
+
+
+def default_configs() -> list:
+    return [name for name in CONFIGS if name.startswith("sqlite") or os.environ.get("POSTGRES_HOST")]
+
+
+def run_worker(config, args):
+    """One configuration's phases, in this process"""
+    from benchmarks import harness
+
+    harness.setup_django()
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test import Client
+
+    def phases():
+        User = get_user_model()
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([User(username=f"bench{i}", password=password, role="bench") for i in range(args.users)])
+        local = threading.local()
+
+        def client():
+            if not hasattr(local, "client"):
+                local.client = Client()
+            return local.client
+
+        def create(index, prefix):
+            response = client().post(
+                "/api/accounts/create/user/",
+                {"username": f"{prefix}{index}", "password": PASSWORD, "role": "bench"},
+                content_type="application/json",
+            )
+            return response.status_code == 201
+
+        def login(index):
+            response = client().post(
+                "/api/accounts/login/",
+                {"username": f"bench{index % args.users}", "password": PASSWORD},
+                content_type="application/json",
+            )
+            return response.status_code == 200
+
+        return {
+            "creates": harness.load(lambda index: create(index, "new"), args.creates, args.threads),
+            "logins": harness.load(login, args.logins, args.threads),
+            "mixed": harness.load(
+                lambda index: create(index, "mixed") if index % 2 else login(index), args.creates + args.logins,
+                args.threads,
+            ),
+        }
+
+    if connection.vendor == "sqlite":
+        # a fresh file from the parent, so the journal mode and locking are the real ones
+        call_command("migrate", verbosity=0)
+        results = phases()
+    else:
+        with harness.test_database():
+            results = phases()
+    results["vendor"] = connection.vendor
+    return results
+
+
+def run(configs, args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="h4ev-bench-db-") as directory:
+        for config in configs:
+            result_file = os.path.join(directory, f"{config}.json")
+            env = {
+                **os.environ,
+                **CONFIGS[config],
+                "SQLITE_PATH": os.path.join(directory, f"{config}.sqlite3"),
+                "ACCOUNTS_PBKDF2_ITERATIONS": str(args.iterations),
+                "ACCOUNTS_PASSWORD_HASHER": "pbkdf2",
+                "ACCOUNTS_LOGIN_HASH_WORKERS": "0",
+                "ACCOUNTS_LOGIN_RATE_LIMIT": "false",
+            }
+            command = [
+                sys.executable, "-m", "benchmarks.bench_database", "--worker", config, "--result-file", result_file,
+                "--threads", str(args.threads), "--users", str(args.users),
+                "--creates", str(args.creates), "--logins", str(args.logins),
+            ]
+            completed = subprocess.run(command, env=env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"{config} failed:\n{completed.stderr[-2000:]}")
+                continue
+            with open(result_file) as f:
+                results[config] = json.load(f)
+            for phase in ("creates", "logins", "mixed"):
+                row = results[config][phase]
+                print(
+                    f"{config:>18} {phase:>7}  {row['requests_per_s']:>8.1f} req/s  p50 {row['p50_ms']:>8.2f} ms  "
+                    f"p95 {row['p95_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms  errors {row['errors']}"
+                )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=None,
+                        help="defaults to the SQLite ones, plus Postgres when POSTGRES_HOST is set")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent requests")
+    parser.add_argument("--users", type=int, default=50, help="existing users the logins spread over")
+    parser.add_argument("--creates", type=int, default=200)
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--iterations", type=int, default=1000, help="PBKDF2 iterations for the run")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--worker", choices=list(CONFIGS), help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        results = run_worker(args.worker, args)
+        with open(args.result_file, "w") as f:
+            json.dump(results, f)
+        return
+
+    results = run(args.configs or default_configs(), args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "database", **results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Login throughput: cost of each password hasher at the configured work
+factors, token issuance, and concurrent logins through UserLoginView with
+passwords checked inline or on the hashing process pool. While logins run,
+a probe thread times a cheap request to show how much the hashing starves
+the rest of the worker.
+
+    python -m benchmarks.bench_login --users 20 --logins 200 --threads 8 --json report.json
+
+Runs against a throwaway test database; login rate limiting is disabled.
+"""
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import harness
+from benchmarks.harness import best_of, percentile
+
+harness.setup_django()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.utils.module_loading import import_string  # noqa: E402
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+
+from h4ev import settings  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+PROBE_PATH = "/api/accounts/users/get/all/?paginate=true&page_size=1"
+
+
+def bench_hashers(repeat):
+    results = []
+    for name, path in settings.PASSWORD_HASHER_CLASSES.items():
+        hasher = import_string(path)()
+        try:
+            encoded = hasher.encode(PASSWORD, hasher.salt())
+        except ValueError as e:
+            print(f"skipping {name}: {e}")
+            continue
+        verify_s = best_of(repeat, lambda: hasher.verify(PASSWORD, encoded))
+        row = {"hasher": name, "verify_ms": round(verify_s * 1000, 2), "verifies_per_core_s": round(1 / verify_s, 1)}
+        results.append(row)
+        print(f"{name:>8}  verify {row['verify_ms']:>9.2f} ms  ({row['verifies_per_core_s']:>8.1f}/s per core)")
+    return results
+
+
+def bench_tokens(user, repeat):
+    def issue():
+        refresh = RefreshToken.for_user(user)
+        return str(refresh), str(refresh.access_token)
+
+    issue_s = best_of(repeat, issue)
+    print(f"   token  issue  {issue_s * 1000:>9.3f} ms")
+    return {"token_issue_ms": round(issue_s * 1000, 3)}
+
+
+def bench_logins(usernames, logins, threads, workers):
+    settings.ACCOUNTS["LOGIN_HASH_WORKERS"] = workers
+    client = Client()
+    # warm up the pool and the connection so the first timings are not skewed
+    client.post("/api/accounts/login/", {"username": usernames[0], "password": PASSWORD},
+                content_type="application/json")
+
+    probe_ms = []
+    done = threading.Event()
+
+    token = RefreshToken.for_user(get_user_model().objects.get(username=usernames[0])).access_token
+
+    def probe():
+        probe_client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+        while not done.is_set():
+            start = time.perf_counter()
+            probe_client.get(PROBE_PATH)
+            probe_ms.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.01)
+
+    def login(index):
+        start = time.perf_counter()
+        response = Client().post(
+            "/api/accounts/login/",
+            {"username": usernames[index % len(usernames)], "password": PASSWORD},
+            content_type="application/json",
+        )
+        assert response.status_code == 200, response.content
+        return (time.perf_counter() - start) * 1000
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(login, range(logins)))
+    seconds = time.perf_counter() - start
+    done.set()
+    prober.join()
+
+    row = {
+        "mode": f"pool({workers})" if workers else "inline",
+        "logins_per_s": round(logins / seconds, 1),
+        "login_p50_ms": round(percentile(latencies, 0.5), 1),
+        "login_p95_ms": round(percentile(latencies, 0.95), 1),
+        "probe_p50_ms": round(statistics.median(probe_ms), 1) if probe_ms else None,
+        "probe_p95_ms": round(percentile(probe_ms, 0.95), 1) if probe_ms else None,
+    }
+    print(
+        f"{row['mode']:>10}  {row['logins_per_s']:>7.1f} logins/s  login p50 {row['login_p50_ms']:>7.1f} ms "
+        f"p95 {row['login_p95_ms']:>7.1f} ms  probe p50 {row['probe_p50_ms']} ms p95 {row['probe_p95_ms']} ms"
+    )
+    return row
+
+
+def run(users, logins, threads, workers, repeat):
+    settings.ACCOUNTS["LOGIN_RATE_LIMIT"] = False
+    with harness.test_database():
+        User = get_user_model()
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(username=f"bench{i}", password=password, role="bench") for i in range(users)
+        ])
+        usernames = [f"bench{i}" for i in range(users)]
+
+        results = {"hashers": bench_hashers(repeat)}
+        results.update(bench_tokens(User.objects.get(username=usernames[0]), repeat))
+        results["logins"] = [bench_logins(usernames, logins, threads, count) for count in (0, *workers)]
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent login requests")
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1],
+                        help="hashing pool sizes to compare with inline hashing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.users, args.logins, args.threads, args.workers, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "login", **results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare bytes stored and encode/decode time of the Onadata cache
+serializer/compressor combinations on submission-shaped payloads.
+
+    python -m benchmarks.cache_serialization --sizes 100 10000 --json report.json
+"""
+import argparse
+import json
+import time
+
+from django.utils.module_loading import import_string
+
+from benchmarks.payloads import make_submissions
+
+SERIALIZERS = {
+    "pickle": "django_redis.serializers.pickle.PickleSerializer",
+    "json": "django_redis.serializers.json.JSONSerializer",
+    "msgpack": "django_redis.serializers.msgpack.MSGPackSerializer",
+    "orjson": "onadata.cache_serializers.OrjsonSerializer",
+}
+COMPRESSORS = ["none", "zlib", "lz4", "zstd"]
+
+
+def build(serializer_name, compressor_name, min_length):
+    options = {"COMPRESS_ALGORITHM": compressor_name, "COMPRESS_MIN_LENGTH": min_length}
+    serializer = import_string(SERIALIZERS[serializer_name])(options=options)
+    compressor = None
+    if compressor_name != "none":
+        from onadata.cache_serializers import ThresholdCompressor
+        compressor = ThresholdCompressor(options)
+    return serializer, compressor
+
+
+def best_of(repeat, func):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def measure(payload, serializer, compressor, repeat):
+    def encode():
+        value = serializer.dumps(payload)
+        return compressor.compress(value) if compressor else value
+
+    encode_s, stored = best_of(repeat, encode)
+
+    def decode():
+        value = compressor.decompress(stored) if compressor and stored[:1] == compressor.header else stored
+        return serializer.loads(value)
+
+    decode_s, _ = best_of(repeat, decode)
+    return {
+        "bytes": len(stored),
+        "encode_ms": round(encode_s * 1000, 3),
+        "decode_ms": round(decode_s * 1000, 3),
+    }
+
+
+def run(sizes, repeat, min_length):
+    results = []
+    for size in sizes:
+        payload = make_submissions(size)
+        for serializer_name in SERIALIZERS:
+            for compressor_name in COMPRESSORS:
+                try:
+                    serializer, compressor = build(serializer_name, compressor_name, min_length)
+                except Exception as e:
+                    print(f"skipping {serializer_name}+{compressor_name}: {e}")
+                    continue
+                row = {
+                    "submissions": size,
+                    "serializer": serializer_name,
+                    "compressor": compressor_name,
+                    **measure(payload, serializer, compressor, repeat),
+                }
+                results.append(row)
+                print(
+                    f"{size:>7} {serializer_name:>8} {compressor_name:>5} "
+                    f"{row['bytes']:>12,} B  encode {row['encode_ms']:>9.3f} ms  decode {row['decode_ms']:>9.3f} ms"
+                )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-length", type=int, default=1024)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.min_length)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "cache_serialization", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
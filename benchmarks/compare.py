@@ -0,0 +1,127 @@
+"""
+Compare two benchmark reports (benchmarks.suite, or any single benchmark's
+--json output) metric by metric, e.g. the base and head of a branch:
+
+    git worktree add /tmp/h4ev-base main
+    (cd /tmp/h4ev-base && python -m benchmarks.suite --json /tmp/base.json)
+    python -m benchmarks.suite --json /tmp/head.json
+    python -m benchmarks.compare /tmp/base.json /tmp/head.json --threshold 10
+
+Latencies, durations, sizes, errors and upstream calls are better lower;
+rates are better higher. Changes worse than --threshold percent are
+flagged as regressions, and with --fail-on-regression the exit status is 1.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("_ms", "_us", "seconds", "bytes", "errors", "upstream_calls")
+HIGHER_IS_BETTER = ("_per_s", "per_second", "per_core_s")
+SKIP = ("revision", "environment", "parameters", "started_at")
+
+
+def flatten(data, prefix="") -> dict:
+    """Numeric leaves keyed by dotted path; list items by index, or by their name field"""
+    metrics = {}
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = (
+            (str(item.get("hasher") or item.get("mode") or index) if isinstance(item, dict) else str(index), item)
+            for index, item in enumerate(data)
+        )
+    else:
+        return metrics
+    for key, value in items:
+        if not prefix and key in SKIP:
+            continue
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            metrics[path] = value
+        else:
+            metrics.update(flatten(value, path))
+    return metrics
+
+
+def direction(path):
+    """1 when higher is better, -1 when lower is, None for counts and parameters"""
+    name = path.rsplit(".", 1)[-1]
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return None
+
+
+def compare(base, head, threshold) -> list:
+    base_metrics, head_metrics = flatten(base), flatten(head)
+    rows = []
+    for path in sorted(base_metrics.keys() & head_metrics.keys()):
+        sign = direction(path)
+        if sign is None:
+            continue
+        old, new = base_metrics[path], head_metrics[path]
+        if old == new:
+            change = 0.0
+        elif old:
+            change = (new - old) / abs(old) * 100
+        else:
+            change = float("inf")
+        worse = change * sign < 0
+        rows.append({
+            "metric": path,
+            "base": old,
+            "head": new,
+            "change_pct": round(change, 1),
+            "regression": worse and abs(change) > threshold,
+            "improvement": not worse and abs(change) > threshold,
+        })
+    return rows
+
+
+def describe(report) -> str:
+    revision = report.get("revision") or {}
+    commit = (revision.get("commit") or "unknown")[:10]
+    return f"{commit}{' (dirty)' if revision.get('dirty') else ''} {revision.get('subject') or ''}".strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="report of the baseline")
+    parser.add_argument("head", help="report of the change")
+    parser.add_argument("--threshold", type=float, default=10, help="percent change reported as significant")
+    parser.add_argument("--all", action="store_true", help="list unchanged metrics too")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--json", help="write the comparison to this file")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    rows = compare(base, head, args.threshold)
+    print(f"base: {describe(base)}")
+    print(f"head: {describe(head)}")
+    if base.get("parameters") != head.get("parameters"):
+        print("warning: the reports were run with different parameters")
+    for row in rows:
+        if not (args.all or row["regression"] or row["improvement"]):
+            continue
+        mark = "REGRESSION" if row["regression"] else "improved" if row["improvement"] else ""
+        print(f"{row['metric']:<50} {row['base']:>12} -> {row['head']:>12}  {row['change_pct']:>+8.1f}%  {mark}")
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(rows)} metrics compared, {len(regressions)} regressions, "
+          f"{sum(row['improvement'] for row in rows)} improvements beyond {args.threshold:g}%")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"base": base.get("revision"), "head": head.get("revision"), "metrics": rows}, f, indent=2)
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
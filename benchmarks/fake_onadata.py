@@ -0,0 +1,211 @@
+"""
+Local stand-in for the Onadata API, for benchmarks and load tests.
+
+Serves /api/v1/forms?owner=<username> and /api/v1/data/<form_id> with
+generated payloads (benchmarks.payloads), honouring the query / fields /
+page / page_size parameters onadata.services sends, with ETags and 304s.
+Latency, jitter and an error rate can be injected, and every request is
+counted so benchmarks can tell cache hits from upstream calls.
+
+    python -m benchmarks.fake_onadata --port 8765 --submissions 500 --latency 0.05 --error-rate 0.01
+
+then run the app with ONADATA_BASE_URL=http://127.0.0.1:8765.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.payloads import make_forms, make_submissions
+
+OPERATORS = {
+    "$gt": lambda value, bound: value > bound,
+    "$gte": lambda value, bound: value >= bound,
+    "$lt": lambda value, bound: value < bound,
+    "$lte": lambda value, bound: value <= bound,
+    "$ne": lambda value, bound: value != bound,
+}
+
+
+def matches(record, query) -> bool:
+    """The subset of Onadata's Mongo-style `query` the app sends: equality and comparisons"""
+    for field, condition in query.items():
+        value = record.get(field)
+        if isinstance(condition, dict):
+            try:
+                if not all(OPERATORS[op](value, bound) for op, bound in condition.items() if op in OPERATORS):
+                    return False
+            except TypeError:
+                return False
+        elif value != condition and str(value) != str(condition):
+            return False
+    return True
+
+
+class FakeOnadata:
+    """
+    forms per owner, submissions per form (sizes overrides it per form id),
+    latency + uniform jitter in seconds, and the share of requests
+    answered with error_status. All of them may be changed while running.
+    """
+
+    def __init__(self, forms=5, submissions=100, sizes=None, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, seed=42):
+        self.forms = forms
+        self.submissions = submissions
+        self.sizes = dict(sizes or {})
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.payloads = {}
+        self.server = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {"requests": 0, "errors": 0, "not_modified": 0, "bytes": 0}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
+
+    def count(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counts[name] += amount
+
+    def submissions_for(self, form_id) -> list:
+        size = self.sizes.get(form_id, self.submissions)
+        key = (form_id, size)
+        with self.lock:
+            records = self.payloads.get(key)
+        if records is None:
+            numeric_id = int(form_id) if str(form_id).isdigit() else 0
+            records = make_submissions(size, numeric_id)
+            with self.lock:
+                self.payloads[key] = records
+        return records
+
+    def delay(self):
+        with self.lock:
+            seconds = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.error_rate and self.rng.random() < self.error_rate
+        if seconds:
+            time.sleep(seconds)
+        return fail
+
+    def respond(self, path, params):
+        """(status, body) for a GET"""
+        if path.rstrip("/") == "/api/v1/forms":
+            owner = params.get("owner", ["demo"])[0]
+            return 200, make_forms(self.forms, owner)
+
+        if not path.startswith("/api/v1/data/"):
+            return 404, {"detail": "Not found."}
+        records = self.submissions_for(path[len("/api/v1/data/"):].strip("/"))
+
+        if "query" in params:
+            query = json.loads(params["query"][0])
+            records = [record for record in records if matches(record, query)]
+        if "sort" in params:
+            for field, direction in reversed(list(json.loads(params["sort"][0]).items())):
+                records = sorted(records, key=lambda record: str(record.get(field)), reverse=direction < 0)
+        if "page" in params:
+            page = int(params["page"][0])
+            page_size = int(params.get("page_size", [100])[0])
+            records = records[(page - 1) * page_size:page * page_size]
+            if not records:
+                return 404, {"detail": "Invalid page."}
+        if "fields" in params:
+            fields = json.loads(params["fields"][0])
+            records = [{field: record[field] for field in fields if field in record} for record in records]
+        return 200, records
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if fake.delay():
+                    fake.count(requests=1, errors=1)
+                    self.send(fake.error_status, b'{"detail": "Injected error."}')
+                    return
+
+                status, data = fake.respond(url.path, parse_qs(url.query))
+                body = json.dumps(data).encode()
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    fake.count(requests=1, not_modified=1)
+                    self.send(304, b"", etag)
+                    return
+                fake.count(requests=1, bytes=len(body))
+                self.send(status, body, etag if status == 200 else None)
+
+            def send(self, status, body, etag=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0) -> str:
+        """Serve on a background thread; returns the base URL"""
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-onadata", daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--forms", type=int, default=5, help="forms per owner")
+    parser.add_argument("--submissions", type=int, default=100, help="submissions per form")
+    parser.add_argument("--size", action="append", default=[], metavar="FORM_ID=COUNT",
+                        help="submissions for one form, e.g. --size 9001=20000")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args(argv)
+
+    sizes = dict(item.split("=", 1) for item in args.size)
+    fake = FakeOnadata(
+        forms=args.forms, submissions=args.submissions, sizes={key: int(value) for key, value in sizes.items()},
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+    )
+    print(f"fake Onadata on {fake.start(args.host, args.port)}")
+    try:
+        while True:
+            time.sleep(10)
+            print(fake.stats())
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Shared setup for the Django benchmarks: a fake Onadata server, Django on
+benchmarks.settings with a throwaway test database, request logs in a
+temporary directory, and a threaded load runner with latency percentiles.
+"""
+import contextlib
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+from benchmarks.fake_onadata import FakeOnadata
+
+
+def setup_django(fake=None):
+    """
+    Configure Django for a benchmark; with a FakeOnadata, start it and
+    point the Onadata client at it. Call before importing app modules.
+    """
+    if fake is not None:
+        os.environ["ONADATA_BASE_URL"] = fake.start()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+
+    from h4ev import settings
+    if fake is not None:
+        settings.ONADATA["BASE_URL"] = os.environ["ONADATA_BASE_URL"]
+    # keep benchmark request logs out of the project's LOG_DIR
+    settings.LOG_DIR = tempfile.mkdtemp(prefix="h4ev-bench-logs-")
+    settings.REQUEST_LOG["STORE"] = os.path.join(settings.LOG_DIR, "requests.sqlite3")
+    return fake
+
+
+def start_fake_onadata(**options) -> FakeOnadata:
+    return setup_django(FakeOnadata(**options))
+
+
+@contextlib.contextmanager
+def test_database():
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def clear_caches():
+    from django.core.cache import caches
+    from h4ev import settings
+
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+@contextlib.contextmanager
+def quiet():
+    # the app prints upstream errors (the flaky scenario makes plenty); keep them out of the report output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def load(func, count, threads) -> dict:
+    """
+    Call func(index) count times from a pool of threads. func returns
+    whether the call succeeded; exceptions count as errors.
+    """
+    def call(index):
+        start = time.perf_counter()
+        try:
+            ok = func(index)
+        except Exception:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    with quiet():
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(call, range(count)))
+        seconds = time.perf_counter() - start
+
+    latencies = [ms for ms, _ in results]
+    return {
+        "requests": count,
+        "errors": sum(1 for _, ok in results if not ok),
+        "seconds": round(seconds, 3),
+        "requests_per_s": round(count / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.5), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(max(latencies), 2),
+    }
+
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(
+                ["git", *args], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "subject": git("log", "-1", "--format=%s"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def environment() -> dict:
+    from django.conf import settings as django_settings
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "django": django.get_version(),
+        "redis": "local" if os.environ.get("BENCH_REDIS_URL") else "fakeredis",
+        "database": django_settings.DATABASES["default"]["ENGINE"].rsplit(".", 1)[-1],
+    }
@@ -0,0 +1,129 @@
+"""
+Micro-benchmarks of the per-request hot paths: building a cache key,
+encoding and decoding submissions with the configured Onadata cache
+serializer and compressor, and the overhead LoggingAPIView adds to a
+trivial authenticated request.
+
+    python -m benchmarks.micro --calls 20000 --sizes 100 5000 --json report.json
+"""
+import argparse
+import json
+
+from benchmarks import harness
+
+if __name__ == "__main__":
+    harness.setup_django()
+
+from types import SimpleNamespace  # noqa: E402
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from rest_framework.permissions import AllowAny  # noqa: E402
+from rest_framework.response import Response  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+from rest_framework.views import APIView  # noqa: E402
+
+from accounts.services import LoggingAPIView, generate_cache_key  # noqa: E402
+from benchmarks.cache_serialization import SERIALIZERS, build, measure  # noqa: E402
+from benchmarks.payloads import make_submissions  # noqa: E402
+from h4ev import settings  # noqa: E402
+
+
+class PlainView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response({"ok": True})
+
+
+class LoggedView(LoggingAPIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response({"ok": True})
+
+
+def bench_cache_key(calls, repeat):
+    user = SimpleNamespace(id=42, role="enumerator")
+    url_params = {"page": "2", "page_size": "100", "fields": "_id,household/state", "submitted_after": "2024-01-01"}
+
+    def build_keys():
+        for _ in range(calls):
+            generate_cache_key(user, url_params, 60, "form_submissions", {"form_id": "1234"})
+
+    seconds = harness.best_of(repeat, build_keys)
+    row = {"cache_key_us": round(seconds / calls * 1e6, 2)}
+    print(f"cache key        {row['cache_key_us']:>9.2f} us")
+    return row
+
+
+def configured_serializer():
+    options = settings.CACHES["onadata"]["OPTIONS"]
+    names = {path: name for name, path in SERIALIZERS.items()}
+    return names[options["SERIALIZER"]], options["COMPRESS_ALGORITHM"], options["COMPRESS_MIN_LENGTH"]
+
+
+def bench_serialization(sizes, repeat):
+    serializer_name, compressor_name, min_length = configured_serializer()
+    serializer, compressor = build(serializer_name, compressor_name, min_length)
+    results = {"serializer": serializer_name, "compressor": compressor_name}
+    for size in sizes:
+        row = measure(make_submissions(size), serializer, compressor, repeat)
+        results[f"submissions_{size}"] = row
+        print(
+            f"{serializer_name}+{compressor_name} {size:>7} submissions  {row['bytes']:>12,} B  "
+            f"encode {row['encode_ms']:>9.3f} ms  decode {row['decode_ms']:>9.3f} ms"
+        )
+    return results
+
+
+def bench_logging_overhead(calls, repeat):
+    User = get_user_model()
+    user = User(id=1, username="bench", role="bench")
+    factory = APIRequestFactory()
+    views = {"plain": PlainView.as_view(), "logged": LoggedView.as_view()}
+
+    def call(view):
+        def requests():
+            for _ in range(calls):
+                request = factory.get("/bench/?page=1")
+                force_authenticate(request, user=user)
+                view(request)
+        return requests
+
+    timings = {name: harness.best_of(repeat, call(view)) / calls * 1e6 for name, view in views.items()}
+    row = {
+        "plain_view_us": round(timings["plain"], 2),
+        "logged_view_us": round(timings["logged"], 2),
+        "logging_overhead_us": round(timings["logged"] - timings["plain"], 2),
+    }
+    print(
+        f"APIView          {row['plain_view_us']:>9.2f} us  LoggingAPIView {row['logged_view_us']:>9.2f} us  "
+        f"overhead {row['logging_overhead_us']:>9.2f} us"
+    )
+    return row
+
+
+def run(calls, sizes, repeat):
+    return {
+        "cache_key": bench_cache_key(calls, repeat),
+        "serialization": bench_serialization(sizes, repeat),
+        "logging": bench_logging_overhead(max(1, calls // 10), repeat),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000, help="cache keys per timing; a tenth as many requests")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.calls, args.sizes, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "micro", **results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Onadata-shaped payloads for benchmarks"""
+import random
+import uuid
+from datetime import datetime, timedelta
+
+
+def make_submission(index, form_id=1, rng=random):
+    submitted = datetime(2024, 1, 1) + timedelta(minutes=index * 7)
+    return {
+        "_id": index,
+        "_uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "_xform_id": form_id,
+        "_xform_id_string": f"household_survey_{form_id}",
+        "_submission_time": submitted.isoformat(),
+        "_date_modified": (submitted + timedelta(minutes=3)).isoformat(),
+        "_submitted_by": f"enumerator{index % 40}",
+        "_status": "submitted_via_web",
+        "_version": "202401011200",
+        "_duration": rng.randint(60, 3600),
+        "_geolocation": [round(rng.uniform(4, 13), 6), round(rng.uniform(3, 14), 6)],
+        "_attachments": [],
+        "_notes": [],
+        "_tags": [],
+        "_edited": False,
+        "_media_count": 0,
+        "_total_media": 0,
+        "_media_all_received": True,
+        "formhub/uuid": "f0e4b0b6c6c74d21a9c5a7b2b7d3b8e1",
+        "meta/instanceID": f"uuid:{uuid.UUID(int=rng.getrandbits(128))}",
+        "start": submitted.isoformat(),
+        "end": (submitted + timedelta(minutes=12)).isoformat(),
+        "household/head_name": f"Respondent {index}",
+        "household/size": rng.randint(1, 12),
+        "household/state": rng.choice(["Lagos", "Kano", "Kaduna", "Oyo", "Rivers", "FCT"]),
+        "household/has_bednet": rng.choice(["yes", "no"]),
+        "household/children_under_5": rng.randint(0, 5),
+        "health/last_visit": rng.choice(["week", "month", "year", "never"]),
+        "health/symptoms": " ".join(rng.sample(["fever", "cough", "rash", "diarrhoea", "headache"], 2)),
+        "health/temperature": round(rng.uniform(35.5, 40.5), 1),
+    }
+
+
+def make_submissions(count, form_id=1, seed=42):
+    rng = random.Random(seed)
+    return [make_submission(index, form_id, rng) for index in range(1, count + 1)]
+
+
+def make_forms(count, owner="demo"):
+    return [
+        {
+            "formid": form_id,
+            "id_string": f"household_survey_{form_id}",
+            "title": f"Household survey {form_id}",
+            "owner": owner,
+            "num_of_submissions": form_id * 10,
+            "date_created": "2024-01-01T00:00:00",
+            "downloadable": True,
+        }
+        for form_id in range(1, count + 1)
+    ]
@@ -0,0 +1,206 @@
+"""
+End-to-end load scenarios through the full middleware and view stack,
+with JWT-authenticated requests against a fake Onadata server
+(benchmarks.fake_onadata) and fakeredis or a local Redis:
+
+  cold_cache      empty caches, concurrent requests spread over the forms;
+                  single-flight should keep upstream calls near one per form
+  warm_cache      the same requests again, served from the cache
+  login_storm     concurrent logins spread over the users
+  large_form      one large form: cold fetch, warm fetches and an NDJSON stream
+  flaky_upstream  empty caches with injected upstream errors (retries,
+                  circuit breaker and error responses)
+
+    python -m benchmarks.scenarios --requests 400 --threads 16 --latency 0.05 --json report.json
+
+Runs in-process on the Django test client against a throwaway test database.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+
+from benchmarks import harness
+
+FAKE = harness.start_fake_onadata() if __name__ == "__main__" else None
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.auth.hashers import make_password  # noqa: E402
+from django.test import Client  # noqa: E402
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+LARGE_FORM_ID = "9001"
+OWNER = "demo"
+
+
+class Session:
+    """Test clients per thread, each authenticated as one of the benchmark users"""
+
+    def __init__(self, tokens):
+        self.tokens = itertools.cycle(tokens)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get(self, path):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            with self.lock:
+                token = next(self.tokens)
+            client = self.local.client = Client(headers={"Authorization": f"Bearer {token}"})
+        return client.get(path)
+
+
+def create_users(count) -> list:
+    User = get_user_model()
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([User(username=f"bench{i}", password=password, role="bench") for i in range(count)])
+    return list(User.objects.filter(username__startswith="bench").order_by("id"))
+
+
+def form_paths(forms) -> list:
+    return [f"/api/onadata/form/{form_id}/" for form_id in range(1, forms + 1)] + [f"/api/onadata/user/{OWNER}/forms/"]
+
+
+def fetch_paths(fake, session, paths, requests, threads) -> dict:
+    fake.reset()
+    row = harness.load(lambda index: session.get(paths[index % len(paths)]).status_code == 200, requests, threads)
+    row["upstream_calls"] = fake.stats()["requests"]
+    return row
+
+
+def cold_cache(fake, session, forms, requests, threads):
+    harness.clear_caches()
+    return fetch_paths(fake, session, form_paths(forms), requests, threads)
+
+
+def warm_cache(fake, session, forms, requests, threads):
+    return fetch_paths(fake, session, form_paths(forms), requests, threads)
+
+
+def login_storm(users, logins, threads):
+    local = threading.local()
+
+    def login(index):
+        client = getattr(local, "client", None) or Client()
+        local.client = client
+        response = client.post(
+            "/api/accounts/login/",
+            {"username": users[index % len(users)].username, "password": PASSWORD},
+            content_type="application/json",
+        )
+        return response.status_code == 200
+
+    return harness.load(login, logins, threads)
+
+
+def timed_get(session, path):
+    start = time.perf_counter()
+    with harness.quiet():
+        response = session.get(path)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+    return (time.perf_counter() - start) * 1000, response.status_code, len(body)
+
+
+def large_form(fake, session, submissions, requests, threads):
+    fake.sizes[LARGE_FORM_ID] = submissions
+    fake.submissions_for(LARGE_FORM_ID)
+    harness.clear_caches()
+    fake.reset()
+    path = f"/api/onadata/form/{LARGE_FORM_ID}/"
+
+    cold_ms, status, size = timed_get(session, path)
+    warm = harness.load(lambda index: session.get(path).status_code == 200, requests, threads)
+    stream_ms, stream_status, stream_size = timed_get(session, f"{path}?stream=ndjson")
+    return {
+        "submissions": submissions,
+        "cold_ms": round(cold_ms, 2),
+        "response_bytes": size,
+        "warm": warm,
+        "stream_ms": round(stream_ms, 2),
+        "stream_bytes": stream_size,
+        "errors": sum(code != 200 for code in (status, stream_status)) + warm["errors"],
+        "upstream_calls": fake.stats()["requests"],
+    }
+
+
+def flaky_upstream(fake, session, forms, requests, threads, error_rate):
+    harness.clear_caches()
+    fake.error_rate = error_rate
+    try:
+        row = fetch_paths(fake, session, form_paths(forms), requests, threads)
+    finally:
+        fake.error_rate = 0.0
+    row["error_rate"] = error_rate
+    row["upstream_errors"] = fake.stats()["errors"]
+    return row
+
+
+def report(name, row):
+    print(
+        f"{name:>15}  {row.get('requests_per_s') or 0:>8.1f} req/s  p50 {row.get('p50_ms') or 0:>8.2f} ms  "
+        f"p95 {row.get('p95_ms') or 0:>8.2f} ms  errors {row['errors']:>4}  upstream {row.get('upstream_calls', '-')}"
+    )
+
+
+def run(fake, users, forms, submissions, large_submissions, requests, logins, threads, latency, error_rate):
+    fake.forms = forms
+    fake.submissions = submissions
+    fake.latency = latency
+    with harness.test_database():
+        accounts = create_users(users)
+        session = Session([str(RefreshToken.for_user(user).access_token) for user in accounts])
+
+        results = {}
+        results["cold_cache"] = cold_cache(fake, session, forms, requests, threads)
+        results["warm_cache"] = warm_cache(fake, session, forms, requests, threads)
+        results["login_storm"] = login_storm(accounts, logins, threads)
+        for name, row in results.items():
+            report(name, row)
+
+        results["large_form"] = large_form(fake, session, large_submissions, requests // 10 or 1, threads)
+        row = results["large_form"]
+        print(
+            f"{'large_form':>15}  {row['submissions']} submissions  cold {row['cold_ms']:.1f} ms  "
+            f"warm p95 {row['warm']['p95_ms']:.1f} ms  stream {row['stream_ms']:.1f} ms  "
+            f"{row['response_bytes']:,} B  errors {row['errors']}"
+        )
+        # last: the open circuit breaker it may leave behind would skew the others
+        results["flaky_upstream"] = flaky_upstream(fake, session, forms, requests, threads, error_rate)
+        report("flaky_upstream", results["flaky_upstream"])
+    return results
+
+
+def add_arguments(parser):
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--forms", type=int, default=10, help="forms per owner on the fake Onadata")
+    parser.add_argument("--submissions", type=int, default=200, help="submissions per form")
+    parser.add_argument("--large-submissions", type=int, default=20000, help="submissions of the large form")
+    parser.add_argument("--requests", type=int, default=400, help="requests per cache scenario")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds of fake Onadata latency")
+    parser.add_argument("--error-rate", type=float, default=0.2, help="upstream error share in flaky_upstream")
+
+
+def run_from_args(fake, args):
+    return run(fake, args.users, args.forms, args.submissions, args.large_submissions, args.requests,
+               args.logins, args.threads, args.latency, args.error_rate)
+
+
+def main(argv=None, fake=None):
+    fake = fake or FAKE
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run_from_args(fake, args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "scenarios", **results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
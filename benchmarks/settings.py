@@ -0,0 +1,36 @@
+"""
+Settings for the benchmark suite: the project settings with every Redis
+cache pointed at BENCH_REDIS_URL (a local Redis, e.g.
+redis://127.0.0.1:6379/15, which is flushed) or, when unset, at an
+in-process fakeredis server, so runs need no external services.
+"""
+import copy
+import os
+
+from h4ev.settings import *  # noqa: F401,F403
+from h4ev.settings import CACHES as PROJECT_CACHES
+
+DEBUG = False
+# the Django test client's host, for runs outside a test environment
+ALLOWED_HOSTS = ["testserver", "localhost", "127.0.0.1"]
+
+BENCH_REDIS_URL = os.environ.get("BENCH_REDIS_URL")
+
+CACHES = copy.deepcopy(PROJECT_CACHES)
+if BENCH_REDIS_URL:
+    for alias in CACHES.values():
+        if alias["BACKEND"].startswith("django_redis"):
+            alias["LOCATION"] = BENCH_REDIS_URL
+else:
+    try:
+        import fakeredis
+    except ImportError:
+        raise ImportError("the benchmarks need fakeredis installed or BENCH_REDIS_URL pointing at a local Redis")
+
+    FAKE_REDIS_SERVER = fakeredis.FakeServer()
+    for alias in CACHES.values():
+        if alias["BACKEND"].startswith("django_redis"):
+            alias["OPTIONS"]["CONNECTION_POOL_KWARGS"] = {
+                "connection_class": fakeredis.FakeConnection,
+                "server": FAKE_REDIS_SERVER,
+            }
@@ -0,0 +1,71 @@
+"""
+The whole benchmark suite, micro-benchmarks and end-to-end scenarios, in
+one run with one JSON report that records the commit, environment and
+parameters, so reports from different commits can be compared with
+benchmarks.compare.
+
+    python -m benchmarks.suite --json reports/$(git rev-parse --short HEAD).json
+    python -m benchmarks.suite --quick --json quick.json
+
+Needs fakeredis (or BENCH_REDIS_URL set to a local Redis); Onadata is
+replaced by benchmarks.fake_onadata.
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+from benchmarks import harness
+
+FAKE = harness.start_fake_onadata() if __name__ == "__main__" else None
+
+from benchmarks import micro, scenarios  # noqa: E402
+
+# smaller volumes for a smoke run of the suite, e.g. in CI
+QUICK = {"calls": 2000, "sizes": [100], "repeat": 3, "requests": 100, "logins": 10, "large_submissions": 2000}
+
+
+def run(args, fake):
+    started = time.perf_counter()
+    report = {
+        "benchmark": "suite",
+        "revision": harness.git_revision(),
+        "environment": harness.environment(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": vars(args),
+    }
+    if "micro" in args.only:
+        print("== micro")
+        report["micro"] = micro.run(args.calls, args.sizes, args.repeat)
+    if "scenarios" in args.only:
+        print("== scenarios")
+        report["scenarios"] = scenarios.run_from_args(fake, args)
+    report["seconds"] = round(time.perf_counter() - started, 1)
+    return report
+
+
+def main(argv=None, fake=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=["micro", "scenarios"], default=["micro", "scenarios"])
+    parser.add_argument("--quick", action="store_true", help="small volumes for a fast smoke run")
+    parser.add_argument("--calls", type=int, default=20000, help="micro-benchmark iterations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 5000], help="submissions per serialized payload")
+    parser.add_argument("--repeat", type=int, default=5)
+    scenarios.add_arguments(parser)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+    if args.quick:
+        for name, value in QUICK.items():
+            setattr(args, name, value)
+
+    report = run(args, fake or FAKE)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Per-connection database setup, run from the connection_created signal
+(connected in AccountsConfig.ready): applies settings.SQLITE_PRAGMAS to
+every new SQLite connection.
+"""
+import re
+
+from h4ev import settings
+
+PRAGMA_VALUE = re.compile(r"-?\w+")
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            if not value:
+                continue
+            # pragma values cannot be bound as parameters; only plain words and numbers are let through
+            if not PRAGMA_VALUE.fullmatch(str(value)):
+                print(f"Ignoring SQLite pragma {name}={value!r}")
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,33 @@
+"""
+Per-process singletons. Connection pools, executors and background threads
+do not survive a fork, so each gunicorn worker builds its own the first
+time it asks for one.
+"""
+import functools
+import os
+import threading
+
+
+def per_process(factory):
+    """
+    Decorate factory so it runs once per process and set of arguments;
+    later calls return what it built, and a forked child builds afresh.
+    """
+    lock = threading.Lock()
+    built = {"pid": None, "instances": {}}
+
+    @functools.wraps(factory)
+    def get(*args):
+        pid = os.getpid()
+        instances = built["instances"]
+        if built["pid"] == pid and args in instances:
+            return instances[args]
+        with lock:
+            if built["pid"] != pid:
+                built["pid"], built["instances"] = pid, {}
+            instances = built["instances"]
+            if args not in instances:
+                instances[args] = factory(*args)
+            return instances[args]
+
+    return get
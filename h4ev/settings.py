@@ -47,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # outermost, so its total and Server-Timing cover the whole request
+    'accounts.middleware.MetricsMiddleware',
+    'accounts.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,11 +82,61 @@ WSGI_APPLICATION = 'h4ev.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE picks "sqlite" (the default) or "postgres" (needs psycopg installed)
+DATABASE_ENGINE = os.environ.get("DATABASE_ENGINE", "sqlite")
+# seconds a worker thread keeps its connection open between requests: 0 reconnects on every request,
+# "none" never closes it. Keep 0 under ASGI and pool with PgBouncer instead.
+_conn_max_age = os.environ.get("DATABASE_CONN_MAX_AGE", "60")
+DATABASE_CONN_MAX_AGE = None if _conn_max_age.lower() == "none" else int(_conn_max_age)
+# check a reused connection still works before the first query of each request
+DATABASE_CONN_HEALTH_CHECKS = os.environ.get("DATABASE_CONN_HEALTH_CHECKS", "true").lower() == "true"
+
+if DATABASE_ENGINE == "postgres":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get("POSTGRES_DB", "h4ev"),
+            'USER': os.environ.get("POSTGRES_USER", "h4ev"),
+            'PASSWORD': os.environ.get("POSTGRES_PASSWORD", ""),
+            'HOST': os.environ.get("POSTGRES_HOST", "localhost"),
+            'PORT': os.environ.get("POSTGRES_PORT", "5432"),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DATABASE_CONN_HEALTH_CHECKS,
+            # PgBouncer in transaction mode cannot hold the server-side cursors QuerySet.iterator() uses
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get("POSTGRES_PGBOUNCER", "false").lower() == "true",
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get("POSTGRES_CONNECT_TIMEOUT", 5)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            # Django's backend plus transaction_mode (h4ev/sqlite/base.py)
+            'ENGINE': 'h4ev.sqlite',
+            'NAME': os.environ.get("SQLITE_PATH", BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DATABASE_CONN_HEALTH_CHECKS,
+            'OPTIONS': {
+                # atomic blocks take the write lock at BEGIN, so a writer waits up to timeout seconds
+                # for another's transaction to finish instead of failing with "database is locked"
+                'transaction_mode': os.environ.get("SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+                'timeout': float(os.environ.get("SQLITE_TIMEOUT", 5)),
+            },
+        }
     }
+
+# Journal mode `migrate` sets on the database file once (accounts/migrations/0002_sqlite_journal_mode.py);
+# it is stored in the file. WAL lets readers carry on while a worker writes. Empty keeps the file's mode.
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "wal")
+
+# Pragmas run on every new SQLite connection (h4ev/database.py); an empty value skips one.
+SQLITE_PRAGMAS = {
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "normal"),
+    # negative: KiB of page cache per connection
+    "cache_size": os.environ.get("SQLITE_CACHE_SIZE", "-20000"),
+    "temp_store": os.environ.get("SQLITE_TEMP_STORE", "memory"),
+    "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)),
 }
 
 CACHES = {
@@ -96,6 +149,41 @@ CACHES = {
     }
 }
 
+# Onadata responses get their own alias so their serializer and compression
+# can be tuned without touching anything else stored in Redis
+ONADATA_CACHE_SERIALIZERS = {
+    "pickle": "django_redis.serializers.pickle.PickleSerializer",
+    "json": "django_redis.serializers.json.JSONSerializer",
+    "msgpack": "django_redis.serializers.msgpack.MSGPackSerializer",
+    "orjson": "onadata.cache_serializers.OrjsonSerializer",
+}
+CACHES["onadata"] = {
+    "BACKEND": "django_redis.cache.RedisCache",
+    "LOCATION": CACHES["default"]["LOCATION"],
+    "KEY_PREFIX": "onadata",
+    "OPTIONS": {
+        "CLIENT_CLASS": "django_redis.client.DefaultClient",
+        "SERIALIZER": ONADATA_CACHE_SERIALIZERS[os.environ.get("ONADATA_CACHE_SERIALIZER", "orjson")],
+        "COMPRESSOR": "onadata.cache_serializers.ThresholdCompressor",
+        # "zlib", "lz4" or "zstd"; values up to COMPRESS_MIN_LENGTH bytes are stored uncompressed
+        "COMPRESS_ALGORITHM": os.environ.get("ONADATA_CACHE_COMPRESSION", "zlib"),
+        "COMPRESS_MIN_LENGTH": int(os.environ.get("ONADATA_CACHE_COMPRESS_MIN_LENGTH", 1024)),
+        "COMPRESS_LEVEL": os.environ.get("ONADATA_CACHE_COMPRESS_LEVEL"),
+    },
+}
+
+# Optional per-worker in-memory tier in front of Redis for Onadata responses
+ONADATA_LOCAL_CACHE_BYTES = int(os.environ.get("ONADATA_LOCAL_CACHE_BYTES", 0))
+if ONADATA_LOCAL_CACHE_BYTES:
+    CACHES["onadata_local"] = {
+        "BACKEND": "onadata.cache_backends.TwoTierCache",
+        "LOCATION": "onadata",
+        "OPTIONS": {
+            "MAX_BYTES": ONADATA_LOCAL_CACHE_BYTES,
+            "MAX_LOCAL_TTL": int(os.environ.get("ONADATA_LOCAL_CACHE_MAX_TTL", 300)),
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -152,7 +240,204 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
+# User accounts API
+ACCOUNTS = {
+    # GET /api/accounts/users/get/all/ pages with ?paginate=true (?page_size= is capped at USERS_MAX_PAGE_SIZE)
+    "USERS_PAGE_SIZE": int(os.environ.get("ACCOUNTS_USERS_PAGE_SIZE", 100)),
+    "USERS_MAX_PAGE_SIZE": int(os.environ.get("ACCOUNTS_USERS_MAX_PAGE_SIZE", 1000)),
+    # rows fetched per database round trip when streaming users with ?stream=ndjson
+    "USERS_STREAM_CHUNK_SIZE": int(os.environ.get("ACCOUNTS_USERS_STREAM_CHUNK_SIZE", 2000)),
+    # bulk user import: users inserted per transaction, password hashing processes, rows and bytes per API
+    # request (keep the bytes under DATA_UPLOAD_MAX_MEMORY_SIZE, 2.5 MB by default); 0 workers hashes on the
+    # request thread, worth raising for large imports on a machine with idle cores.
+    "IMPORT_BATCH_SIZE": int(os.environ.get("ACCOUNTS_IMPORT_BATCH_SIZE", 1000)),
+    "IMPORT_HASH_WORKERS": int(os.environ.get("ACCOUNTS_IMPORT_HASH_WORKERS", 0)),
+    "IMPORT_MAX_ROWS": int(os.environ.get("ACCOUNTS_IMPORT_MAX_ROWS", 10000)),
+    "IMPORT_MAX_BYTES": int(os.environ.get("ACCOUNTS_IMPORT_MAX_BYTES", 2 * 1024 * 1024)),
+    # password hashing: "pbkdf2", "scrypt", "argon2" (needs argon2-cffi) or "bcrypt" (needs bcrypt),
+    # and its work factors; existing hashes are upgraded when their user next logs in
+    "PASSWORD_HASHER": os.environ.get("ACCOUNTS_PASSWORD_HASHER", "pbkdf2"),
+    "PBKDF2_ITERATIONS": int(os.environ.get("ACCOUNTS_PBKDF2_ITERATIONS", 720000)),
+    "SCRYPT_WORK_FACTOR": int(os.environ.get("ACCOUNTS_SCRYPT_WORK_FACTOR", 2 ** 14)),
+    "ARGON2_TIME_COST": int(os.environ.get("ACCOUNTS_ARGON2_TIME_COST", 2)),
+    "ARGON2_MEMORY_COST": int(os.environ.get("ACCOUNTS_ARGON2_MEMORY_COST", 102400)),
+    "ARGON2_PARALLELISM": int(os.environ.get("ACCOUNTS_ARGON2_PARALLELISM", 8)),
+    "BCRYPT_ROUNDS": int(os.environ.get("ACCOUNTS_BCRYPT_ROUNDS", 12)),
+    # processes per worker that check login passwords (0 checks them on the request thread). Only worth it for
+    # threaded or async workers whose other requests queue behind a slow hash, with cores to spare
+    "LOGIN_HASH_WORKERS": int(os.environ.get("ACCOUNTS_LOGIN_HASH_WORKERS", 0)),
+    # failed logins allowed per username and per client IP within LOGIN_FAILURE_WINDOW seconds
+    "LOGIN_RATE_LIMIT": os.environ.get("ACCOUNTS_LOGIN_RATE_LIMIT", "true").lower() == "true",
+    "LOGIN_RATE_CACHE": os.environ.get("ACCOUNTS_LOGIN_RATE_CACHE", "default"),
+    "LOGIN_MAX_FAILURES_PER_USERNAME": int(os.environ.get("ACCOUNTS_LOGIN_MAX_FAILURES_PER_USERNAME", 10)),
+    "LOGIN_MAX_FAILURES_PER_IP": int(os.environ.get("ACCOUNTS_LOGIN_MAX_FAILURES_PER_IP", 100)),
+    "LOGIN_FAILURE_WINDOW": int(os.environ.get("ACCOUNTS_LOGIN_FAILURE_WINDOW", 900)),
+    # META key of the client IP set by a trusted proxy, e.g. HTTP_X_FORWARDED_FOR ("" uses REMOTE_ADDR)
+    "LOGIN_IP_HEADER": os.environ.get("ACCOUNTS_LOGIN_IP_HEADER", ""),
+    # authenticate JWTs against a cached copy of the user row instead of querying it on every request;
+    # rows stay in each worker's memory for USER_CACHE_TTL seconds and are dropped everywhere on save/delete
+    "JWT_USER_CACHE": os.environ.get("ACCOUNTS_JWT_USER_CACHE", "true").lower() == "true",
+    "USER_CACHE_TTL": int(os.environ.get("ACCOUNTS_USER_CACHE_TTL", 60)),
+}
+
+CACHES["users"] = {
+    "BACKEND": "onadata.cache_backends.TwoTierCache",
+    "LOCATION": "default",
+    "OPTIONS": {
+        "MAX_BYTES": int(os.environ.get("ACCOUNTS_USER_CACHE_BYTES", 16 * 1024 * 1024)),
+        "MAX_LOCAL_TTL": ACCOUNTS["USER_CACHE_TTL"],
+        "CHANNEL": "cache-invalidate:users",
+    },
+}
+if ACCOUNTS["JWT_USER_CACHE"]:
+    REST_FRAMEWORK["DEFAULT_AUTHENTICATION_CLASSES"] = ("accounts.authentication.CachedJWTAuthentication",)
+
+PASSWORD_HASHER_CLASSES = {
+    "pbkdf2": "accounts.hashers.PBKDF2PasswordHasher",
+    "scrypt": "accounts.hashers.ScryptPasswordHasher",
+    "argon2": "accounts.hashers.Argon2PasswordHasher",
+    "bcrypt": "accounts.hashers.BCryptSHA256PasswordHasher",
+}
+# the first hasher makes new hashes; the others still verify existing ones
+PASSWORD_HASHERS = [
+    PASSWORD_HASHER_CLASSES[ACCOUNTS["PASSWORD_HASHER"]],
+    *(path for name, path in PASSWORD_HASHER_CLASSES.items() if name != ACCOUNTS["PASSWORD_HASHER"]),
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+AUTHENTICATION_BACKENDS = ["accounts.backends.PooledModelBackend"]
+
 LOG_DIR = os.path.join(BASE_DIR, "logs")
+# runs the tests with LOG_DIR and the request log store in a temporary directory
+TEST_RUNNER = "h4ev.test_runner.TestRunner"
+
+# Per-request timings (Server-Timing header) and Prometheus metrics served at /metrics
+METRICS = {
+    "ENABLED": os.environ.get("METRICS_ENABLED", "true").lower() == "true",
+    "SERVER_TIMING": os.environ.get("METRICS_SERVER_TIMING", "true").lower() == "true",
+    # seconds between each worker adding its counters into the shared Redis hash
+    "FLUSH_INTERVAL": int(os.environ.get("METRICS_FLUSH_INTERVAL", 10)),
+    # latency histogram bucket bounds in seconds
+    "BUCKETS": [float(bound) for bound in os.environ.get(
+        "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")],
+    # when set, /metrics requires "Authorization: Bearer <token>" instead of an admin user
+    "TOKEN": os.environ.get("METRICS_TOKEN", ""),
+}
+
+# Opt-in profiling of sampled and slow requests (accounts/profiling.py)
+PROFILING = {
+    "ENABLED": os.environ.get("PROFILING_ENABLED", "false").lower() == "true",
+    # share of requests profiled from start to finish with cProfile
+    "SAMPLE_RATE": float(os.environ.get("PROFILING_SAMPLE_RATE", 0)),
+    # requests running past WATCH_AFTER_MS get their stack sampled every STACK_INTERVAL seconds,
+    # kept when they finish over SLOW_MS (0 disables)
+    "SLOW_MS": int(os.environ.get("PROFILING_SLOW_MS", 2000)),
+    "WATCH_AFTER_MS": int(os.environ.get("PROFILING_WATCH_AFTER_MS", 500)),
+    "STACK_INTERVAL": float(os.environ.get("PROFILING_STACK_INTERVAL", 0.01)),
+    # defaults to LOG_DIR/profiles; only the newest MAX_PROFILES are kept
+    "DIR": os.environ.get("PROFILING_DIR", ""),
+    "MAX_PROFILES": int(os.environ.get("PROFILING_MAX_PROFILES", 200)),
+}
+
+# Request logs written by LoggingAPIView
+REQUEST_LOG = {
+    # queue entries for a background writer instead of writing on the request thread
+    "ASYNC": os.environ.get("REQUEST_LOG_ASYNC", "true").lower() == "true",
+    # entries held in memory per worker before the full policy applies
+    "QUEUE_SIZE": int(os.environ.get("REQUEST_LOG_QUEUE_SIZE", 10000)),
+    # "drop" discards entries when the queue is full, "block" waits up to BLOCK_TIMEOUT seconds first
+    "FULL_POLICY": os.environ.get("REQUEST_LOG_FULL_POLICY", "drop"),
+    "BLOCK_TIMEOUT": float(os.environ.get("REQUEST_LOG_BLOCK_TIMEOUT", 0.05)),
+    # the writer flushes after this many entries or seconds, whichever comes first
+    "BATCH_SIZE": int(os.environ.get("REQUEST_LOG_BATCH_SIZE", 500)),
+    "FLUSH_INTERVAL": float(os.environ.get("REQUEST_LOG_FLUSH_INTERVAL", 1.0)),
+    "MAX_OPEN_FILES": int(os.environ.get("REQUEST_LOG_MAX_OPEN_FILES", 256)),
+    # "per_user" writes logs/user_<id>.jsonl; "partitioned" writes one file per day,
+    # logs/<YYYY-MM-DD>/requests.jsonl, with a requests.idx of per-user byte ranges
+    "LAYOUT": os.environ.get("REQUEST_LOG_LAYOUT", "per_user"),
+    # rotate an active file past this size (0 disables) and at each "hourly"/"daily"/"weekly" boundary
+    "ROTATE_BYTES": int(os.environ.get("REQUEST_LOG_ROTATE_BYTES", 50 * 1024 * 1024)),
+    "ROTATE_INTERVAL": os.environ.get("REQUEST_LOG_ROTATE_INTERVAL", "daily"),
+    # "gzip", "zstd" (needs pyzstd) or "" to keep rotated segments uncompressed
+    "COMPRESSION": os.environ.get("REQUEST_LOG_COMPRESSION", "gzip"),
+    # seconds a rotated segment must sit untouched before it is compressed
+    "COMPRESS_MIN_AGE": int(os.environ.get("REQUEST_LOG_COMPRESS_MIN_AGE", 60)),
+    # delete rotated segments and archives older than this many days (0 keeps them forever)
+    "RETENTION_DAYS": int(os.environ.get("REQUEST_LOG_RETENTION_DAYS", 30)),
+    # seconds between rotation/compression/retention passes in each writer
+    "MAINTENANCE_INTERVAL": int(os.environ.get("REQUEST_LOG_MAINTENANCE_INTERVAL", 60)),
+    # SQLite file the logs are ingested into for querying (accounts/logstore.py)
+    "STORE": os.environ.get("REQUEST_LOG_STORE", os.path.join(LOG_DIR, "requests.sqlite3")),
+    # seconds between background ingests of new log lines into STORE (0 leaves it to request_log_stats)
+    "INGEST_INTERVAL": int(os.environ.get("REQUEST_LOG_INGEST_INTERVAL", 300)),
+}
+
+# Onadata upstream client
+ONADATA = {
+    "CACHE_ALIAS": "onadata_local" if ONADATA_LOCAL_CACHE_BYTES else "onadata",
+    "BASE_URL": os.environ.get("ONADATA_BASE_URL", "https://api.ona.io"),
+    # connection pool per gunicorn worker
+    "POOL_CONNECTIONS": int(os.environ.get("ONADATA_POOL_CONNECTIONS", 4)),
+    "POOL_MAXSIZE": int(os.environ.get("ONADATA_POOL_MAXSIZE", 16)),
+    # upstream connections per event loop for the async views (onadata/async_client.py)
+    "ASYNC_MAX_CONNECTIONS": int(os.environ.get("ONADATA_ASYNC_MAX_CONNECTIONS", 200)),
+    "ASYNC_MAX_KEEPALIVE": int(os.environ.get("ONADATA_ASYNC_MAX_KEEPALIVE", 50)),
+    # seconds
+    "CONNECT_TIMEOUT": float(os.environ.get("ONADATA_CONNECT_TIMEOUT", 3.05)),
+    "READ_TIMEOUT": float(os.environ.get("ONADATA_READ_TIMEOUT", 30)),
+    # idempotent GETs are retried on connection errors and these statuses, backing off
+    # RETRY_BACKOFF * 2^n seconds (capped at RETRY_BACKOFF_MAX) plus up to RETRY_JITTER
+    "RETRIES": int(os.environ.get("ONADATA_RETRIES", 2)),
+    "RETRY_STATUSES": [int(code) for code in os.environ.get("ONADATA_RETRY_STATUSES", "502,503,504").split(",")],
+    "RETRY_BACKOFF": float(os.environ.get("ONADATA_RETRY_BACKOFF", 0.2)),
+    "RETRY_BACKOFF_MAX": float(os.environ.get("ONADATA_RETRY_BACKOFF_MAX", 2)),
+    "RETRY_JITTER": float(os.environ.get("ONADATA_RETRY_JITTER", 0.2)),
+    # retries per worker and minute are capped at RETRY_BUDGET_MIN + RETRY_BUDGET_RATIO * requests
+    "RETRY_BUDGET_RATIO": float(os.environ.get("ONADATA_RETRY_BUDGET_RATIO", 0.2)),
+    "RETRY_BUDGET_MIN": int(os.environ.get("ONADATA_RETRY_BUDGET_MIN", 10)),
+    # BREAKER_FAILURES failures within BREAKER_WINDOW seconds open the circuit for BREAKER_OPEN_SECONDS
+    "BREAKER_FAILURES": int(os.environ.get("ONADATA_BREAKER_FAILURES", 5)),
+    "BREAKER_WINDOW": int(os.environ.get("ONADATA_BREAKER_WINDOW", 30)),
+    "BREAKER_OPEN_SECONDS": int(os.environ.get("ONADATA_BREAKER_OPEN_SECONDS", 30)),
+    # answer from the last good cached entry when Onadata fails or the circuit is open
+    "SERVE_STALE_ON_ERROR": os.environ.get("ONADATA_SERVE_STALE_ON_ERROR", "true").lower() == "true",
+    # submissions per upstream page when streaming
+    "PAGE_SIZE": int(os.environ.get("ONADATA_PAGE_SIZE", 1000)),
+    # largest page_size a client may ask for on the submissions endpoint
+    "MAX_PAGE_SIZE": int(os.environ.get("ONADATA_MAX_PAGE_SIZE", 5000)),
+    # single-flight lock around cache misses: lease and how long followers wait (seconds)
+    "LOCK_LEASE": int(os.environ.get("ONADATA_LOCK_LEASE", 40)),
+    "LOCK_WAIT": float(os.environ.get("ONADATA_LOCK_WAIT", 10)),
+    "LOCK_POLL_INTERVAL": float(os.environ.get("ONADATA_LOCK_POLL_INTERVAL", 0.05)),
+    # seconds cached entries live, and the optional time bucket that busts them early (0 disables)
+    "CACHE_TIMEOUT": int(os.environ.get("ONADATA_CACHE_TIMEOUT", 300)),
+    "CACHE_TIME_WINDOW": int(os.environ.get("ONADATA_CACHE_TIME_WINDOW", 0)),
+    # "ttl" expires entries after CACHE_TIMEOUT, "swr" serves stale entries while refreshing in the background
+    "CACHE_MODE": os.environ.get("ONADATA_CACHE_MODE", "ttl"),
+    "FRESH_TTL": int(os.environ.get("ONADATA_FRESH_TTL", 60)),
+    # how long stale entries stay usable; in "ttl" mode the last good copy outlives CACHE_TIMEOUT by this much
+    "STALE_TTL": int(os.environ.get("ONADATA_STALE_TTL", 600)),
+    "REFRESH_WORKERS": int(os.environ.get("ONADATA_REFRESH_WORKERS", 4)),
+    # serve from the local mirror filled by `manage.py sync_onadata`:
+    # "off", "prefer" (mirror first) or "fallback" (only when Onadata fails)
+    "MIRROR_MODE": os.environ.get("ONADATA_MIRROR_MODE", "off"),
+    # concurrent upstream fetches per worker for the batch submissions endpoint, and forms per batch
+    "BATCH_WORKERS": int(os.environ.get("ONADATA_BATCH_WORKERS", 8)),
+    "BATCH_MAX_FORMS": int(os.environ.get("ONADATA_BATCH_MAX_FORMS", 100)),
+    # cache pre-warming (`manage.py warm_onadata_cache`): hot requests come from per-hour
+    # Redis hit counts ("hits"), the request log store ("logs") or "both"
+    "WARM_TRACK_HITS": os.environ.get("ONADATA_WARM_TRACK_HITS", "true").lower() == "true",
+    # hits are counted per worker and written every WARM_HIT_FLUSH_INTERVAL seconds; each hourly
+    # set keeps its WARM_HITS_MAX most requested paths
+    "WARM_HIT_FLUSH_INTERVAL": float(os.environ.get("ONADATA_WARM_HIT_FLUSH_INTERVAL", 10)),
+    "WARM_HITS_MAX": int(os.environ.get("ONADATA_WARM_HITS_MAX", 1000)),
+    "WARM_SOURCE": os.environ.get("ONADATA_WARM_SOURCE", "hits"),
+    "WARM_TOP": int(os.environ.get("ONADATA_WARM_TOP", 50)),
+    # refresh entries that expire within WARM_LEAD seconds, at most WARM_RATE upstream fetches per second
+    "WARM_LEAD": int(os.environ.get("ONADATA_WARM_LEAD", 15)),
+    "WARM_RATE": float(os.environ.get("ONADATA_WARM_RATE", 5)),
+    "WARM_CONCURRENCY": int(os.environ.get("ONADATA_WARM_CONCURRENCY", 4)),
+    "WARM_INTERVAL": int(os.environ.get("ONADATA_WARM_INTERVAL", 30)),
+}
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
@@ -0,0 +1,28 @@
+"""
+Django's SQLite backend with OPTIONS["transaction_mode"], which Django
+only gained in 5.1: atomic blocks open with BEGIN <transaction_mode>
+instead of a plain (deferred) BEGIN.
+
+Under a deferred BEGIN a transaction that reads before it writes fails
+with "database is locked" as soon as another connection holds the write
+lock, without waiting out the timeout. BEGIN IMMEDIATE takes the write
+lock up front, so concurrent writers wait for it instead.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        mode = (params.pop("transaction_mode", None) or "DEFERRED").upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}, not {mode!r}")
+        self.transaction_mode = mode
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
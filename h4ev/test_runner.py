@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from accounts import metrics
+from accounts.logsink import close_log_sink
+from h4ev import settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that points LOG_DIR, the request log store and the
+    profiles at a temporary directory, so test runs leave the project's
+    logs/ alone, and the Redis caches at the benchmark settings' fakeredis
+    (or BENCH_REDIS_URL), so they need no Redis server.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # imported here: building the fake caches needs fakeredis, which only the tests use
+        from benchmarks import settings as test_settings
+
+        self.cache_settings = override_settings(CACHES=test_settings.CACHES)
+        self.cache_settings.enable()
+        self.log_dir = tempfile.mkdtemp(prefix="h4ev-test-logs-")
+        self.saved_log_settings = (settings.LOG_DIR, settings.REQUEST_LOG["STORE"])
+        settings.LOG_DIR = self.log_dir
+        settings.REQUEST_LOG["STORE"] = os.path.join(self.log_dir, "requests.sqlite3")
+
+    def teardown_test_environment(self, **kwargs):
+        close_log_sink()
+        settings.LOG_DIR, settings.REQUEST_LOG["STORE"] = self.saved_log_settings
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+        # flushed while the test caches are still in place, so the exit-time flush has nothing to send
+        metrics.flush()
+        self.cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -17,21 +17,53 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from accounts.views import CreateUserView, GetAllUsersView, UserLoginView, RetrieveUpdateDeleteUserView
-from onadata.views import GetFormsByUsernameView, GetFormSubmissionsView
+from accounts.views import (
+    CreateUserView,
+    GetAllUsersView,
+    ImportUsersView,
+    MetricsView,
+    ProfileDownloadView,
+    ProfileListView,
+    RequestLogStatsView,
+    RetrieveUpdateDeleteUserView,
+    UserLoginView,
+)
+from onadata.async_views import AsyncGetFormSubmissionsView, AsyncGetFormsByUsernameView
+from onadata.views import (
+    BatchFormSubmissionsView,
+    GetFormsByUsernameView,
+    GetFormSubmissionsView,
+    InvalidateOnadataCacheView,
+    OnadataCacheStatsView,
+    OnadataClientStatsView,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 
     path('api/accounts/create/user/', CreateUserView.as_view(), name='create_user'),
     path('api/accounts/users/get/all/', GetAllUsersView.as_view(), name='create_user'),
+    path('api/accounts/users/import/', ImportUsersView.as_view(), name='import_users'),
     path('api/accounts/login/', UserLoginView.as_view(), name='create_user'),
     path("api/accounts/user/<int:user_id>/", RetrieveUpdateDeleteUserView.as_view(), name="user-detail",),
+    path('api/accounts/logs/stats/', RequestLogStatsView.as_view(), name='request_log_stats'),
+    path('api/accounts/profiles/', ProfileListView.as_view(), name='profiles'),
+    path('api/accounts/profiles/<str:name>/', ProfileDownloadView.as_view(), name='profile_download'),
 
 
     path('api/onadata/user/<str:username>/forms/', GetFormsByUsernameView.as_view(), name='get_forms_by_username'),
     path('api/onadata/form/<str:form_id>/', GetFormSubmissionsView.as_view(), name='get_form_submissions'),
+    path('api/onadata/forms/submissions/', BatchFormSubmissionsView.as_view(), name='batch_form_submissions'),
+    # same endpoints as native async views, for the ASGI (uvicorn) deployment
+    path('api/async/onadata/user/<str:username>/forms/', AsyncGetFormsByUsernameView.as_view(),
+         name='async_get_forms_by_username'),
+    path('api/async/onadata/form/<str:form_id>/', AsyncGetFormSubmissionsView.as_view(),
+         name='async_get_form_submissions'),
+    path('api/onadata/client/stats/', OnadataClientStatsView.as_view(), name='onadata_client_stats'),
+    path('api/onadata/cache/stats/', OnadataCacheStatsView.as_view(), name='onadata_cache_stats'),
+    path('api/onadata/cache/invalidate/', InvalidateOnadataCacheView.as_view(), name='onadata_cache_invalidate'),
 
 
 ]
@@ -1,3 +1,16 @@
 from django.contrib import admin
 
-# Register your models here.
+from onadata.models import Form, Submission
+
+
+@admin.register(Form)
+class FormAdmin(admin.ModelAdmin):
+    list_display = ["formid", "id_string", "owner", "last_submission_id", "last_synced_at"]
+    search_fields = ["id_string", "title", "owner"]
+
+
+@admin.register(Submission)
+class SubmissionAdmin(admin.ModelAdmin):
+    list_display = ["form", "submission_id", "submission_time"]
+    list_select_related = ["form"]
+    raw_id_fields = ["form"]
@@ -0,0 +1,114 @@
+import asyncio
+import weakref
+
+import httpx
+
+from accounts.metrics import timer
+from h4ev import settings
+from onadata.breaker import get_breaker
+from onadata.cache import run_sync
+from onadata.client import conditional_headers, record_outcome
+from onadata.retry import backoff_delay, get_retry_budget
+
+
+class AsyncOnadataClient:
+    """
+    httpx.AsyncClient counterpart of OnadataClient for the async views.
+
+    A single event loop can keep up to ASYNC_MAX_CONNECTIONS upstream
+    requests in flight, instead of tying up one sync worker per request.
+    Retries and the circuit breaker follow the sync client.
+    """
+
+    def __init__(self, base_url=None, max_connections=None, max_keepalive=None,
+                 connect_timeout=None, read_timeout=None):
+        config = settings.ONADATA
+        self.base_url = (base_url or config["BASE_URL"]).rstrip("/")
+        self.client = httpx.AsyncClient(
+            headers={
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate, br",
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections or config["ASYNC_MAX_CONNECTIONS"],
+                max_keepalive_connections=max_keepalive or config["ASYNC_MAX_KEEPALIVE"],
+            ),
+            timeout=httpx.Timeout(
+                read_timeout or config["READ_TIMEOUT"],
+                connect=connect_timeout or config["CONNECT_TIMEOUT"],
+            ),
+        )
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def get(self, path, params=None, validators=None, **kwargs):
+        """
+        GET path from Onadata. When validators from an earlier response are
+        given, the request is conditional and may come back as 304.
+        """
+        if validators:
+            kwargs["headers"] = {**conditional_headers(validators), **kwargs.get("headers", {})}
+
+        breaker = get_breaker()
+        probe = await run_sync(breaker.allow)
+        budget = get_retry_budget()
+        budget.record_request()
+        config = settings.ONADATA
+        attempt = 0
+        while True:
+            try:
+                with timer("upstream"):
+                    response = await self.client.get(self.url(path), params=params, **kwargs)
+            except httpx.TransportError:
+                if attempt < config["RETRIES"] and budget.withdraw():
+                    attempt += 1
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                await run_sync(breaker.record_failure, probe)
+                raise
+
+            if response.status_code in config["RETRY_STATUSES"] and attempt < config["RETRIES"] and budget.withdraw():
+                attempt += 1
+                await asyncio.sleep(retry_after(response) or backoff_delay(attempt))
+                continue
+            break
+
+        await run_sync(record_outcome, breaker, response.status_code, probe)
+        return response
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def retry_after(response):
+    value = response.headers.get("Retry-After", "")
+    return min(int(value), settings.ONADATA["RETRY_BACKOFF_MAX"]) if value.isdigit() else None
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncOnadataClient:
+    """
+    Return the async Onadata client for the running event loop.
+
+    httpx connections belong to the loop that opened them, so each loop
+    (one per uvicorn worker) gets its own client and pool. The client is
+    closed when its loop shuts down: under WSGI every request runs in a
+    loop of its own, which would otherwise leave a client behind each time.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncOnadataClient()
+        client.closer = loop.create_task(close_on_shutdown(client))
+    return client
+
+
+async def close_on_shutdown(client):
+    """Wait until the loop shuts down, which cancels its pending tasks, then close client"""
+    try:
+        await asyncio.get_running_loop().create_future()
+    finally:
+        await client.close()
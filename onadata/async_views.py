@@ -0,0 +1,246 @@
+"""
+Async (ASGI) versions of the Onadata views.
+
+Served under an ASGI server (gunicorn with uvicorn workers), a request
+waiting on Onadata only holds a coroutine, so one process can keep
+hundreds of upstream calls in flight. They answer exactly like their sync
+counterparts in onadata/views.py, which keep serving the WSGI deployment.
+"""
+import itertools
+import json
+import math
+from datetime import datetime
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+
+from accounts.services import start_log_entry, write_log_entry
+from onadata.breaker import CircuitOpenError
+from onadata.cache import acached_fetch, form_tag, owner_tag
+from onadata.mirror import mirror_enabled, mirror_etag, mirrored_form, mirrored_forms, submission_values
+from onadata.services import (
+    afetch_form_submissions,
+    afetch_user_forms,
+    aiter_form_submissions,
+    parse_submission_query,
+    submission_cache_params,
+    submission_mongo_query,
+)
+from onadata.views import STREAM_CONTENT_TYPES, client_has, projected
+from onadata.warmer import record_hit
+
+MIRROR_CHUNK_SIZE = 2000
+UPSTREAM_ERRORS = (httpx.HTTPError, CircuitOpenError)
+
+
+def etag_json_response(request, data, etag):
+    if client_has(request, etag):
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(data, safe=False)
+    response["ETag"] = etag
+    return response
+
+
+def upstream_error_response(body, error):
+    if isinstance(error, CircuitOpenError):
+        response = JsonResponse(body, status=503)
+        response["Retry-After"] = str(math.ceil(error.retry_after))
+        return response
+    return JsonResponse(body, status=502)
+
+
+async def astream_records(records, stream_format):
+    """Serialize an async iterable lazily; an upstream failure aborts the stream as in stream_records"""
+    index = 0
+    if stream_format == "json":
+        yield "["
+    try:
+        async for record in records:
+            if stream_format == "ndjson":
+                yield json.dumps(record) + "\n"
+            else:
+                yield ("," if index else "") + json.dumps(record)
+            index += 1
+    except UPSTREAM_ERRORS as e:
+        print(f"Error streaming form submissions: {e}")
+        raise
+    if stream_format == "json":
+        yield "]"
+
+
+async def amirror_records(form, query):
+    """Mirrored submissions read in chunks on the ORM thread"""
+    records = submission_values(form, query).iterator(chunk_size=MIRROR_CHUNK_SIZE)
+    next_chunk = sync_to_async(lambda: list(itertools.islice(records, MIRROR_CHUNK_SIZE)))
+    while True:
+        chunk = await next_chunk()
+        if not chunk:
+            return
+        for record in projected(chunk, query):
+            yield record
+
+
+class AsyncLoggingView(View):
+    """
+    Async counterpart of LoggingAPIView: authenticates the JWT and writes
+    the same per-user request log entry. DRF's APIView only dispatches
+    synchronously, so these are plain Django async views.
+    """
+    # the project's JWT authentication (CachedJWTAuthentication unless ACCOUNTS_JWT_USER_CACHE is off)
+    authentication = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await sync_to_async(self.authentication.authenticate)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": e.detail}, status=401)
+        if authenticated is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        request.user = authenticated[0]
+
+        start_time = datetime.utcnow()
+        log_entry = start_log_entry(request, start_time)
+        response = await super().dispatch(request, *args, **kwargs)
+        write_log_entry(request, log_entry, start_time, response.status_code)
+        return response
+
+
+class AsyncGetFormsByUsernameView(AsyncLoggingView):
+
+    async def get(self, request, username):
+
+        if mirror_enabled("prefer"):
+            data, etag = await sync_to_async(mirrored_forms)(username)
+            if data:
+                return etag_json_response(request, data, etag)
+
+        record_hit(request.path, request.GET)
+        # Parameters to be considered for cache busting
+        url_params = request.GET.dict()
+
+        try:
+            entry = await acached_fetch(
+                "user_forms",
+                {"username": username},
+                url_params,
+                lambda validators: afetch_user_forms(username, validators),
+                tags=[owner_tag(username)],
+            )
+
+        except UPSTREAM_ERRORS as e:
+            print(f"Error fetching forms: {e}")
+            if mirror_enabled("fallback"):
+                data, etag = await sync_to_async(mirrored_forms)(username)
+                if data:
+                    return etag_json_response(request, data, etag)
+            return upstream_error_response({"error": "Failed to fetch forms"}, e)
+
+        data = entry["data"]
+        if len(data) == 0:
+            return JsonResponse(f"error: no forms found for user {username}", safe=False)
+        return etag_json_response(request, data, entry["etag"])
+
+
+class AsyncGetFormSubmissionsView(AsyncLoggingView):
+
+    async def get(self, request, form_id):
+
+        try:
+            query = parse_submission_query(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        form = await sync_to_async(mirrored_form)(form_id) if mirror_enabled("prefer") else None
+
+        stream_format = request.GET.get("stream")
+        if stream_format in STREAM_CONTENT_TYPES:
+            if form is not None:
+                return StreamingHttpResponse(
+                    astream_records(amirror_records(form, query), stream_format),
+                    content_type=STREAM_CONTENT_TYPES[stream_format],
+                )
+            return await self.stream(form_id, query, stream_format)
+
+        if form is not None:
+            return await self.from_mirror(request, form, query)
+
+        record_hit(request.path, request.GET)
+        # one cache entry per distinct upstream query
+        url_params = submission_cache_params(query, request.GET)
+
+        try:
+            entry = await acached_fetch(
+                "form_submissions",
+                {"form_id": form_id},
+                url_params,
+                lambda validators: afetch_form_submissions(form_id, validators, query=query),
+                tags=[form_tag(form_id)],
+            )
+
+        except UPSTREAM_ERRORS as e:
+            print(f"Error fetching form submissions: {e}")
+            form = await sync_to_async(mirrored_form)(form_id) if mirror_enabled("fallback") else None
+            if form is not None:
+                return await self.from_mirror(request, form, query)
+            return upstream_error_response(
+                {
+                    "error": "Failed to fetch form submissions",
+                    "error_description": f"External API returned {str(e)}"
+                },
+                e
+            )
+
+        data = entry["data"]
+        if not data:
+            return JsonResponse({"error": f"No submissions found for form {form_id}"}, status=404)
+
+        return etag_json_response(request, data, entry["etag"])
+
+    async def from_mirror(self, request, form, query):
+        etag = await sync_to_async(mirror_etag)(form, variant=request.GET.urlencode())
+        if client_has(request, etag):
+            return etag_json_response(request, None, etag)
+
+        data = await sync_to_async(lambda: list(projected(submission_values(form, query), query)))()
+        if not data:
+            return JsonResponse({"error": f"No submissions found for form {form.formid}"}, status=404)
+        return etag_json_response(request, data, etag)
+
+    async def stream(self, form_id, query, stream_format):
+        """Stream submissions page by page; see GetFormSubmissionsView.stream"""
+        records = aiter_form_submissions(
+            form_id,
+            query=submission_mongo_query(query) or None,
+            fields=query.get("fields"),
+        )
+
+        try:
+            # fetch the first page up front so upstream errors still map to a status code
+            first = await anext(records, None)
+        except UPSTREAM_ERRORS as e:
+            print(f"Error fetching form submissions: {e}")
+            return upstream_error_response(
+                {
+                    "error": "Failed to fetch form submissions",
+                    "error_description": f"External API returned {str(e)}"
+                },
+                e
+            )
+
+        if first is None:
+            return JsonResponse({"error": f"No submissions found for form {form_id}"}, status=404)
+
+        async def chained():
+            yield first
+            async for record in records:
+                yield record
+
+        return StreamingHttpResponse(
+            astream_records(chained(), stream_format),
+            content_type=STREAM_CONTENT_TYPES[stream_format],
+        )
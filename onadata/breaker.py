@@ -0,0 +1,193 @@
+"""
+Circuit breaker for Onadata shared by every worker through Redis.
+
+BREAKER_FAILURES failed calls (connection errors, timeouts, 5xx) within
+BREAKER_WINDOW seconds open the circuit for BREAKER_OPEN_SECONDS, during
+which calls fail at once with CircuitOpenError. After that a single
+probe call is let through (half-open): success closes the circuit, failure
+opens it again. Without Redis the state is kept per worker.
+"""
+import threading
+import time
+
+import requests
+from redis.exceptions import RedisError
+
+from h4ev import settings
+
+KEY_PREFIX = "onadata:breaker"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling Onadata while the circuit is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Onadata circuit breaker is open; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class LocalState:
+    """In-process stand-in for the Redis keys when the cache is not Redis"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.values.get(key, (None, 0))
+            return value if expires > time.time() else None
+
+    def set(self, key, value, ttl, nx=False):
+        with self.lock:
+            current, expires = self.values.get(key, (None, 0))
+            if nx and current is not None and expires > time.time():
+                return False
+            self.values[key] = (value, time.time() + ttl)
+            return True
+
+    def incr(self, key, ttl):
+        with self.lock:
+            current, expires = self.values.get(key, (None, 0))
+            if current is None or expires <= time.time():
+                current, expires = 0, time.time() + ttl
+            self.values[key] = (current + 1, expires)
+            return current + 1
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+
+class CircuitBreaker:
+
+    def __init__(self, name="onadata", failures=None, window=None, open_seconds=None):
+        config = settings.ONADATA
+        self.name = name
+        self.failures = failures or config["BREAKER_FAILURES"]
+        self.window = window or config["BREAKER_WINDOW"]
+        self.open_seconds = open_seconds or config["BREAKER_OPEN_SECONDS"]
+        # a probe that never reports back frees the slot after one full upstream timeout
+        self.probe_ttl = int(config["CONNECT_TIMEOUT"] + config["READ_TIMEOUT"]) + 1
+        self.local = LocalState()
+        self.counters = {"rejected": 0, "failures": 0, "opened": 0, "probes": 0}
+
+    def key(self, part):
+        return f"{KEY_PREFIX}:{self.name}:{part}"
+
+    def redis(self):
+        from onadata.cache import get_redis
+        return get_redis()
+
+    def open_until(self):
+        redis = self.redis()
+        try:
+            value = redis.get(self.key("open")) if redis is not None else self.local.get(self.key("open"))
+        except RedisError as e:
+            # without Redis the breaker cannot coordinate; let calls through
+            print(f"Error reading circuit breaker state: {e}")
+            return None
+        return float(value) if value is not None else None
+
+    def allow(self) -> bool:
+        """
+        Raise CircuitOpenError unless a call to Onadata may go ahead.
+        Returns True when the call is the half-open probe; pass that back
+        to record_success / record_failure.
+        """
+        until = self.open_until()
+        if until is None:
+            return False
+
+        now = time.time()
+        if now < until:
+            self.counters["rejected"] += 1
+            raise CircuitOpenError(until - now)
+
+        # half-open: a single worker gets to probe the upstream
+        redis = self.redis()
+        try:
+            if redis is not None:
+                acquired = redis.set(self.key("probe"), 1, nx=True, ex=self.probe_ttl)
+            else:
+                acquired = self.local.set(self.key("probe"), 1, self.probe_ttl, nx=True)
+        except RedisError:
+            acquired = True
+        if not acquired:
+            self.counters["rejected"] += 1
+            # another worker's probe is in flight
+            raise CircuitOpenError(1)
+        self.counters["probes"] += 1
+        return True
+
+    def record_success(self, probe=False):
+        if not probe:
+            return
+        keys = [self.key("open"), self.key("probe"), self.key("failures")]
+        redis = self.redis()
+        try:
+            if redis is not None:
+                redis.delete(*keys)
+            else:
+                self.local.delete(*keys)
+        except RedisError as e:
+            print(f"Error closing circuit breaker: {e}")
+
+    def record_failure(self, probe=False):
+        self.counters["failures"] += 1
+        redis = self.redis()
+        try:
+            if probe:
+                self.trip(redis)
+                return
+
+            if redis is not None:
+                pipe = redis.pipeline(transaction=False)
+                pipe.incr(self.key("failures"))
+                pipe.expire(self.key("failures"), self.window, nx=True)
+                count = pipe.execute()[0]
+            else:
+                count = self.local.incr(self.key("failures"), self.window)
+            if count >= self.failures:
+                self.trip(redis)
+        except RedisError as e:
+            print(f"Error recording circuit breaker failure: {e}")
+
+    def trip(self, redis):
+        until = time.time() + self.open_seconds
+        # keep the marker past the open period so the half-open probe can find it
+        ttl = self.open_seconds + self.window + self.probe_ttl
+        if redis is not None:
+            pipe = redis.pipeline(transaction=False)
+            pipe.set(self.key("open"), until, ex=ttl)
+            pipe.delete(self.key("probe"), self.key("failures"))
+            pipe.execute()
+        else:
+            self.local.set(self.key("open"), until, ttl)
+            self.local.delete(self.key("probe"), self.key("failures"))
+        self.counters["opened"] += 1
+        print(f"Onadata circuit breaker opened for {self.open_seconds}s")
+
+    def state(self):
+        until = self.open_until()
+        if until is None:
+            return "closed"
+        return "open" if time.time() < until else "half_open"
+
+    def stats(self) -> dict:
+        return {"state": self.state(), **self.counters}
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker() -> CircuitBreaker:
+    global _breaker
+
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker()
+    return _breaker
@@ -0,0 +1,545 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import orjson
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.utils.connection import ConnectionProxy
+from redis.exceptions import LockError
+
+from accounts import metrics
+from accounts.metrics import TimedCache
+from accounts.services import generate_cache_key
+from h4ev import settings
+from h4ev.process import per_process
+from onadata.breaker import CircuitOpenError
+
+cache = TimedCache(ConnectionProxy(caches, settings.ONADATA["CACHE_ALIAS"]))
+
+
+def get_lock(cache_key, thread_local=True):
+    """
+    Return a Redis lock guarding the fetch for cache_key, or None when the
+    configured cache backend has no lock support (e.g. local memory cache).
+    """
+    if not hasattr(cache, "lock"):
+        return None
+    return cache.lock(
+        f"lock:{cache_key}",
+        timeout=settings.ONADATA["LOCK_LEASE"],
+        thread_local=thread_local,
+    )
+
+
+def release_lock(lock):
+    try:
+        lock.release()
+    except LockError:
+        # lease ran out while fetching and another process may hold it now
+        pass
+
+
+def cached_fetch(route, path_params, url_params, fetch, tags=(), should_cache=bool):
+    """
+    Serve an Onadata response through the cache using the configured
+    ONADATA CACHE_MODE, returning its cache entry (see make_entry).
+
+    fetch(validators) must return (data, status_code, validators) like the
+    onadata.services fetch_* functions. When a previous entry exists its
+    upstream validators are sent along, so an unchanged resource costs a 304
+    instead of a full download.
+
+    Keys are scoped to the route and its path parameters rather than the
+    requesting user, since the upstream response is the same for everyone.
+    Every entry is recorded under its tags so it can be invalidated with
+    invalidate_tags() instead of waiting for the TTL.
+
+    "ttl" keeps the original behaviour: entries expire after CACHE_TIMEOUT,
+    optionally bucketed on CACHE_TIME_WINDOW, and misses are coalesced with
+    single_flight. "swr" serves stale entries immediately while they are
+    refreshed in the background. With SERVE_STALE_ON_ERROR, a failed fetch
+    (including an open circuit breaker) falls back to the last good entry.
+    """
+    with metrics.cache_lookup(route):
+        config = settings.ONADATA
+        key = generate_cache_key(user=None, url_params=url_params, route=route, path_params=path_params)
+
+        if config["CACHE_MODE"] == "swr":
+            return stale_while_revalidate(key, fetch, should_cache=should_cache, tags=tags)
+
+        cache_key = generate_cache_key(
+            user=None,
+            url_params=url_params,
+            time_window=config["CACHE_TIME_WINDOW"],
+            route=route,
+            path_params=path_params,
+        )
+        stale_key = stale_key_of(key)
+        try:
+            return single_flight(
+                cache_key,
+                lambda: load_entry(fetch, previous=cache.get(stale_key)),
+                config["CACHE_TIMEOUT"],
+                stale_key=stale_key,
+                should_cache=lambda entry: should_cache(entry["data"]),
+                tags=tags,
+            )
+        except requests.exceptions.RequestException as e:
+            entry = stale_entry(stale_key, e)
+            if entry is None:
+                raise
+            metrics.mark_stale()
+            return entry
+
+
+def stale_key_of(key):
+    """
+    Key of the last good entry behind a "ttl" mode entry. It has its own key
+    whatever the CACHE_TIME_WINDOW, so it outlives the fresh entry: misses
+    revalidate it against the upstream and failures can fall back to it.
+    """
+    return f"{key}:stale"
+
+
+def stale_entry(stale_key, error):
+    """The last good entry for stale_key when SERVE_STALE_ON_ERROR allows it"""
+    if not settings.ONADATA["SERVE_STALE_ON_ERROR"]:
+        return None
+    entry = cache.get(stale_key)
+    if entry is not None:
+        print(f"Serving stale {stale_key} after upstream error: {error}")
+    return entry
+
+
+def get_redis():
+    """Raw Redis connection behind the Onadata cache, or None for other backends"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection(getattr(cache, "remote_alias", settings.ONADATA["CACHE_ALIAS"]))
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def tag_set_key(tag):
+    return f"onadata:tag:{tag}"
+
+
+def tag_entry(cache_key, tags, timeout):
+    """Record cache_key in the Redis set of each tag"""
+    if not tags:
+        return
+
+    redis = get_redis()
+    if redis is None:
+        for tag in tags:
+            keys = cache.get(tag_set_key(tag), set())
+            keys.add(cache_key)
+            cache.set(tag_set_key(tag), keys, timeout=timeout)
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    for tag in tags:
+        pipe.sadd(tag_set_key(tag), cache_key)
+        # keep the set around at least as long as its newest entry
+        pipe.expire(tag_set_key(tag), timeout, gt=True)
+        pipe.expire(tag_set_key(tag), timeout, nx=True)
+    pipe.execute()
+
+
+def invalidate_tags(tags) -> int:
+    """Delete every cache entry recorded under any of tags, returning how many"""
+    redis = get_redis()
+    deleted = 0
+
+    for tag in tags:
+        if redis is None:
+            keys = cache.get(tag_set_key(tag), set())
+            cache.delete(tag_set_key(tag))
+        else:
+            keys = {key.decode() for key in redis.smembers(tag_set_key(tag))}
+            redis.delete(tag_set_key(tag))
+        if keys:
+            cache.delete_many(list(keys))
+            deleted += len(keys)
+
+    return deleted
+
+
+def form_tag(form_id):
+    return f"form:{form_id}"
+
+
+def owner_tag(username):
+    return f"owner:{username}"
+
+
+def single_flight(cache_key, fetch, timeout, stale_key=None, should_cache=bool, tags=()):
+    """
+    Return the cached value for cache_key, calling fetch() on a miss.
+
+    Concurrent misses are coalesced across every worker through a Redis
+    lock with a lease: one caller fetches and fills the cache while the
+    others serve the previous value stored under stale_key, or wait for
+    the fetch to land.
+    """
+    data = cache.get(cache_key)
+    if data is not None:
+        return data
+
+    lock = get_lock(cache_key)
+    if lock is None:
+        return fill(cache_key, fetch, timeout, stale_key, should_cache, tags)
+
+    if lock.acquire(blocking=False):
+        try:
+            # the previous holder may have filled the cache while we raced for the lock
+            data = cache.get(cache_key)
+            if data is not None:
+                return data
+            return fill(cache_key, fetch, timeout, stale_key, should_cache, tags)
+        finally:
+            release_lock(lock)
+
+    if stale_key:
+        data = cache.get(stale_key)
+        if data is not None:
+            return data
+
+    deadline = time.monotonic() + settings.ONADATA["LOCK_WAIT"]
+    while time.monotonic() < deadline:
+        time.sleep(settings.ONADATA["LOCK_POLL_INTERVAL"])
+        data = cache.get(cache_key)
+        if data is not None:
+            return data
+        if not lock.locked():
+            # holder finished without caching anything (empty result or upstream error)
+            break
+
+    return fill(cache_key, fetch, timeout, stale_key, should_cache, tags)
+
+
+def fill(cache_key, fetch, timeout, stale_key=None, should_cache=bool, tags=()):
+    data = fetch()
+    if should_cache(data):
+        cache.set(cache_key, data, timeout=timeout)
+        tag_entry(cache_key, tags, timeout)
+        if stale_key:
+            # the last good entry outlives the fresh one so it can stand in during outages
+            stale_timeout = timeout + settings.ONADATA["STALE_TTL"]
+            cache.set(stale_key, data, timeout=stale_timeout)
+            tag_entry(stale_key, tags, stale_timeout)
+    return data
+
+
+def make_entry(data, validators=None, etag=None):
+    """
+    Envelope stored for every Onadata response: the data, when it stops
+    being fresh, the upstream validators used to revalidate it and the
+    ETag we hand to our own clients.
+    """
+    return {
+        "data": data,
+        "fresh_until": time.time() + settings.ONADATA["FRESH_TTL"],
+        "validators": validators or {},
+        "etag": etag or content_etag(data),
+    }
+
+
+def content_etag(data):
+    return '"%s"' % hashlib.md5(orjson.dumps(data)).hexdigest()
+
+
+def load_entry(fetch, previous=None):
+    """Fetch a new entry, revalidating previous against the upstream if given"""
+    validators = previous["validators"] if previous else None
+    data, status_code, validators = fetch(validators)
+    if status_code == 304 and previous is not None:
+        return make_entry(previous["data"], validators, etag=previous["etag"])
+    return make_entry(data, validators)
+
+
+def entry_timeout():
+    # entries live in Redis for their fresh period plus the stale grace period
+    return settings.ONADATA["FRESH_TTL"] + settings.ONADATA["STALE_TTL"]
+
+
+def stale_while_revalidate(cache_key, fetch, should_cache=bool, tags=()):
+    """
+    Return the cached entry for cache_key, refreshing it in the background
+    once it is past its fresh TTL. Only a hard miss waits on the upstream.
+    """
+    entry = cache.get(cache_key)
+    if entry is not None:
+        if entry["fresh_until"] <= time.time():
+            schedule_refresh(cache_key, fetch, should_cache, tags, previous=entry)
+        return entry
+
+    return single_flight(
+        cache_key,
+        lambda: load_entry(fetch),
+        timeout=entry_timeout(),
+        should_cache=lambda entry: should_cache(entry["data"]),
+        tags=tags,
+    )
+
+
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+
+@per_process
+def get_refresh_pool() -> ThreadPoolExecutor:
+    """Background refresh workers for this process"""
+    with _refresh_lock:
+        # refreshes queued in the parent never run in this process
+        _refreshing.clear()
+    return ThreadPoolExecutor(
+        max_workers=settings.ONADATA["REFRESH_WORKERS"],
+        thread_name_prefix="onadata-refresh",
+    )
+
+
+def schedule_refresh(cache_key, fetch, should_cache=bool, tags=(), previous=None):
+    """
+    Queue a background refresh of cache_key unless one is already running
+    in this process or, through the Redis lock, in any other worker.
+    """
+    with _refresh_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    # the lock is released from the refresh thread, so it must not be thread-local
+    lock = get_lock(cache_key, thread_local=False)
+    if lock is not None and not lock.acquire(blocking=False):
+        with _refresh_lock:
+            _refreshing.discard(cache_key)
+        return
+
+    get_refresh_pool().submit(refresh, cache_key, fetch, should_cache, tags, previous, lock)
+
+
+def refresh(cache_key, fetch, should_cache, tags, previous, lock) -> bool:
+    try:
+        entry = load_entry(fetch, previous)
+        if should_cache(entry["data"]):
+            cache.set(cache_key, entry, timeout=entry_timeout())
+            tag_entry(cache_key, tags, entry_timeout())
+        return True
+    except Exception as e:
+        # keep serving the stale entry; the next stale read retries the refresh
+        print(f"Error refreshing {cache_key}: {e}")
+        return False
+    finally:
+        if lock is not None:
+            release_lock(lock)
+        with _refresh_lock:
+            _refreshing.discard(cache_key)
+        close_old_connections()
+
+
+def remaining_ttl(cache_key):
+    """Seconds before cache_key expires: 0 when missing, None when unknown (no TTL support)"""
+    ttl = getattr(cache, "ttl", None)
+    if ttl is None:
+        return None if cache.get(cache_key) is not None else 0
+    remaining = ttl(cache_key)
+    return float("inf") if remaining is None else remaining
+
+
+def warm(route, path_params, url_params, fetch, tags=(), should_cache=bool, lead=0) -> str:
+    """
+    Refresh what cached_fetch would serve for these parameters when it is
+    missing or expires within lead seconds, so requests never see the miss.
+    Returns "fresh" (nothing to do), "warmed", "busy" (another worker is
+    refreshing it) or "failed".
+
+    In "ttl" mode with a CACHE_TIME_WINDOW this also fills the next
+    window's key when the boundary falls within lead seconds.
+    """
+    config = settings.ONADATA
+    key = generate_cache_key(user=None, url_params=url_params, route=route, path_params=path_params)
+
+    if config["CACHE_MODE"] == "swr":
+        previous = cache.get(key)
+        if previous is not None and previous["fresh_until"] - time.time() > lead:
+            return "fresh"
+        lock = get_lock(key, thread_local=False)
+        if lock is not None and not lock.acquire(blocking=False):
+            return "busy"
+        with _refresh_lock:
+            _refreshing.add(key)
+        return "warmed" if refresh(key, fetch, should_cache, tags, previous, lock) else "failed"
+
+    stale_key = stale_key_of(key)
+
+    now = time.time()
+    keys = []
+    for at in (now, now + lead):
+        key = generate_cache_key(
+            user=None,
+            url_params=url_params,
+            time_window=config["CACHE_TIME_WINDOW"],
+            route=route,
+            path_params=path_params,
+            timestamp=at,
+        )
+        if key not in keys:
+            keys.append(key)
+    expiring = []
+    for key in keys:
+        remaining = remaining_ttl(key)
+        # without TTL support an existing entry is revalidated every pass (usually a cheap 304)
+        if remaining is None or remaining <= lead:
+            expiring.append(key)
+    if not expiring:
+        return "fresh"
+
+    try:
+        entry = load_entry(fetch, previous=cache.get(stale_key))
+    except requests.exceptions.RequestException as e:
+        print(f"Error warming {stale_key}: {e}")
+        return "failed"
+    for key in expiring:
+        fill(key, lambda: entry, config["CACHE_TIMEOUT"], stale_key,
+             lambda entry: should_cache(entry["data"]), tags)
+    return "warmed"
+
+
+# Async counterparts for the ASGI views. Django's own aget/aset run every
+# call on the single thread-sensitive executor, which would serialize all
+# Redis traffic of the event loop; the cache clients are thread-safe, so
+# they are run on the default executor instead.
+
+def run_sync(func, *args, **kwargs):
+    return sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+
+async def acached_fetch(route, path_params, url_params, fetch, tags=(), should_cache=bool):
+    """cached_fetch for async views; fetch(validators) is a coroutine function"""
+    with metrics.cache_lookup(route):
+        config = settings.ONADATA
+        key = generate_cache_key(user=None, url_params=url_params, route=route, path_params=path_params)
+
+        if config["CACHE_MODE"] == "swr":
+            return await astale_while_revalidate(key, fetch, should_cache=should_cache, tags=tags)
+
+        cache_key = generate_cache_key(
+            user=None,
+            url_params=url_params,
+            time_window=config["CACHE_TIME_WINDOW"],
+            route=route,
+            path_params=path_params,
+        )
+        stale_key = stale_key_of(key)
+
+        async def load():
+            return await aload_entry(fetch, previous=await run_sync(cache.get, stale_key))
+
+        try:
+            return await asingle_flight(
+                cache_key,
+                load,
+                config["CACHE_TIMEOUT"],
+                stale_key=stale_key,
+                should_cache=lambda entry: should_cache(entry["data"]),
+                tags=tags,
+            )
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            entry = await run_sync(stale_entry, stale_key, e)
+            if entry is None:
+                raise
+            metrics.mark_stale()
+            return entry
+
+
+async def asingle_flight(cache_key, fetch, timeout, stale_key=None, should_cache=bool, tags=()):
+    """single_flight for coroutine fetches; waiting callers sleep without holding a thread"""
+    data = await run_sync(cache.get, cache_key)
+    if data is not None:
+        return data
+
+    # acquired and released from different executor threads
+    lock = get_lock(cache_key, thread_local=False)
+    if lock is None:
+        return await afill(cache_key, fetch, timeout, stale_key, should_cache, tags)
+
+    if await run_sync(lock.acquire, blocking=False):
+        try:
+            data = await run_sync(cache.get, cache_key)
+            if data is not None:
+                return data
+            return await afill(cache_key, fetch, timeout, stale_key, should_cache, tags)
+        finally:
+            await run_sync(release_lock, lock)
+
+    if stale_key:
+        data = await run_sync(cache.get, stale_key)
+        if data is not None:
+            return data
+
+    deadline = time.monotonic() + settings.ONADATA["LOCK_WAIT"]
+    while time.monotonic() < deadline:
+        await asyncio.sleep(settings.ONADATA["LOCK_POLL_INTERVAL"])
+        data = await run_sync(cache.get, cache_key)
+        if data is not None:
+            return data
+        if not await run_sync(lock.locked):
+            break
+
+    return await afill(cache_key, fetch, timeout, stale_key, should_cache, tags)
+
+
+async def afill(cache_key, fetch, timeout, stale_key=None, should_cache=bool, tags=()):
+    data = await fetch()
+    if should_cache(data):
+        await run_sync(fill, cache_key, lambda: data, timeout, stale_key, should_cache, tags)
+    return data
+
+
+async def aload_entry(fetch, previous=None):
+    validators = previous["validators"] if previous else None
+    data, status_code, validators = await fetch(validators)
+    if status_code == 304 and previous is not None:
+        return make_entry(previous["data"], validators, etag=previous["etag"])
+    return make_entry(data, validators)
+
+
+async def astale_while_revalidate(cache_key, fetch, should_cache=bool, tags=()):
+    """stale_while_revalidate for coroutine fetches"""
+    entry = await run_sync(cache.get, cache_key)
+    if entry is not None:
+        if entry["fresh_until"] <= time.time():
+            await aschedule_refresh(cache_key, fetch, should_cache, tags, previous=entry)
+        return entry
+
+    return await asingle_flight(
+        cache_key,
+        lambda: aload_entry(fetch),
+        timeout=entry_timeout(),
+        should_cache=lambda entry: should_cache(entry["data"]),
+        tags=tags,
+    )
+
+
+async def aschedule_refresh(cache_key, fetch, should_cache=bool, tags=(), previous=None):
+    """
+    schedule_refresh for coroutine fetches. The refresh runs on the refresh
+    pool in an event loop of its own: a task on the request's loop would be
+    cancelled with it, and under WSGI that loop ends with the request.
+    """
+    await run_sync(schedule_refresh, cache_key, blocking_fetch(fetch), should_cache, tags, previous)
+
+
+def blocking_fetch(fetch):
+    """A fetch(validators) that runs a coroutine fetch to completion in a new event loop"""
+    async def run(validators):
+        return await fetch(validators)
+
+    return lambda validators: async_to_sync(run, force_new_loop=True)(validators)
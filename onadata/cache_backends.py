@@ -0,0 +1,342 @@
+"Two-tier cache backend: a per-process LRU in front of another Django cache."
+import json
+import os
+import pickle
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from h4ev.process import per_process
+
+
+class LocalTier:
+    """Byte-bounded LRU of live objects, each with its own expiry"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.subscriber = None
+        self.counters = {
+            "local_hits": 0,
+            "local_misses": 0,
+            "remote_hits": 0,
+            "remote_misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["local_misses"] += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.counters["local_misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["local_hits"] += 1
+            return entry
+
+    def set(self, key, value, ttl, size=None):
+        """size is the value's encoded length in bytes, measured by pickling when not given"""
+        if ttl is not None and ttl <= 0:
+            self.delete(key)
+            return
+
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        expires_at = None if ttl is None else time.monotonic() + ttl
+
+        with self.lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (expires_at, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._pop(oldest)
+                self.counters["evictions"] += 1
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "pid": os.getpid(),
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+@per_process
+def get_tier(name, max_bytes):
+    """
+    Return this process's local tier for the alias name. Django hands out
+    one backend instance per thread, so the tier is shared through here.
+    """
+    return LocalTier(max_bytes)
+
+
+class TwoTierCache(BaseCache):
+    """
+    Serve hot keys from an in-process LRU and fall back to the cache alias
+    named in LOCATION (normally the Redis "default" cache).
+
+    Local entries expire with the remote entry's TTL and are sized by the
+    bytes the remote stored. With a django-redis remote, a local miss reads
+    the value and its TTL in one pipeline, and writes encode the value once
+    for both tiers. Every write or delete
+    is published on a Redis channel so the other workers drop their local
+    copies. Values come back as the shared cached objects, so callers must
+    not mutate them.
+
+    OPTIONS:
+      MAX_BYTES      size bound of the local tier (encoded size)
+      MAX_LOCAL_TTL  upper bound on how long an entry stays local (seconds)
+      CHANNEL        pub/sub channel used for invalidation
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.remote_alias = location
+        self.max_bytes = int(options.get("MAX_BYTES", 64 * 1024 * 1024))
+        self.max_local_ttl = options.get("MAX_LOCAL_TTL", 300)
+        self.channel = options.get("CHANNEL", f"cache-invalidate:{location}")
+        self.name = f"{location}:{self.channel}"
+
+    @property
+    def remote(self):
+        return caches[self.remote_alias]
+
+    @property
+    def local(self):
+        tier = get_tier(self.name, self.max_bytes)
+        if tier.subscriber is None:
+            self.start_subscriber(tier)
+        return tier
+
+    def __getattr__(self, name):
+        # expose backend specific helpers such as lock() and ttl()
+        if name.startswith("_") or name == "remote_alias":
+            raise AttributeError(name)
+        return getattr(caches[self.remote_alias], name)
+
+    @property
+    def redis_client(self):
+        """The remote's django-redis client, or None for other backends"""
+        client = getattr(self.remote, "client", None)
+        return client if hasattr(client, "encode") and hasattr(client, "decode") else None
+
+    def local_ttl(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            ttl_of = getattr(self.remote, "ttl", None)
+            ttl = ttl_of(key, version=version) if ttl_of else self.default_timeout
+        else:
+            ttl = timeout
+        return self.bound_ttl(ttl)
+
+    def bound_ttl(self, ttl):
+        if ttl is None:
+            return self.max_local_ttl
+        return min(ttl, self.max_local_ttl) if self.max_local_ttl else ttl
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        local = self.local
+        entry = local.get(local_key)
+        if entry is not None:
+            return entry[2]
+
+        client = self.redis_client
+        if client is None:
+            value = self.remote.get(key, self._missing_key, version=version)
+            if value is self._missing_key:
+                local.count("remote_misses")
+                return default
+            local.count("remote_hits")
+            local.set(local_key, value, self.local_ttl(key, version=version))
+            return value
+
+        remote_key = client.make_key(key, version=version)
+        redis = client.get_client(write=False)
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.get(remote_key)
+            pipe.pttl(remote_key)
+            raw, pttl = pipe.execute()
+        except RedisError as e:
+            raise ConnectionInterrupted(connection=redis) from e
+        if raw is None:
+            local.count("remote_misses")
+            return default
+
+        local.count("remote_hits")
+        value = client.decode(raw)
+        # PTTL is -1 for a key without expiry
+        local.set(local_key, value, self.bound_ttl(None if pttl < 0 else pttl / 1000), size=len(raw))
+        return value
+
+    def get_many(self, keys, version=None):
+        return {
+            key: value
+            for key in keys
+            if (value := self.get(key, self._missing_key, version=version)) is not self._missing_key
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        client = self.redis_client
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.remote.default_timeout
+
+        if client is None:
+            self.remote.set(key, value, timeout=timeout, version=version)
+            self.local.set(local_key, value, self.local_ttl(key, timeout, version))
+        elif timeout is not None and timeout <= 0:
+            # like django-redis, a non-positive timeout deletes the key
+            self.remote.delete(key, version=version)
+            self.local.delete(local_key)
+        else:
+            # encode once: the bytes stored in Redis also size the local copy
+            raw = client.encode(value)
+            redis = client.get_client(write=True)
+            try:
+                redis.set(client.make_key(key, version=version), raw, px=None if timeout is None else int(timeout * 1000))
+            except RedisError as e:
+                raise ConnectionInterrupted(connection=redis) from e
+            size = len(raw) if isinstance(raw, bytes) else None
+            self.local.set(local_key, value, self.bound_ttl(timeout), size=size)
+        self.publish([local_key])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout=timeout, version=version)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.remote.add(key, value, timeout=timeout, version=version)
+        if added:
+            self.invalidate([key], version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.invalidate([key], version)
+        return self.remote.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.invalidate([key], version)
+        return self.remote.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        return self.local.get(local_key) is not None or self.remote.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self.invalidate([key], version)
+        return self.remote.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self.invalidate(keys, version)
+        return self.remote.delete_many(keys, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.publish(None)
+        return self.remote.clear()
+
+    def invalidate(self, keys, version=None):
+        local_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        for local_key in local_keys:
+            self.local.delete(local_key)
+        self.publish(local_keys)
+
+    def stats(self):
+        return self.local.stats()
+
+    def redis(self):
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection(self.remote_alias)
+        except (ImportError, NotImplementedError):
+            return None
+
+    def publish(self, keys):
+        """Tell the other workers to drop keys (all keys when None)"""
+        connection = self.redis()
+        if connection is None:
+            return
+        message = json.dumps({"origin": origin(), "keys": keys})
+        try:
+            connection.publish(self.channel, message)
+        except Exception as e:
+            print(f"Error publishing cache invalidation: {e}")
+
+    def start_subscriber(self, tier):
+        with tier.lock:
+            if tier.subscriber is not None:
+                return
+            tier.subscriber = threading.Thread(
+                target=self.listen,
+                args=(tier,),
+                name="cache-invalidation",
+                daemon=True,
+            )
+        if self.redis() is None:
+            return
+        tier.subscriber.start()
+
+    def listen(self, tier):
+        while True:
+            try:
+                pubsub = self.redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    payload = json.loads(message["data"])
+                    if payload["origin"] == origin():
+                        continue
+                    tier.count("invalidations")
+                    if payload["keys"] is None:
+                        tier.clear()
+                    else:
+                        for key in payload["keys"]:
+                            tier.delete(key)
+            except Exception as e:
+                # invalidations may have been missed while disconnected
+                print(f"Cache invalidation listener error: {e}")
+                tier.clear()
+                time.sleep(1)
+
+
+def origin():
+    return f"{socket.gethostname()}:{os.getpid()}"
@@ -0,0 +1,113 @@
+"""
+django-redis serializer and compressor used for cached Onadata payloads.
+
+Onadata responses are plain JSON, so they encode far smaller and faster as
+JSON/msgpack than as pickles of Python dicts. Compression only kicks in
+above a size threshold, where it pays for its CPU cost.
+"""
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django_redis.compressors.base import BaseCompressor
+from django_redis.exceptions import CompressorError
+from django_redis.serializers.base import BaseSerializer
+
+# One-byte header written in front of every compressed value, so values
+# stored below the threshold (or by another compressor) can be told apart.
+ZLIB, LZ4, ZSTD = b"\x01", b"\x02", b"\x03"
+
+
+class OrjsonSerializer(BaseSerializer):
+
+    def __init__(self, options):
+        super().__init__(options)
+        try:
+            import orjson
+        except ImportError:
+            raise ImproperlyConfigured("OrjsonSerializer requires the orjson package")
+        self.orjson = orjson
+
+    def dumps(self, value):
+        return self.orjson.dumps(value, option=self.orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, value):
+        return self.orjson.loads(value)
+
+
+def zlib_codec(level):
+    return (
+        lambda value: zlib.compress(value, level),
+        zlib.decompress,
+    )
+
+
+def lz4_codec(level):
+    import lz4.frame
+    return (
+        lambda value: lz4.frame.compress(value, compression_level=level),
+        lz4.frame.decompress,
+    )
+
+
+def zstd_codec(level):
+    import pyzstd
+    return (
+        lambda value: pyzstd.compress(value, level),
+        pyzstd.decompress,
+    )
+
+
+CODECS = {
+    "zlib": (ZLIB, zlib_codec, 6),
+    "lz4": (LZ4, lz4_codec, 0),
+    "zstd": (ZSTD, zstd_codec, 3),
+}
+CODECS_BY_HEADER = {header: name for name, (header, _, _) in CODECS.items()}
+
+
+class ThresholdCompressor(BaseCompressor):
+    """
+    Compress values larger than COMPRESS_MIN_LENGTH bytes with the
+    COMPRESS_ALGORITHM codec ("zlib", "lz4" or "zstd") at COMPRESS_LEVEL.
+    Smaller values are stored as-is.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        algorithm = options.get("COMPRESS_ALGORITHM", "zlib")
+        if algorithm not in CODECS:
+            raise ImproperlyConfigured(f"unknown COMPRESS_ALGORITHM {algorithm!r}")
+
+        self.header, codec, default_level = CODECS[algorithm]
+        self.min_length = int(options.get("COMPRESS_MIN_LENGTH", 1024))
+        level = int(options.get("COMPRESS_LEVEL") or default_level)
+        try:
+            self._compress, _ = codec(level)
+        except ImportError:
+            raise ImproperlyConfigured(f"{algorithm} compression requires its python package")
+        self._decompressors = {self.header: codec(level)[1]}
+
+    def compress(self, value):
+        if len(value) <= self.min_length:
+            return value
+        return self.header + self._compress(value)
+
+    def decompress(self, value):
+        decompress = self.decompressor(value[:1])
+        if decompress is None:
+            # stored uncompressed; django-redis falls back to the raw value
+            raise CompressorError("value is not compressed")
+        try:
+            return decompress(value[1:])
+        except Exception as e:
+            raise CompressorError(e)
+
+    def decompressor(self, header):
+        if header not in self._decompressors and header in CODECS_BY_HEADER:
+            # values written under a previous COMPRESS_ALGORITHM setting
+            _, codec, default_level = CODECS[CODECS_BY_HEADER[header]]
+            try:
+                self._decompressors[header] = codec(default_level)[1]
+            except ImportError:
+                return None
+        return self._decompressors.get(header)
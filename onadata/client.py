@@ -0,0 +1,121 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from accounts.metrics import timer
+from h4ev import settings
+from h4ev.process import per_process
+from onadata.breaker import get_breaker
+from onadata.retry import build_retry, get_retry_budget
+
+
+class OnadataClient:
+    """
+    Thin wrapper around a requests.Session talking to the Onadata API.
+
+    The session keeps a pool of keep-alive connections so repeated calls
+    reuse the same TCP/TLS connection instead of handshaking every time.
+    GETs are retried with jittered backoff (onadata/retry.py) and go
+    through the shared circuit breaker (onadata/breaker.py).
+    """
+
+    def __init__(self, base_url=None, pool_connections=None, pool_maxsize=None,
+                 connect_timeout=None, read_timeout=None):
+        config = settings.ONADATA
+        self.base_url = (base_url or config["BASE_URL"]).rstrip("/")
+        self.timeout = (
+            connect_timeout or config["CONNECT_TIMEOUT"],
+            read_timeout or config["READ_TIMEOUT"],
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate, br",
+        })
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections or config["POOL_CONNECTIONS"],
+            pool_maxsize=pool_maxsize or config["POOL_MAXSIZE"],
+            pool_block=False,
+            max_retries=build_retry(),
+        )
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path, params=None, validators=None, **kwargs):
+        """
+        GET path from Onadata. When validators from an earlier response are
+        given, the request is conditional and may come back as 304.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if validators:
+            kwargs["headers"] = {**conditional_headers(validators), **kwargs.get("headers", {})}
+
+        breaker = get_breaker()
+        probe = breaker.allow()
+        get_retry_budget().record_request()
+        try:
+            with timer("upstream"):
+                response = self.session.get(self.url(path), params=params, **kwargs)
+        except requests.exceptions.RequestException:
+            breaker.record_failure(probe)
+            raise
+        record_outcome(breaker, response.status_code, probe)
+        return response
+
+    def pool_stats(self) -> dict:
+        """Connection reuse counters summed over every host pool."""
+        pools = self.adapter.poolmanager.pools
+        connections = 0
+        requests_made = 0
+        for key in pools.keys():
+            pool = pools[key]
+            connections += pool.num_connections
+            requests_made += pool.num_requests
+
+        return {
+            "pid": os.getpid(),
+            "pools": len(pools),
+            "connections_opened": connections,
+            "requests": requests_made,
+            "connections_reused": max(requests_made - connections, 0),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+def record_outcome(breaker, status_code, probe=False):
+    # 4xx are the caller's problem, not a sign the upstream is unhealthy
+    if status_code >= 500:
+        breaker.record_failure(probe)
+    else:
+        breaker.record_success(probe)
+
+
+def conditional_headers(validators) -> dict:
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def response_validators(response) -> dict:
+    """ETag / Last-Modified of an upstream response, to revalidate it later"""
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return {name: value for name, value in validators.items() if value}
+
+
+@per_process
+def get_client() -> OnadataClient:
+    """Return the Onadata client for this worker process"""
+    return OnadataClient()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from onadata.cache import form_tag, invalidate_tags, owner_tag
+
+
+class Command(BaseCommand):
+    help = "Invalidate cached Onadata responses for specific forms and/or owners"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--form", action="append", default=[], dest="forms", help="form id (repeatable)")
+        parser.add_argument("--owner", action="append", default=[], dest="owners", help="owner username (repeatable)")
+
+    def handle(self, *args, **options):
+        if not options["forms"] and not options["owners"]:
+            raise CommandError("pass at least one --form or --owner")
+
+        tags = [form_tag(form_id) for form_id in options["forms"]]
+        tags += [owner_tag(username) for username in options["owners"]]
+        deleted = invalidate_tags(tags)
+        self.stdout.write(self.style.SUCCESS(f"Invalidated {deleted} cache entries"))
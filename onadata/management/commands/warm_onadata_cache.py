@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from h4ev import settings
+from onadata.warmer import warm_hot
+
+
+class Command(BaseCommand):
+    help = "Refresh the Onadata cache entries of the most requested forms and owners before they expire"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true",
+                            help="keep warming every --interval seconds instead of running one pass")
+        parser.add_argument("--interval", type=int, default=None)
+        parser.add_argument("--top", type=int, default=None, help="how many hot requests to warm")
+        parser.add_argument("--source", choices=["hits", "logs", "both"], default=None)
+        parser.add_argument("--since-hours", type=float, default=1,
+                            help="how far back to look in the request logs")
+        parser.add_argument("--lead", type=int, default=None,
+                            help="refresh entries expiring within this many seconds")
+        parser.add_argument("--concurrency", type=int, default=None)
+        parser.add_argument("--rate", type=float, default=None, help="upstream fetches per second")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] or settings.ONADATA["WARM_INTERVAL"]
+        while True:
+            start = time.monotonic()
+            results = warm_hot(
+                source=options["source"],
+                limit=options["top"],
+                since_hours=options["since_hours"],
+                lead=options["lead"],
+                concurrency=options["concurrency"],
+                rate=options["rate"],
+            )
+            summary = ", ".join(f"{outcome}={count}" for outcome, count in sorted(results.items())) or "nothing to warm"
+            self.stdout.write(f"{summary} in {time.monotonic() - start:.1f}s")
+            if not options["loop"]:
+                return
+            time.sleep(max(0, interval - (time.monotonic() - start)))
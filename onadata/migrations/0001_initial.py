@@ -0,0 +1,46 @@
+# Generated by Django 5.0.4 on 2026-10-18 09:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Form',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('formid', models.BigIntegerField(unique=True)),
+                ('id_string', models.CharField(blank=True, max_length=255)),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('owner', models.CharField(db_index=True, max_length=255)),
+                ('data', models.JSONField(default=dict)),
+                ('last_submission_id', models.BigIntegerField(default=0)),
+                ('last_submission_time', models.DateTimeField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Submission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.BigIntegerField()),
+                ('submission_time', models.DateTimeField(blank=True, null=True)),
+                ('data', models.JSONField()),
+                ('form', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='onadata.form')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['form', 'submission_time'], name='onadata_sub_form_id_9f9d18_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='submission',
+            constraint=models.UniqueConstraint(fields=('form', 'submission_id'), name='unique_form_submission'),
+        ),
+    ]
@@ -0,0 +1,183 @@
+"""Incremental local mirror of Onadata forms and submissions"""
+import hashlib
+import json
+from datetime import timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from h4ev import settings
+from onadata.models import Form, Submission
+from onadata.services import get_user_forms, iter_form_submissions
+
+
+def parse_submission_time(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def sync_owner_forms(username: str, client=None) -> list:
+    """Upsert the mirror's Form rows for every form an owner has on Onadata"""
+    data, status_code = get_user_forms(username, client=client)
+    forms = []
+    for form_data in data:
+        form, _ = Form.objects.update_or_create(
+            formid=form_data["formid"],
+            defaults={
+                "id_string": form_data.get("id_string", ""),
+                "title": form_data.get("title", ""),
+                "owner": form_data.get("owner", username),
+                "data": form_data,
+            },
+        )
+        forms.append(form)
+    return forms
+
+
+def sync_form_submissions(form: Form, full: bool = False, batch_size: int = None, client=None) -> int:
+    """
+    Pull submissions newer than the form's high-water mark into the mirror,
+    or every submission when full is set (to pick up edits and drop the
+    submissions deleted on Onadata). Each batch is upserted in its own
+    transaction together with the new high-water mark, so an interrupted
+    sync resumes where it stopped.
+    """
+    batch_size = batch_size or settings.ONADATA["PAGE_SIZE"]
+    query = None if full or not form.last_submission_id else {"_id": {"$gt": form.last_submission_id}}
+    records = iter_form_submissions(
+        str(form.formid),
+        page_size=batch_size,
+        client=client,
+        query=query,
+        sort={"_id": 1},
+    )
+
+    synced = 0
+    seen = set()
+    batch = []
+    for record in records:
+        batch.append(record)
+        seen.add(record["_id"])
+        if len(batch) >= batch_size:
+            synced += save_batch(form, batch)
+            batch = []
+    if batch:
+        synced += save_batch(form, batch)
+    if full:
+        delete_missing(form, seen)
+
+    form.last_synced_at = timezone.now()
+    form.save(update_fields=["last_synced_at"])
+    return synced
+
+
+def save_batch(form: Form, records: list) -> int:
+    submissions = [
+        Submission(
+            form=form,
+            submission_id=record["_id"],
+            submission_time=parse_submission_time(record.get("_submission_time")),
+            data=record,
+        )
+        for record in records
+    ]
+    newest = max(submissions, key=lambda submission: submission.submission_id)
+
+    with transaction.atomic():
+        Submission.objects.bulk_create(
+            submissions,
+            update_conflicts=True,
+            unique_fields=["form", "submission_id"],
+            update_fields=["submission_time", "data"],
+        )
+        if newest.submission_id > form.last_submission_id:
+            form.last_submission_id = newest.submission_id
+            form.last_submission_time = newest.submission_time
+            form.save(update_fields=["last_submission_id", "last_submission_time"])
+
+    return len(submissions)
+
+
+def delete_missing(form: Form, seen: set, chunk_size: int = 500) -> int:
+    """Delete the form's mirrored submissions whose ids a full sync did not see"""
+    missing = sorted(set(form.submissions.values_list("submission_id", flat=True)) - seen)
+    with transaction.atomic():
+        for start in range(0, len(missing), chunk_size):
+            form.submissions.filter(submission_id__in=missing[start:start + chunk_size]).delete()
+        if missing:
+            # the high-water mark may have been one of them
+            newest = form.submissions.order_by("-submission_id").first()
+            form.last_submission_id = newest.submission_id if newest else 0
+            form.last_submission_time = newest.submission_time if newest else None
+            form.save(update_fields=["last_submission_id", "last_submission_time"])
+    return len(missing)
+
+
+def mirrored_form(form_id):
+    """Return the mirrored Form for an Onadata form id, if it has been synced"""
+    if not str(form_id).isdigit():
+        return None
+    return Form.objects.filter(formid=int(form_id), last_synced_at__isnull=False).first()
+
+
+def mirror_etag(form: Form, variant: str = "") -> str:
+    """ETag of a mirrored form's submissions; variant distinguishes query strings"""
+    etag = f"mirror-{form.formid}-{form.last_submission_id}-{form.last_synced_at.timestamp():.0f}"
+    if variant:
+        etag += "-" + hashlib.md5(variant.encode()).hexdigest()[:12]
+    return f'"{etag}"'
+
+
+def mirror_enabled(mode):
+    """Whether the ONADATA MIRROR_MODE setting is mode ("prefer" or "fallback")"""
+    return settings.ONADATA["MIRROR_MODE"] == mode
+
+
+def mirrored_forms(username):
+    """Mirrored forms data for an owner and its ETag, or (None, None) if never synced"""
+    forms = list(Form.objects.filter(owner=username).order_by("formid"))
+    if not forms:
+        return None, None
+    etag = '"mirror-forms-%s"' % "-".join(f"{form.formid}.{form.last_submission_id}" for form in forms)
+    return [form.data for form in forms], etag
+
+
+def submission_values(form: Form, query: dict = None):
+    """
+    Mirrored submissions of a form as raw Onadata records, filtered and
+    paginated in the database according to a parsed submission query.
+    Projection is left to the caller (see onadata.services.project).
+    """
+    submissions = form.submissions.order_by("submission_id")
+    query = query or {}
+
+    for field, value in query.get("filters", {}).items():
+        if "__" in field:
+            raise ValueError(f"filter field must be a plain key, got {field!r}")
+        # filter values arrive as text; also match numbers stored as JSON numbers
+        match = Q(**{f"data__{field}": value})
+        try:
+            match |= Q(**{f"data__{field}": json.loads(value)})
+        except ValueError:
+            pass
+        submissions = submissions.filter(match)
+    if query.get("submitted_after"):
+        submissions = submissions.filter(
+            submission_time__gte=timezone.make_aware(query["submitted_after"], dt_timezone.utc)
+        )
+    if query.get("submitted_before"):
+        submissions = submissions.filter(
+            submission_time__lte=timezone.make_aware(query["submitted_before"], dt_timezone.utc)
+        )
+
+    values = submissions.values_list("data", flat=True)
+    if query.get("page"):
+        offset = (query["page"] - 1) * query["page_size"]
+        values = values[offset:offset + query["page_size"]]
+    return values
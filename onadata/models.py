@@ -1,3 +1,37 @@
 from django.db import models
 
-# Create your models here.
+
+class Form(models.Model):
+    """Local mirror of an Onadata form and its sync high-water mark"""
+    formid = models.BigIntegerField(unique=True)
+    id_string = models.CharField(max_length=255, blank=True)
+    title = models.CharField(max_length=255, blank=True)
+    owner = models.CharField(max_length=255, db_index=True)
+    data = models.JSONField(default=dict)
+
+    # highest Onadata `_id` / `_submission_time` mirrored so far
+    last_submission_id = models.BigIntegerField(default=0)
+    last_submission_time = models.DateTimeField(null=True, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.owner}/{self.id_string or self.formid}"
+
+
+class Submission(models.Model):
+    """Local mirror of one Onadata submission, stored as returned by the API"""
+    form = models.ForeignKey(Form, related_name="submissions", on_delete=models.CASCADE)
+    submission_id = models.BigIntegerField()
+    submission_time = models.DateTimeField(null=True, blank=True)
+    data = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["form", "submission_id"], name="unique_form_submission"),
+        ]
+        indexes = [
+            models.Index(fields=["form", "submission_time"]),
+        ]
+
+    def __str__(self):
+        return f"{self.form_id}:{self.submission_id}"
@@ -0,0 +1,110 @@
+"""
+Bounded retries for idempotent Onadata GETs.
+
+Retries back off exponentially with jitter so workers do not retry in
+lockstep, and draw from a per-worker retry budget: once retries exceed
+RETRY_BUDGET_RATIO of the requests in the current minute (plus a
+RETRY_BUDGET_MIN floor), failing calls fail at once instead of tripling
+the load on a struggling upstream.
+"""
+import random
+import threading
+import time
+
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+from h4ev import settings
+
+BUDGET_WINDOW = 60
+
+
+class RetryBudget:
+
+    def __init__(self, ratio=None, minimum=None, window=BUDGET_WINDOW):
+        self.ratio = settings.ONADATA["RETRY_BUDGET_RATIO"] if ratio is None else ratio
+        self.minimum = settings.ONADATA["RETRY_BUDGET_MIN"] if minimum is None else minimum
+        self.window = window
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.counters = {"requests": 0, "retries": 0, "retries_denied": 0}
+
+    def roll(self):
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self.window_start = now
+            self.requests = 0
+            self.retries = 0
+
+    def record_request(self):
+        with self.lock:
+            self.roll()
+            self.requests += 1
+            self.counters["requests"] += 1
+
+    def withdraw(self) -> bool:
+        """Take one retry from the budget, or return False if it is spent"""
+        with self.lock:
+            self.roll()
+            if self.retries >= self.minimum + self.ratio * self.requests:
+                self.counters["retries_denied"] += 1
+                return False
+            self.retries += 1
+            self.counters["retries"] += 1
+            return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_retry_budget() -> RetryBudget:
+    global _budget
+
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = RetryBudget()
+    return _budget
+
+
+def backoff_delay(attempt) -> float:
+    """Seconds to wait before retry number attempt (1-based)"""
+    config = settings.ONADATA
+    delay = min(config["RETRY_BACKOFF"] * (2 ** (attempt - 1)), config["RETRY_BACKOFF_MAX"])
+    return delay + random.uniform(0, config["RETRY_JITTER"])
+
+
+class BudgetedRetry(Retry):
+    """urllib3 Retry that also draws every retry from the worker's retry budget"""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # urllib3 first decides whether it would retry at all (it raises MaxRetryError when it would not),
+        # so only retries that are actually made draw on the budget
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if not get_retry_budget().withdraw():
+            # give up like an exhausted Retry: with raise_on_status=False urlopen hands back the
+            # last response of a retried status, and errors are raised
+            raise MaxRetryError(_pool, url, error or ResponseError("retry budget exhausted"))
+        return retry
+
+
+def build_retry() -> Retry:
+    config = settings.ONADATA
+    return BudgetedRetry(
+        total=config["RETRIES"],
+        allowed_methods={"GET", "HEAD"},
+        status_forcelist=config["RETRY_STATUSES"],
+        backoff_factor=config["RETRY_BACKOFF"],
+        backoff_max=config["RETRY_BACKOFF_MAX"],
+        backoff_jitter=config["RETRY_JITTER"],
+        respect_retry_after_header=True,
+        # the final 5xx is returned so raise_for_status reports it as usual
+        raise_on_status=False,
+    )
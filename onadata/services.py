@@ -1,18 +1,309 @@
-import requests
+import json
+from datetime import datetime, time, timezone
 
+from django.utils.dateparse import parse_date, parse_datetime
 
-def get_user_forms(username: str) -> tuple:
+from h4ev import settings
+from onadata.async_client import get_async_client
+from onadata.client import get_client, response_validators
+
+
+def get_user_forms(username: str, client=None) -> tuple:
+    data, status_code, validators = fetch_user_forms(username, client=client)
+    return data, status_code
+
+
+def get_form_submissions(form_id: str, client=None) -> dict:
+    data, status_code, validators = fetch_form_submissions(form_id, client=client)
+    return data
+
+
+def fetch_user_forms(username: str, validators: dict = None, client=None) -> tuple:
+    """
+    Fetch an owner's forms, revalidating against the given upstream validators.
+    Returns (data, status_code, validators); data is None on a 304.
+    """
+    client = client or get_client()
     params = {
         'owner': username,
     }
-    response = requests.get('https://api.ona.io/api/v1/forms', params=params)
-    response.raise_for_status()
-    data = response.json()
-    return data, response.status_code
+    response = client.get('/api/v1/forms', params=params, validators=validators)
+    return read_conditional(response, validators)
+
+
+def fetch_form_submissions(form_id: str, validators: dict = None, client=None, query: dict = None) -> tuple:
+    """
+    Fetch a form's submissions, revalidating against the given upstream validators.
+    query (from parse_submission_query) is pushed to Onadata as its
+    query / fields / page parameters, and its filters and projection are
+    applied again to what comes back (see select_submissions).
+    Returns (data, status_code, validators); data is None on a 304.
+    """
+    client = client or get_client()
+    params = submission_query_params(query) if query else None
+    response = client.get(f'/api/v1/data/{form_id}', params=params, validators=validators)
+
+    if response.status_code == 404 and query and query.get("page", 1) > 1:
+        # Onadata answers 404 for a page past the last submission
+        return [], response.status_code, {}
+    return selected(read_conditional(response, validators), query)
+
+
+async def afetch_user_forms(username: str, validators: dict = None, client=None) -> tuple:
+    """Async fetch_user_forms for the async views"""
+    client = client or get_async_client()
+    response = await client.get('/api/v1/forms', params={'owner': username}, validators=validators)
+    return read_conditional(response, validators)
+
 
+async def afetch_form_submissions(form_id: str, validators: dict = None, client=None, query: dict = None) -> tuple:
+    """Async fetch_form_submissions for the async views"""
+    client = client or get_async_client()
+    params = submission_query_params(query) if query else None
+    response = await client.get(f'/api/v1/data/{form_id}', params=params, validators=validators)
 
-def get_form_submissions(form_id: str) -> dict:
-    response = requests.get(f'https://api.ona.io/api/v1/data/{form_id}')
+    if response.status_code == 404 and query and query.get("page", 1) > 1:
+        return [], response.status_code, {}
+    return selected(read_conditional(response, validators), query)
+
+
+def selected(result, query) -> tuple:
+    """A fetch result with select_submissions applied to its data"""
+    data, status_code, validators = result
+    if data is not None and query:
+        data = select_submissions(data, query)
+    return data, status_code, validators
+
+
+def read_conditional(response, validators=None) -> tuple:
+    if response.status_code == 304:
+        # unchanged upstream; keep the previous validators unless new ones were sent
+        return None, response.status_code, response_validators(response) or validators
     response.raise_for_status()
     data = response.json()
-    return data
+    return data, response.status_code, response_validators(response)
+
+
+def iter_form_submissions(form_id: str, page_size: int = None, client=None, query: dict = None,
+                          sort: dict = None, fields: list = None):
+    """
+    Yield submissions for a form one at a time, fetching them from Onadata
+    page by page so only a single page is held in memory.
+
+    query, sort and fields are passed to Onadata as its JSON `query` /
+    `sort` / `fields` parameters, e.g. query={"_id": {"$gt": 100}},
+    sort={"_id": 1}, fields=["_id", "name"].
+    """
+    client = client or get_client()
+    page_size = page_size or settings.ONADATA["PAGE_SIZE"]
+    page = 1
+
+    while True:
+        params = {
+            'page': page,
+            'page_size': page_size,
+        }
+        if query:
+            params['query'] = json.dumps(query)
+        if sort:
+            params['sort'] = json.dumps(sort)
+        if fields:
+            params['fields'] = json.dumps(fields)
+        response = client.get(f'/api/v1/data/{form_id}', params=params)
+
+        # Onadata answers 404 once we page past the last submission
+        if response.status_code == 404 and page > 1:
+            return
+        response.raise_for_status()
+
+        records = response.json()
+        yield from records
+
+        if len(records) < page_size:
+            return
+        page += 1
+
+
+async def aiter_form_submissions(form_id: str, page_size: int = None, client=None, query: dict = None,
+                                 fields: list = None):
+    """Async iter_form_submissions: yields submissions page by page"""
+    page_size = page_size or settings.ONADATA["PAGE_SIZE"]
+    page = 1
+
+    while True:
+        params = {
+            'page': page,
+            'page_size': page_size,
+        }
+        if query:
+            params['query'] = json.dumps(query)
+        if fields:
+            params['fields'] = json.dumps(fields)
+        # the client of the loop fetching this page: under WSGI the first page is read in the
+        # view's loop and the rest in the one Django consumes the response in
+        response = await (client or get_async_client()).get(f'/api/v1/data/{form_id}', params=params)
+
+        if response.status_code == 404 and page > 1:
+            return
+        response.raise_for_status()
+
+        records = response.json()
+        for record in records:
+            yield record
+
+        if len(records) < page_size:
+            return
+        page += 1
+
+
+def parse_submission_query(params) -> dict:
+    """
+    Parse the projection, filter and pagination parameters of a submissions
+    request (a QueryDict) into a query dict. Raises ValueError on bad input.
+
+      fields=_id,name                comma separated projection, repeatable
+      filter=field:value             equality filter on a top-level key, repeatable
+      submitted_after=<date/time>    lower bound on _submission_time (inclusive)
+      submitted_before=<date/time>   upper bound on _submission_time (inclusive)
+      page=<n>&page_size=<n>         1-based pagination
+    """
+    query = {}
+
+    # repeated fields parameters are merged, in order and without duplicates
+    fields = [
+        field.strip() for value in params.getlist("fields") for field in value.split(",") if field.strip()
+    ]
+    if fields:
+        query["fields"] = list(dict.fromkeys(fields))
+
+    filters = {}
+    for item in params.getlist("filter"):
+        field, separator, value = item.partition(":")
+        if not separator or not field:
+            raise ValueError(f"filter must look like field:value, got {item!r}")
+        if "__" in field:
+            # the mirror filters on data__<field>, where "__" would reach into other lookups
+            raise ValueError(f"filter field must be a plain key, got {field!r}")
+        filters[field] = value
+    if filters:
+        query["filters"] = filters
+
+    for name, bound in (("submitted_after", time.min), ("submitted_before", time.max)):
+        value = params.get(name)
+        if value:
+            query[name] = parse_query_datetime(name, value, bound)
+
+    for name in ("page", "page_size"):
+        value = params.get(name)
+        if value:
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError(f"{name} must be a positive integer")
+            query[name] = int(value)
+    if "page_size" in query:
+        query["page_size"] = min(query["page_size"], settings.ONADATA["MAX_PAGE_SIZE"])
+    if "page_size" in query or "page" in query:
+        query.setdefault("page", 1)
+        query.setdefault("page_size", settings.ONADATA["PAGE_SIZE"])
+
+    return query
+
+
+def parse_query_datetime(name, value, bound):
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        # a bare date covers the whole day (parse_datetime would read it as midnight)
+        parsed = datetime.combine(day, bound)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def submission_mongo_query(query) -> dict:
+    """The Onadata `query` filter for a parsed submission query"""
+    mongo = dict(query.get("filters", {}))
+    time_range = {}
+    if query.get("submitted_after"):
+        time_range["$gte"] = query["submitted_after"].strftime("%Y-%m-%dT%H:%M:%S")
+    if query.get("submitted_before"):
+        time_range["$lte"] = query["submitted_before"].strftime("%Y-%m-%dT%H:%M:%S")
+    if time_range:
+        mongo["_submission_time"] = time_range
+    return mongo
+
+
+def submission_query_params(query) -> dict:
+    """Onadata request parameters for a parsed submission query"""
+    params = {}
+    mongo = submission_mongo_query(query)
+    if mongo:
+        params["query"] = json.dumps(mongo)
+    if query.get("fields"):
+        params["fields"] = json.dumps(query["fields"])
+    if query.get("page"):
+        params["page"] = query["page"]
+        params["page_size"] = query["page_size"]
+    return params
+
+
+def project(record: dict, fields) -> dict:
+    return {field: record[field] for field in fields if field in record}
+
+
+def submission_cache_params(query, params=None) -> dict:
+    """
+    Cache key parameters of a parsed submission query. Keys come from the
+    parsed query rather than the raw query string, so two requests share an
+    entry exactly when they make the same upstream request. A cache_bust
+    parameter in params is kept so it still forces a fresh entry.
+    """
+    key_params = {"query": json.dumps(query, sort_keys=True, default=str)} if query else {}
+    if params is not None and params.get("cache_bust"):
+        key_params["cache_bust"] = params["cache_bust"]
+    return key_params
+
+
+def filter_matches(record: dict, field, value) -> bool:
+    """Equality filter on a record; as in the mirror, text values also match JSON numbers"""
+    if field not in record:
+        return False
+    if record[field] == value:
+        return True
+    try:
+        return record[field] == json.loads(value)
+    except ValueError:
+        return False
+
+
+def submitted_within(record: dict, query) -> bool:
+    after, before = query.get("submitted_after"), query.get("submitted_before")
+    if not after and not before:
+        return True
+    submitted = parse_datetime(record.get("_submission_time") or "")
+    if submitted is None:
+        return False
+    if submitted.tzinfo is not None:
+        submitted = submitted.astimezone(timezone.utc).replace(tzinfo=None)
+    return (not after or submitted >= after) and (not before or submitted <= before)
+
+
+def select_submissions(records, query) -> list:
+    """
+    Apply a parsed query's filters, time bounds and projection to upstream
+    records, so the response matches the query even where Onadata ignores
+    part of it. Pagination is left to Onadata.
+    """
+    filters = query.get("filters", {})
+    fields = query.get("fields")
+    return [
+        project(record, fields) if fields else record
+        for record in records
+        if all(filter_matches(record, field, value) for field, value in filters.items())
+        and submitted_within(record, query)
+    ]
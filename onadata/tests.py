@@ -1,3 +1,614 @@
+import asyncio
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django_redis.exceptions import CompressorError
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.http import QueryDict
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.services import generate_cache_key
+from h4ev import settings
+from onadata.async_client import get_async_client
+from onadata.breaker import CircuitOpenError
+from onadata.async_views import astream_records
+from onadata.cache import (
+    aschedule_refresh,
+    cache,
+    get_lock,
+    get_redis,
+    make_entry,
+    release_lock,
+    single_flight,
+    stale_key_of,
+    stale_while_revalidate,
+)
+from onadata.cache_serializers import CODECS, ZLIB, ThresholdCompressor
+from onadata.mirror import sync_form_submissions
+from onadata.models import Form, Submission
+from onadata.retry import BudgetedRetry, RetryBudget
+from onadata.services import fetch_form_submissions, parse_submission_query
+from onadata.warmer import HIT_BUCKET, HitCounter, hit_member, hits_key, hot_from_hits
+
+User = get_user_model()
+
+
+class BatchFormSubmissionsTests(TestCase):
+    url = "/api/onadata/forms/submissions/"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="batch", password="secret"))
+
+    def post(self, body):
+        with mock.patch("onadata.views.fetch_many") as fetch_many:
+            fetch_many.return_value = []
+            response = self.client.post(self.url, body, format="json")
+        return response, fetch_many
+
+    def test_rejects_non_numeric_form_ids(self):
+        for form_id in ("../forms", "1?owner=bob", "1/", "", True, None, {"id": 1}, "١٢"):
+            response, fetch_many = self.post({"form_ids": ["1", form_id]})
+            self.assertEqual(response.status_code, 400, form_id)
+            fetch_many.assert_not_called()
+
+    def test_rejects_a_body_that_is_not_an_object(self):
+        response, fetch_many = self.post(["1", "2"])
+        self.assertEqual(response.status_code, 400)
+        fetch_many.assert_not_called()
+
+    def test_rejects_too_many_form_ids(self):
+        with mock.patch.dict(settings.ONADATA, {"BATCH_MAX_FORMS": 2}):
+            response, fetch_many = self.post({"form_ids": ["1", "2", "3"]})
+        self.assertEqual(response.status_code, 400)
+        fetch_many.assert_not_called()
+
+    def test_accepts_numeric_form_ids(self):
+        response, fetch_many = self.post({"form_ids": [1, "2", "2"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(fetch_many.call_args.args[0], ["1", "2"])
+
+
+class StreamFormSubmissionsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="stream", password="secret"))
+
+    def failing_submissions(self, *args, **kwargs):
+        yield {"_id": 1}
+        yield {"_id": 2}
+        raise requests.exceptions.ConnectionError("upstream went away")
+
+    def test_upstream_failure_mid_stream_aborts_the_response(self):
+        for stream_format in ("json", "ndjson"):
+            with mock.patch("onadata.views.iter_form_submissions", self.failing_submissions):
+                response = self.client.get(f"/api/onadata/form/1/?stream={stream_format}")
+            self.assertEqual(response.status_code, 200)
+
+            chunks = []
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                for chunk in response.streaming_content:
+                    chunks.append(chunk.decode())
+            self.assertEqual(len(chunks), 2 if stream_format == "ndjson" else 3)
+            self.assertNotIn("]", "".join(chunks))
+
+
+class CachedSubmissionsTests(TestCase):
+    url = "/api/onadata/form/7/"
+
+    def setUp(self):
+        cache.clear()
+        # cached user rows outlive the test database rows they were read from
+        caches["users"].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="cached", password="secret"))
+        self.upstream = [{"_id": 1}]
+        patcher = mock.patch("onadata.views.fetch_form_submissions", side_effect=lambda *args, **kwargs: (
+            self.upstream, 200, {}
+        ))
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_key_covers_route_path_and_parameters(self):
+        key = generate_cache_key(None, {"page": "1", "fields": "_id"}, route="form_submissions", path_params={"form_id": "7"})
+        self.assertEqual(
+            key, generate_cache_key(None, {"fields": "_id", "page": "1"}, route="form_submissions", path_params={"form_id": "7"}),
+        )
+        for other in (
+            generate_cache_key(None, {"page": "2", "fields": "_id"}, route="form_submissions", path_params={"form_id": "7"}),
+            generate_cache_key(None, {"page": "1", "fields": "_id"}, route="form_submissions", path_params={"form_id": "8"}),
+            generate_cache_key(None, {"page": "1", "fields": "_id"}, route="user_forms", path_params={"form_id": "7"}),
+        ):
+            self.assertNotEqual(key, other)
+
+    def test_repeat_requests_are_served_from_the_cache(self):
+        self.assertEqual(self.client.get(self.url).json(), [{"_id": 1}])
+        self.assertEqual(self.client.get(self.url).json(), [{"_id": 1}])
+        self.assertEqual(self.fetch.call_count, 1)
+        # another query is another entry
+        self.client.get(self.url + "?page=2")
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_distinct_queries_get_distinct_entries(self):
+        # one filter on a value with a comma, then two filters
+        self.client.get(self.url + "?filter=a:1,b:2")
+        self.client.get(self.url + "?filter=a:1&filter=b:2")
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(
+            [call.kwargs["query"]["filters"] for call in self.fetch.call_args_list],
+            [{"a": "1,b:2"}, {"a": "1", "b": "2"}],
+        )
+
+    def test_repeated_fields_are_merged_into_one_entry(self):
+        self.client.get(self.url + "?fields=_id&fields=name")
+        self.client.get(self.url + "?fields=_id,name")
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(self.fetch.call_args.kwargs["query"]["fields"], ["_id", "name"])
+
+    def test_last_good_entry_has_its_own_key(self):
+        self.client.get(self.url)
+        key = generate_cache_key(None, {}, route="form_submissions", path_params={"form_id": "7"})
+        self.assertEqual(cache.get(key)["data"], [{"_id": 1}])
+        self.assertEqual(cache.get(stale_key_of(key))["data"], [{"_id": 1}])
+
+        # the fresh entry expiring leaves the last good one behind
+        cache.delete(key)
+        self.assertEqual(cache.get(stale_key_of(key))["data"], [{"_id": 1}])
+
+    def test_expired_entry_is_revalidated_with_a_304(self):
+        self.fetch.side_effect = lambda *args, **kwargs: (self.upstream, 200, {"etag": '"upstream-1"'})
+        etag = self.client.get(self.url)["ETag"]
+        cache.delete(generate_cache_key(None, {}, route="form_submissions", path_params={"form_id": "7"}))
+
+        # unchanged upstream: a 304 with no body
+        self.fetch.side_effect = lambda *args, **kwargs: (None, 304, {"etag": '"upstream-1"'})
+        response = self.client.get(self.url)
+        self.assertEqual(self.fetch.call_args.args[1], {"etag": '"upstream-1"'})
+        self.assertEqual(response.json(), [{"_id": 1}])
+        self.assertEqual(response["ETag"], etag)
+
+    def test_open_circuit_serves_the_last_good_entry(self):
+        self.client.get(self.url)
+        cache.delete(generate_cache_key(None, {}, route="form_submissions", path_params={"form_id": "7"}))
+
+        self.fetch.side_effect = CircuitOpenError(30)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"_id": 1}])
+
+        with mock.patch.dict(settings.ONADATA, {"SERVE_STALE_ON_ERROR": False}):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "30")
+
+    def test_async_view_serves_the_last_good_entry(self):
+        # the async view shares the sync view's cache entries
+        self.client.get(self.url)
+        cache.delete(generate_cache_key(None, {}, route="form_submissions", path_params={"form_id": "7"}))
+
+        token = RefreshToken.for_user(User.objects.get(username="cached")).access_token
+        with mock.patch("onadata.async_views.afetch_form_submissions", side_effect=CircuitOpenError(30)):
+            response = APIClient().get("/api/async/onadata/form/7/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"_id": 1}])
+
+    def test_invalidating_a_form_drops_its_entries_only(self):
+        self.client.get(self.url)
+        self.client.get(self.url + "?page=2")
+        self.client.get("/api/onadata/form/8/")
+        self.assertEqual(self.fetch.call_count, 3)
+
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user(username="admin", password="secret", is_staff=True))
+        response = admin.post("/api/onadata/cache/invalidate/", {"forms": ["7"]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.json()["invalidated"], 2)
+
+        self.upstream = [{"_id": 1}, {"_id": 2}]
+        self.assertEqual(self.client.get(self.url).json(), [{"_id": 1}, {"_id": 2}])
+        self.client.get("/api/onadata/form/8/")
+        self.assertEqual(self.fetch.call_count, 4)
+
+    def test_invalidation_rejects_malformed_bodies(self):
+        admin = APIClient()
+        admin.force_authenticate(User.objects.create_user(username="admin", password="secret", is_staff=True))
+        for body in (["7"], {"forms": "123"}, {"forms": ["7", "../x"]}, {"forms": [True]}, {"owners": "alice"},
+                     {"owners": [1]}, {}):
+            with mock.patch("onadata.views.invalidate_tags") as invalidate_tags:
+                response = admin.post("/api/onadata/cache/invalidate/", body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+            invalidate_tags.assert_not_called()
+
+        with mock.patch("onadata.views.invalidate_tags", return_value=0) as invalidate_tags:
+            response = admin.post("/api/onadata/cache/invalidate/", {"forms": [7, "8"], "owners": ["alice"]},
+                                  format="json")
+        self.assertEqual(response.status_code, 200)
+        invalidate_tags.assert_called_once_with(["form:7", "form:8", "owner:alice"])
+
+    def test_matching_etag_gets_a_304(self):
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+
+        for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response["ETag"], etag)
+            self.assertEqual(response.content, b"")
+
+        # a tag that merely contains the current one is a different version
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"x{etag[1:]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"_id": 1}])
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def fetch(self):
+        self.calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return [{"_id": len(self.calls)}]
+
+    def test_concurrent_misses_fetch_once(self):
+        barrier = threading.Barrier(5)
+        results = []
+
+        def miss():
+            barrier.wait()
+            results.append(single_flight("flight", self.fetch, timeout=60))
+
+        threads = [threading.Thread(target=miss) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(self.calls), 1)
+        # the followers waited for the leader's fill
+        self.assertEqual(results, [[{"_id": 1}]] * 5)
+
+    def test_follower_serves_stale_or_fetches_itself_after_waiting(self):
+        lock = get_lock("flight")
+        self.assertTrue(lock.acquire(blocking=False))
+        self.addCleanup(release_lock, lock)
+
+        cache.set("flight:stale", [{"_id": 0}])
+        self.assertEqual(single_flight("flight", self.fetch, timeout=60, stale_key="flight:stale"), [{"_id": 0}])
+        self.assertEqual(self.calls, [])
+
+        with mock.patch.dict(settings.ONADATA, {"LOCK_WAIT": 0.3}):
+            started = time.monotonic()
+            self.assertEqual(single_flight("flight", self.fetch, timeout=60), [{"_id": 1}])
+        # gave up on the stuck holder's lease only once LOCK_WAIT ran out
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertEqual(len(self.calls), 1)
+
+
+class StaleWhileRevalidateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_stale_entries_are_served_while_one_refresh_runs(self):
+        stale = make_entry([{"_id": 0}])
+        stale["fresh_until"] = time.time() - 1
+        cache.set("swr", stale, timeout=60)
+        release = threading.Event()
+        calls = []
+
+        def fetch(validators):
+            calls.append(validators)
+            release.wait(5)
+            return [{"_id": 1}], 200, {}
+
+        for _ in range(5):
+            started = time.monotonic()
+            self.assertEqual(stale_while_revalidate("swr", fetch)["data"], [{"_id": 0}])
+            self.assertLess(time.monotonic() - started, 0.5)
+        release.set()
+
+        deadline = time.monotonic() + 5
+        while cache.get("swr")["data"] != [{"_id": 1}] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.get("swr")["data"], [{"_id": 1}])
+        self.assertEqual(len(calls), 1)
+
+
+class SelectSubmissionsTests(TestCase):
+
+    def fetch(self, query_string, records):
+        response = mock.Mock(status_code=200, headers={}, json=lambda: records)
+        client = mock.Mock(get=mock.Mock(return_value=response))
+        data, status_code, validators = fetch_form_submissions(
+            "7", client=client, query=parse_submission_query(QueryDict(query_string))
+        )
+        return data
+
+    def test_filters_and_projection_apply_to_upstream_records(self):
+        records = [
+            {"_id": 1, "name": "ada", "age": 36, "_submission_time": "2024-05-01T10:00:00"},
+            {"_id": 2, "name": "bob", "age": 41, "_submission_time": "2024-05-02T10:00:00"},
+            {"_id": 3, "name": "ada", "age": 41, "_submission_time": "2024-05-03T10:00:00"},
+        ]
+        self.assertEqual(self.fetch("filter=name:ada&fields=_id", records), [{"_id": 1}, {"_id": 3}])
+        self.assertEqual(self.fetch("filter=age:41&filter=name:ada", records), [records[2]])
+        self.assertEqual(
+            self.fetch("submitted_after=2024-05-02&submitted_before=2024-05-02&fields=name", records),
+            [{"name": "bob"}],
+        )
+        self.assertEqual(self.fetch("", records), records)
+
+
+class MirroredSubmissionsTests(TestCase):
+    url = "/api/onadata/form/5/"
+
+    def setUp(self):
+        form = Form.objects.create(formid=5, owner="alice", last_submission_id=2, last_synced_at=timezone.now())
+        Submission.objects.bulk_create([
+            Submission(form=form, submission_id=1, data={"_id": 1, "name": "ada", "meta": {"ok": True}}),
+            Submission(form=form, submission_id=2, data={"_id": 2, "name": "bob", "meta": {"ok": False}}),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="mirror", password="secret"))
+        patcher = mock.patch.dict(settings.ONADATA, {"MIRROR_MODE": "prefer"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_filters_on_plain_keys(self):
+        response = self.client.get(self.url + "?filter=name:bob")
+        self.assertEqual([record["_id"] for record in response.json()], [2])
+        for field in ("name__contains", "meta__ok", "name__isnull"):
+            response = self.client.get(self.url + f"?filter={field}:true")
+            self.assertEqual(response.status_code, 400, field)
+
+    def test_only_a_matching_etag_gets_a_304(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"other", {etag}').status_code, 304)
+        # a header that merely contains the tag is not a match
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"x{etag}x"').status_code, 200)
+
+    def test_full_sync_drops_submissions_deleted_upstream(self):
+        form = Form.objects.get(formid=5)
+        with mock.patch("onadata.mirror.iter_form_submissions", return_value=iter([{"_id": 1, "name": "ada"}])):
+            self.assertEqual(sync_form_submissions(form), 1)
+        self.assertEqual(form.submissions.count(), 2)
+
+        with mock.patch("onadata.mirror.iter_form_submissions", return_value=iter([{"_id": 1, "name": "ada"}])):
+            sync_form_submissions(form, full=True)
+        form.refresh_from_db()
+        self.assertEqual(list(form.submissions.values_list("submission_id", flat=True)), [1])
+        self.assertEqual(form.last_submission_id, 1)
+
+    def test_sync_command_needs_an_owner_for_new_forms(self):
+        with self.assertRaisesMessage(CommandError, "form 6 is not mirrored yet"):
+            call_command("sync_onadata", "--form", "6")
+        self.assertFalse(Form.objects.filter(formid=6).exists())
+
+        with mock.patch("onadata.mirror.get_user_forms", return_value=([{"formid": 6, "owner": "carol"}], 200)), \
+                mock.patch("onadata.mirror.iter_form_submissions", return_value=iter([])):
+            call_command("sync_onadata", "--owner", "carol", "--form", "6", stdout=io.StringIO())
+        self.assertEqual(Form.objects.get(formid=6).owner, "carol")
+
+
+class AsyncRoutesTests(TestCase):
+
+    def test_client_is_closed_with_its_loop(self):
+        async def client():
+            return get_async_client()
+
+        # async_to_sync runs each call in a loop of its own, like async views under WSGI
+        first, second = async_to_sync(client)(), async_to_sync(client)()
+        self.assertIsNot(first, second)
+        self.assertTrue(first.client.is_closed)
+        self.assertTrue(second.client.is_closed)
+
+    def test_upstream_failure_mid_stream_aborts_the_stream(self):
+        async def records():
+            yield {"_id": 1}
+            raise httpx.ReadTimeout("upstream went away")
+
+        async def collect(chunks):
+            async for chunk in astream_records(records(), "json"):
+                chunks.append(chunk)
+
+        chunks = []
+        with self.assertRaises(httpx.ReadTimeout):
+            async_to_sync(collect)(chunks)
+        self.assertEqual(chunks, ["[", '{"_id": 1}'])
+
+    def test_refresh_outlives_the_request_loop(self):
+        cache_key = "tests:async-refresh"
+        cache.delete(cache_key)
+
+        async def fetch(validators):
+            await asyncio.sleep(0.05)
+            return [{"_id": 1}], 200, {}
+
+        async_to_sync(aschedule_refresh)(cache_key, fetch)
+        deadline = time.monotonic() + 5
+        while cache.get(cache_key) is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.get(cache_key)["data"], [{"_id": 1}])
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class BudgetedRetryTests(TestCase):
+
+    def setUp(self):
+        UnavailableHandler.hits = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), UnavailableHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def get(self, budget, total=3):
+        session = requests.Session()
+        retry = BudgetedRetry(total=total, status_forcelist=[503], backoff_factor=0, raise_on_status=False)
+        session.mount("http://", HTTPAdapter(max_retries=retry))
+        with mock.patch("onadata.retry.get_retry_budget", return_value=budget):
+            return session.get(self.url)
+
+    def test_each_retry_draws_on_the_budget(self):
+        budget = RetryBudget(ratio=0, minimum=10)
+        response = self.get(budget)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(UnavailableHandler.hits, 4)
+        self.assertEqual(budget.stats()["retries"], 3)
+
+    def test_spent_budget_returns_the_last_response(self):
+        budget = RetryBudget(ratio=0, minimum=1)
+        response = self.get(budget)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(UnavailableHandler.hits, 2)
+        self.assertEqual(budget.stats(), {"requests": 0, "retries": 1, "retries_denied": 1})
+
+    def test_exhausted_retry_takes_nothing_from_the_budget(self):
+        budget = RetryBudget(ratio=0, minimum=10)
+        retry = BudgetedRetry(total=0)
+        with mock.patch("onadata.retry.get_retry_budget", return_value=budget):
+            with self.assertRaises(MaxRetryError):
+                retry.increment("GET", "/", error=NewConnectionError(None, "refused"))
+        self.assertEqual(budget.stats()["retries"], 0)
+
+
+class HitTrackingTests(TestCase):
+
+    def test_member_keeps_only_the_cache_parameters(self):
+        params = QueryDict("page=2&utm_source=mail&filter=b&filter=a&fields=_id&_=1715000000")
+        self.assertEqual(hit_member("/api/onadata/form/1/", params), "/api/onadata/form/1/?fields=_id&filter=a&filter=b&page=2")
+        self.assertEqual(hit_member("/api/onadata/form/1/", QueryDict("nonce=1")), "/api/onadata/form/1/")
+
+    def test_hits_are_written_in_batches_and_capped(self):
+        bucket = int(time.time() // HIT_BUCKET)
+        get_redis().delete(hits_key(bucket), hits_key(bucket - 1))
+        counter = HitCounter(interval=3600)
+        for path in ["/a/"] * 3 + ["/b/"] * 2 + ["/c/"]:
+            counter.add(path)
+        self.assertEqual(hot_from_hits(10), {})
+
+        with mock.patch.dict(settings.ONADATA, {"WARM_HITS_MAX": 2}):
+            counter.flush(counter.counts)
+        self.assertEqual(hot_from_hits(10), {"/a/": 3, "/b/": 2})
+
+
+class ThresholdCompressorTests(TestCase):
+    payload = b'{"_id": 1, "name": "ada"}' * 100
+
+    def compressor(self, algorithm, **options):
+        try:
+            return ThresholdCompressor({"COMPRESS_ALGORITHM": algorithm, "COMPRESS_MIN_LENGTH": 64, **options})
+        except ImproperlyConfigured:
+            self.skipTest(f"{algorithm} is not installed")
+
+    def test_each_codec_round_trips_under_its_header(self):
+        for algorithm, (header, _, _) in CODECS.items():
+            with self.subTest(algorithm):
+                compressor = self.compressor(algorithm)
+                compressed = compressor.compress(self.payload)
+                self.assertEqual(compressed[:1], header)
+                self.assertLess(len(compressed), len(self.payload))
+                self.assertEqual(compressor.decompress(compressed), self.payload)
+
+    def test_values_up_to_the_threshold_are_stored_as_is(self):
+        compressor = self.compressor("zlib")
+        self.assertEqual(compressor.compress(self.payload[:64]), self.payload[:64])
+        self.assertNotEqual(compressor.compress(self.payload[:65]), self.payload[:65])
+
+    def test_values_without_a_header_are_left_to_django_redis(self):
+        compressor = self.compressor("zlib")
+        for value in (self.payload[:64], b"\x07" + self.payload, b""):
+            with self.assertRaises(CompressorError):
+                compressor.decompress(value)
+        # as does a known header over a corrupt body
+        with self.assertRaises(CompressorError):
+            compressor.decompress(ZLIB + b"not zlib")
+
+
+class TwoTierCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = caches["users"]
+        self.cache.clear()
+        self.client = self.cache.remote.client
+
+    def test_local_copy_is_sized_by_the_stored_bytes(self):
+        value = {"rows": list(range(100))}
+        self.cache.set("sized", value, timeout=30)
+        raw = self.client.get_client().get(self.client.make_key("sized"))
+        key = self.cache.make_and_validate_key("sized")
+        self.assertEqual(self.cache.local.entries[key][1], len(raw))
+
+        self.cache.local.clear()
+        self.assertEqual(self.cache.get("sized"), value)
+        self.assertEqual(self.cache.local.entries[key][1], len(raw))
+
+    def test_local_miss_reads_value_and_ttl_in_one_round_trip(self):
+        self.cache.set("ttl", "value", timeout=30)
+        self.cache.local.clear()
+
+        redis = self.client.get_client(write=False)
+        with mock.patch.object(type(redis), "execute_command", autospec=True,
+                               side_effect=AssertionError("unexpected Redis call")), \
+                mock.patch.object(self.client, "ttl", side_effect=AssertionError("separate TTL lookup")):
+            self.assertEqual(self.cache.get("ttl"), "value")
+
+        expires_at = self.cache.local.entries[self.cache.make_and_validate_key("ttl")][0]
+        self.assertAlmostEqual(expires_at - time.monotonic(), 30, delta=2)
+        self.assertIsNone(self.cache.get("missing"))
+
+    def test_has_key_ignores_expired_local_copies(self):
+        key = self.cache.make_and_validate_key("gone")
+        self.cache.local.set(key, "value", ttl=0.05)
+        self.assertTrue(self.cache.has_key("gone"))
+        time.sleep(0.1)
+        self.assertFalse(self.cache.has_key("gone"))
+
+    def test_counters_add_up_across_threads(self):
+        self.cache.set("counted", "value", timeout=30)
+        self.cache.local.clear()
+        before = self.cache.stats()
+
+        def read():
+            for _ in range(200):
+                self.cache.get("counted")
+                self.cache.get("absent")
 
-# Create your tests here.
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        after = self.cache.stats()
+        reads = sum(after[name] - before[name] for name in ("local_hits", "remote_misses", "remote_hits"))
+        self.assertEqual(reads, 1600)
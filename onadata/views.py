@@ -1,12 +1,97 @@
-from django.core.cache import cache
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.views import APIView
+import itertools
+import json
+import math
+
+from django.http import StreamingHttpResponse
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 import requests
 
-from accounts.services import LoggingAPIView, generate_cache_key
-from onadata.services import get_form_submissions, get_user_forms
+from accounts.services import LoggingAPIView
+from h4ev import settings
+from onadata.batch import fetch_many, owner_form_ids, valid_form_id
+from onadata.breaker import CircuitOpenError, get_breaker
+from onadata.cache import cache, cached_fetch, form_tag, invalidate_tags, owner_tag
+from onadata.client import get_client
+from onadata.retry import get_retry_budget
+from onadata.mirror import mirror_enabled, mirror_etag, mirrored_form, mirrored_forms, submission_values
+from onadata.services import (
+    fetch_form_submissions,
+    fetch_user_forms,
+    iter_form_submissions,
+    parse_submission_query,
+    project,
+    submission_cache_params,
+    submission_mongo_query,
+)
+from onadata.warmer import record_hit
+
+STREAM_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+def client_has(request, etag):
+    """Whether the request's If-None-Match already covers etag"""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in client_etags or "*" in client_etags
+
+
+def etag_response(request, data, etag):
+    """Return data tagged with etag, or an empty 304 if the client already has it"""
+    if client_has(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(data, status=status.HTTP_200_OK, headers={"ETag": etag})
+
+
+def upstream_error_response(body, error):
+    """502 for a failed Onadata call, 503 with Retry-After while the circuit breaker is open"""
+    if isinstance(error, CircuitOpenError):
+        return Response(
+            body,
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(math.ceil(error.retry_after))},
+        )
+    return Response(body, status=status.HTTP_502_BAD_GATEWAY)
+
+
+def projected(records, query):
+    """Apply a submission query's field projection to records lazily"""
+    fields = query.get("fields")
+    if not fields:
+        return records
+    return (project(record, fields) for record in records)
+
+
+def stream_ndjson(records):
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+
+def stream_json_array(records):
+    yield "["
+    for index, record in enumerate(records):
+        yield ("," if index else "") + json.dumps(record)
+    yield "]"
+
+
+def stream_records(records, stream_format):
+    """
+    Serialize records lazily. An upstream failure mid-stream is re-raised so
+    the server aborts the response: a truncated body must not end like a
+    complete one (a JSON array is never closed).
+    """
+    chunks = stream_ndjson(records) if stream_format == "ndjson" else stream_json_array(records)
+    try:
+        yield from chunks
+    except requests.exceptions.RequestException as e:
+        print(f"Error streaming form submissions: {e}")
+        raise
 
 
 class GetFormsByUsernameView(LoggingAPIView):
@@ -14,36 +99,36 @@ class GetFormsByUsernameView(LoggingAPIView):
 
     def get(self, request, username):
 
+        if mirror_enabled("prefer"):
+            data, etag = mirrored_forms(username)
+            if data:
+                return etag_response(request, data, etag)
+
+        record_hit(request.path, request.GET)
         # Parameters to be considered for cache busting
         url_params = request.GET.dict()
-        time_window = 60  # Cache busts every minute
-
-        # Generate a dynamic cache key based on username, user, and request params
-        cache_key = generate_cache_key(
-            user=request.user,
-            url_params=url_params,
-            time_window=time_window
-        )
-        cached_data = cache.get(cache_key)
-
-        if cached_data is not None:
-            return Response(cached_data, status=status.HTTP_200_OK)
 
         try:
-            data, status_code = get_user_forms(username)
-
-            if status_code == 200:
-                if len(data) == 0:
-                    return Response(f"error: no forms found for user {username}")
-                cache.set(cache_key, data, timeout=300)
-                return Response(data, status=status.HTTP_200_OK)
+            entry = cached_fetch(
+                "user_forms",
+                {"username": username},
+                url_params,
+                lambda validators: fetch_user_forms(username, validators, client=get_client()),
+                tags=[owner_tag(username)],
+            )
 
         except requests.exceptions.RequestException as e:
             print(f"Error fetching forms: {e}")
-            return Response(
-                {"error": "Failed to fetch forms"},
-                status=status.HTTP_502_BAD_GATEWAY
-            )
+            if mirror_enabled("fallback"):
+                data, etag = mirrored_forms(username)
+                if data:
+                    return etag_response(request, data, etag)
+            return upstream_error_response({"error": "Failed to fetch forms"}, e)
+
+        data = entry["data"]
+        if len(data) == 0:
+            return Response(f"error: no forms found for user {username}")
+        return etag_response(request, data, entry["etag"])
 
 
 class GetFormSubmissionsView(LoggingAPIView):
@@ -51,39 +136,228 @@ class GetFormSubmissionsView(LoggingAPIView):
 
     def get(self, request, form_id):
 
-        # Parameters to be considered for cache busting
-        url_params = request.GET.dict()
-        time_window = 60  # Cache busts every minute
+        try:
+            query = parse_submission_query(request.GET)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Generate a dynamic cache key based on username, user, and request params
-        cache_key = generate_cache_key(
-            user=request.user,
-            url_params=url_params,
-            time_window=time_window
-        )
-        cached_data = cache.get(cache_key)
+        form = mirrored_form(form_id) if mirror_enabled("prefer") else None
 
-        if cached_data is not None:
-            return Response(cached_data, status=status.HTTP_200_OK)
+        stream_format = request.GET.get("stream")
+        if stream_format in STREAM_CONTENT_TYPES:
+            if form is not None:
+                records = submission_values(form, query).iterator(chunk_size=2000)
+                return StreamingHttpResponse(
+                    stream_records(projected(records, query), stream_format),
+                    content_type=STREAM_CONTENT_TYPES[stream_format],
+                )
+            return self.stream(form_id, query, stream_format)
 
-        try:
-            data = get_form_submissions(form_id)
+        if form is not None:
+            return self.from_mirror(request, form, query)
 
-            if not data:
-                return Response(
-                    {"error": f"No submissions found for form {form_id}"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
+        record_hit(request.path, request.GET)
+        # one cache entry per distinct upstream query
+        url_params = submission_cache_params(query, request.GET)
 
-            cache.set(cache_key, data, timeout=300) # clear redis in 5 minutes
-            return Response(data, status=status.HTTP_200_OK)
+        try:
+            entry = cached_fetch(
+                "form_submissions",
+                {"form_id": form_id},
+                url_params,
+                lambda validators: fetch_form_submissions(
+                    form_id, validators, client=get_client(), query=query
+                ),
+                tags=[form_tag(form_id)],
+            )
 
         except requests.exceptions.RequestException as e:
             print(f"Error fetching form submissions: {e}")
+            form = mirrored_form(form_id) if mirror_enabled("fallback") else None
+            if form is not None:
+                return self.from_mirror(request, form, query)
+            return upstream_error_response(
+                {
+                    "error": "Failed to fetch form submissions",
+                    "error_description": f"External API returned {str(e)}"
+                },
+                e
+            )
+
+        data = entry["data"]
+        if not data:
             return Response(
+                {"error": f"No submissions found for form {form_id}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return etag_response(request, data, entry["etag"])
+
+    def from_mirror(self, request, form, query):
+        etag = mirror_etag(form, variant=request.GET.urlencode())
+        if client_has(request, etag):
+            # skip loading the submissions at all when the client is up to date
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        data = list(projected(submission_values(form, query), query))
+        if not data:
+            return Response(
+                {"error": f"No submissions found for form {form.formid}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return etag_response(request, data, etag)
+
+    def stream(self, form_id, query, stream_format):
+        """
+        Stream submissions page by page as NDJSON or a chunked JSON array.
+        Streamed responses bypass the cache so memory stays flat.
+        Filters and projection are pushed to Onadata; page/page_size are ignored.
+        """
+        records = iter_form_submissions(
+            form_id,
+            client=get_client(),
+            query=submission_mongo_query(query) or None,
+            fields=query.get("fields"),
+        )
+
+        try:
+            # fetch the first page up front so upstream errors still map to a status code
+            first = next(records, None)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching form submissions: {e}")
+            return upstream_error_response(
                 {
                     "error": "Failed to fetch form submissions",
                     "error_description": f"External API returned {str(e)}"
                 },
-                status=status.HTTP_502_BAD_GATEWAY
+                e
+            )
+
+        if first is None:
+            return Response(
+                {"error": f"No submissions found for form {form_id}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return StreamingHttpResponse(
+            stream_records(itertools.chain([first], records), stream_format),
+            content_type=STREAM_CONTENT_TYPES[stream_format],
+        )
+
+
+class BatchFormSubmissionsView(LoggingAPIView):
+    """
+    Submissions of many forms in one call, fetched concurrently.
+
+    POST {"form_ids": [...]} or {"username": "<owner>"}; the submission
+    query parameters (fields, filter, submitted_after/before, page) apply to
+    every form. Each form reports its own status so one failing form does
+    not fail the batch.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+
+        try:
+            query = parse_submission_query(request.GET)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not isinstance(request.data, dict):
+            return Response({"error": "expected a JSON object"}, status=status.HTTP_400_BAD_REQUEST)
+        form_ids = request.data.get("form_ids")
+        username = request.data.get("username")
+        if not form_ids and not username:
+            return Response(
+                {"error": "provide a list of form_ids or an owner username"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if form_ids and not isinstance(form_ids, list):
+            return Response({"error": "form_ids must be a list"}, status=status.HTTP_400_BAD_REQUEST)
+        if username and not isinstance(username, str):
+            return Response({"error": "username must be a string"}, status=status.HTTP_400_BAD_REQUEST)
+        if form_ids and len(form_ids) > settings.ONADATA["BATCH_MAX_FORMS"]:
+            return Response(
+                {"error": f"at most {settings.ONADATA['BATCH_MAX_FORMS']} forms per batch"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if form_ids and not all(valid_form_id(form_id) for form_id in form_ids):
+            return Response({"error": "form_ids must be numeric form ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not form_ids:
+            try:
+                form_ids = owner_form_ids(username)
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching forms: {e}")
+                return upstream_error_response({"error": "Failed to fetch forms"}, e)
+
+        # same order, no duplicates
+        form_ids = list(dict.fromkeys(str(form_id) for form_id in form_ids))
+        if len(form_ids) > settings.ONADATA["BATCH_MAX_FORMS"]:
+            return Response(
+                {"error": f"at most {settings.ONADATA['BATCH_MAX_FORMS']} forms per batch"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # the same cache keys as GetFormSubmissionsView, so entries are shared with it
+        url_params = submission_cache_params(query, request.GET)
+        results = fetch_many(form_ids, query, url_params)
+
+        failed = sum(1 for result in results if result["status"] != 200)
+        return Response(
+            {
+                "forms": len(results),
+                "succeeded": len(results) - failed,
+                "failed": failed,
+                "results": results,
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class OnadataClientStatsView(LoggingAPIView):
+    """Connection pool, retry and circuit breaker counters for this worker's Onadata client"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        stats = {
+            **get_client().pool_stats(),
+            "retries": get_retry_budget().stats(),
+            "breaker": get_breaker().stats(),
+        }
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class OnadataCacheStatsView(LoggingAPIView):
+    """Hit/miss counters for the local and Redis cache tiers in this worker"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        stats = getattr(cache, "stats", None)
+        if stats is None:
+            return Response({"error": "local cache tier is not enabled"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(stats(), status=status.HTTP_200_OK)
+
+
+class InvalidateOnadataCacheView(LoggingAPIView):
+    """Drop cached Onadata responses for the given forms and owners"""
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            return Response({"error": "expected a JSON object"}, status=status.HTTP_400_BAD_REQUEST)
+        form_ids = request.data.get("forms") or []
+        usernames = request.data.get("owners") or []
+        if not form_ids and not usernames:
+            return Response(
+                {"error": "provide a list of forms and/or owners to invalidate"},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        if not isinstance(form_ids, list) or not all(valid_form_id(form_id) for form_id in form_ids):
+            return Response({"error": "forms must be a list of numeric form ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(usernames, list) or not all(isinstance(username, str) and username for username in usernames):
+            return Response({"error": "owners must be a list of usernames"}, status=status.HTTP_400_BAD_REQUEST)
+
+        tags = [form_tag(form_id) for form_id in form_ids] + [owner_tag(username) for username in usernames]
+        deleted = invalidate_tags(tags)
+        return Response({"invalidated": deleted}, status=status.HTTP_200_OK)
@@ -0,0 +1,249 @@
+"""
+Cache pre-warming for the most requested forms and owners.
+
+Hot requests are learned from hourly Redis sorted sets of the requests to
+the Onadata views (record_hit counts them in memory and flushes the
+counts every WARM_HIT_FLUSH_INTERVAL seconds), or from the request log
+store (accounts/logstore.py). Each pass refreshes the cache entries of the top
+requests that are missing or about to expire, on a bounded thread pool
+and under a rate limit so warming stays within Onadata's quotas.
+
+WARMERS maps URL names to the function that rebuilds the same cache entry
+as the view; register new cached routes there.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from django.http import QueryDict
+from django.urls import Resolver404, get_resolver, resolve
+from redis.exceptions import RedisError
+
+from h4ev import settings
+from h4ev.process import per_process
+from onadata.cache import cache, form_tag, get_redis, owner_tag, release_lock, warm
+from onadata.client import get_client
+from onadata.services import (
+    fetch_form_submissions,
+    fetch_user_forms,
+    parse_submission_query,
+    submission_cache_params,
+)
+
+HIT_BUCKET = 3600
+# the query parameters that select a cache entry (parse_submission_query); others are left out of hits
+HIT_PARAMS = ("fields", "filter", "submitted_after", "submitted_before", "page", "page_size")
+
+
+def hits_key(bucket):
+    return f"onadata:hits:{bucket}"
+
+
+def hit_member(path, params) -> str:
+    """path plus its HIT_PARAMS in a fixed order, so one cache entry is counted under one name"""
+    query = QueryDict(mutable=True)
+    for name in HIT_PARAMS:
+        values = sorted(value for value in params.getlist(name) if value)
+        if values:
+            query.setlist(name, values)
+    return f"{path}?{query.urlencode()}" if query else path
+
+
+class HitCounter:
+    """Per-process hit counts, written to the hourly sorted set in one pipeline per flush"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.next_flush = time.monotonic() + interval
+
+    def add(self, member):
+        with self.lock:
+            self.counts[member] += 1
+            now = time.monotonic()
+            if now < self.next_flush:
+                return
+            counts, self.counts = self.counts, Counter()
+            self.next_flush = now + self.interval
+        # off the request thread: the only Redis round trip of hit tracking
+        threading.Thread(target=self.flush, args=(counts,), name="onadata-hits", daemon=True).start()
+
+    def flush(self, counts):
+        redis = get_redis()
+        if redis is None or not counts:
+            return
+        key = hits_key(int(time.time() // HIT_BUCKET))
+        try:
+            pipe = redis.pipeline(transaction=False)
+            for member, count in counts.items():
+                pipe.zincrby(key, count, member)
+            # keep only the most requested members so the set stays bounded
+            pipe.zremrangebyrank(key, 0, -settings.ONADATA["WARM_HITS_MAX"] - 1)
+            pipe.expire(key, HIT_BUCKET * 2, nx=True)
+            pipe.execute()
+        except RedisError as e:
+            print(f"Error recording cache hits: {e}")
+
+
+@per_process
+def get_hit_counter() -> HitCounter:
+    """This process's hit counter"""
+    return HitCounter(settings.ONADATA["WARM_HIT_FLUSH_INTERVAL"])
+
+
+def record_hit(path, params):
+    """Count a request to a cached Onadata route (path and its QueryDict of parameters)"""
+    if not settings.ONADATA["WARM_TRACK_HITS"]:
+        return
+    get_hit_counter().add(hit_member(path, params))
+
+
+def hot_from_hits(limit) -> Counter:
+    """Hit counts over the current and previous hourly buckets"""
+    redis = get_redis()
+    if redis is None:
+        return Counter()
+    bucket = int(time.time() // HIT_BUCKET)
+    hits = Counter()
+    for key in (hits_key(bucket), hits_key(bucket - 1)):
+        for member, score in redis.zrevrange(key, 0, limit - 1, withscores=True):
+            hits[member.decode()] += score
+    return hits
+
+
+def hot_from_logs(limit, since_hours) -> Counter:
+    from accounts.logstore import ingest, top_requests
+
+    ingest()
+    # URL patterns of the warmable routes, as the log store records them
+    routes = sorted(
+        str(pattern.pattern) for pattern in get_resolver().url_patterns
+        if getattr(pattern, "name", None) in WARMERS
+    )
+    return Counter(dict(top_requests(time.time() - since_hours * 3600, routes, limit)))
+
+
+def hot_paths(source="hits", limit=50, since_hours=1) -> list:
+    """The limit most requested full paths from "hits", "logs" or "both" """
+    hits = Counter()
+    if source in ("hits", "both"):
+        hits.update(hot_from_hits(limit))
+    if source in ("logs", "both"):
+        hits.update(hot_from_logs(limit, since_hours))
+    return [path for path, _ in hits.most_common(limit)]
+
+
+def warm_user_forms(kwargs, params, lead, limiter):
+    username = kwargs["username"]
+    return warm(
+        "user_forms",
+        {"username": username},
+        params.dict(),
+        limiter.wrap(lambda validators: fetch_user_forms(username, validators, client=get_client())),
+        tags=[owner_tag(username)],
+        lead=lead,
+    )
+
+
+def warm_form_submissions(kwargs, params, lead, limiter):
+    form_id = kwargs["form_id"]
+    if "stream" in params:
+        # streamed responses are never cached
+        return "skipped"
+    try:
+        query = parse_submission_query(params)
+    except ValueError:
+        return "skipped"
+    return warm(
+        "form_submissions",
+        {"form_id": form_id},
+        submission_cache_params(query, params),
+        limiter.wrap(lambda validators: fetch_form_submissions(
+            form_id, validators, client=get_client(), query=query
+        )),
+        tags=[form_tag(form_id)],
+        lead=lead,
+    )
+
+
+# URL name -> function rebuilding the view's cache entry; sync and async routes share entries
+WARMERS = {
+    "get_forms_by_username": warm_user_forms,
+    "async_get_forms_by_username": warm_user_forms,
+    "get_form_submissions": warm_form_submissions,
+    "async_get_form_submissions": warm_form_submissions,
+}
+
+
+class RateLimiter:
+    """Token bucket shared by the warming threads: at most rate upstream fetches per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def wrap(self, fetch):
+        def limited(validators):
+            self.acquire()
+            return fetch(validators)
+        return limited
+
+
+def warm_path(full_path, lead, limiter) -> str:
+    path, _, query_string = full_path.partition("?")
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return "skipped"
+    warmer = WARMERS.get(match.url_name)
+    if warmer is None:
+        return "skipped"
+    try:
+        return warmer(match.kwargs, QueryDict(query_string), lead, limiter)
+    except Exception as e:
+        print(f"Error warming {full_path}: {e}")
+        return "failed"
+    finally:
+        close_old_connections()
+
+
+def warm_hot(source=None, limit=None, since_hours=1, lead=None, concurrency=None, rate=None) -> Counter:
+    """
+    One warming pass over the hottest requests. Only one warmer runs a pass
+    at a time across all processes when the cache is Redis.
+    Returns how many paths ended "fresh", "warmed", "busy", "failed" or "skipped".
+    """
+    config = settings.ONADATA
+    lead = config["WARM_LEAD"] if lead is None else lead
+    limiter = RateLimiter(rate or config["WARM_RATE"])
+
+    leader = cache.lock("lock:onadata-warmer", timeout=config["WARM_INTERVAL"] * 2) if hasattr(cache, "lock") else None
+    if leader is not None and not leader.acquire(blocking=False):
+        return Counter({"not_leader": 1})
+
+    try:
+        paths = hot_paths(source or config["WARM_SOURCE"], limit or config["WARM_TOP"], since_hours)
+        with ThreadPoolExecutor(max_workers=concurrency or config["WARM_CONCURRENCY"],
+                                thread_name_prefix="onadata-warm") as pool:
+            results = list(pool.map(lambda path: warm_path(path, lead, limiter), paths))
+    finally:
+        if leader is not None:
+            release_lock(leader)
+    return Counter(results)